@@ -0,0 +1,370 @@
+"""Command line maintenance of Electricity Consumption Tracker databases (runs without Home Assistant).
+
+    cd /config/custom_components
+    python -m electricity_consumption_tracker stats /config/electricity_consumption_tracker
+    python -m electricity_consumption_tracker verify --dry-run /backup/electricity_consumption_tracker
+    python -m electricity_consumption_tracker rebuild --full electricity_data_abc.db
+    python -m electricity_consumption_tracker bench --repeat 200 electricity_data_abc.db
+    python -m electricity_consumption_tracker scale --workers 4 /config/electricity_consumption_tracker
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+from .const import (
+    TARIFF_TYPES,
+    CONF_TARIFF_TYPE, CONF_FIXED_PRICE, CONF_TOU_PEAK_SHARE, CONF_TOU_OFFPEAK_SHARE
+)
+from .db import connect_db, init_db, sync_billing_config_db, day_bounds
+from .billing import perform_db_calculation, _calculate_months, rebuild_history, verify_db
+from .cache import OpenPeriodCache
+from .columnar import EntryColumns
+from .export import snapshot_db
+from .rebuild import RebuildScheduler
+from .tariff import build_tariff, load_tariff_file, apply_tariff_tables
+
+DB_GLOB = "electricity_data_*.db"
+# Giống mặc định của config entry
+DEFAULT_BILLING_DAY = 1
+DEFAULT_APPLY_DATE = "2024-01-01"
+BENCH_REPEAT = 100
+SCALE_REPEAT = 3
+
+
+def _expand_paths(paths):
+    """File .db giữ nguyên, thư mục -> mọi electricity_data_*.db bên trong."""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(glob.glob(os.path.join(path, DB_GLOB))))
+        else:
+            result.append(path)
+    return result
+
+
+def _stored_config(db_path):
+    """(billing_day, apply_date, options bảng giá) trong billing_config; DB chưa migrate thì (None, None, None)."""
+    conn = connect_db(db_path, read_only=True)
+    try:
+        row = conn.execute("SELECT billing_day, apply_date, tariff FROM billing_config WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        # Bảng/cột chưa có (DB của bản cũ): dùng tham số dòng lệnh hoặc mặc định
+        row = None
+    finally:
+        conn.close()
+    if row is None: return None, None, None
+    return row[0], row[1], json.loads(row[2]) if row[2] else None
+
+
+def _billing_config(db_path, args):
+    """Ngày chốt số/ngày áp dụng: tham số dòng lệnh, nếu không có thì lấy từ billing_config của DB."""
+    billing_day, apply_date = args.billing_day, args.apply_date
+    if billing_day is None or apply_date is None:
+        stored_day, stored_date, _tariff_options = _stored_config(db_path)
+        billing_day = stored_day if billing_day is None else billing_day
+        apply_date = stored_date if apply_date is None else apply_date
+    return (billing_day if billing_day is not None else DEFAULT_BILLING_DAY,
+            apply_date or DEFAULT_APPLY_DATE)
+
+
+def _tariff(db_path, args):
+    """Bảng giá: --tariff nếu có, ngược lại bảng giá của entry lưu trong billing_config (DB cũ chưa lưu: sinh hoạt).
+
+    --fixed-price/--tou-*-share ghi đè tham số tương ứng trong cả hai trường hợp.
+    """
+    options = {}
+    if args.tariff is None:
+        options = _stored_config(db_path)[2] or {}
+    cli = {
+        CONF_TARIFF_TYPE: args.tariff, CONF_FIXED_PRICE: args.fixed_price,
+        CONF_TOU_PEAK_SHARE: args.tou_peak_share, CONF_TOU_OFFPEAK_SHARE: args.tou_offpeak_share,
+    }
+    options.update({k: v for k, v in cli.items() if v is not None})
+    return build_tariff(options)
+
+
+def _worker_init(tariff_file):
+    # Mỗi tiến trình con tự nạp bảng giá (không phụ thuộc fork/spawn)
+    if tariff_file: apply_tariff_tables(load_tariff_file(tariff_file))
+
+
+# --- LỆNH (chạy trong tiến trình con, mỗi lệnh một file) ---
+
+def cmd_rebuild(db_path, args):
+    init_db(db_path)
+    billing_day, apply_date = _billing_config(db_path, args)
+    start = time.perf_counter()
+    periods = rebuild_history(db_path, billing_day, apply_date, _tariff(db_path, args), full=args.full)
+    return {"periods": periods, "billing_day": billing_day, "apply_date": apply_date,
+            "seconds": round(time.perf_counter() - start, 3)}
+
+
+def _verify(db_path, args):
+    init_db(db_path)
+    billing_day, apply_date = _billing_config(db_path, args)
+    # Điền kỳ (ky_nam, ky_thang) cho DB cũ như khi Home Assistant setup, giữ nguyên bảng giá đã lưu
+    sync_billing_config_db(db_path, billing_day, apply_date)
+    return verify_db(db_path, billing_day, apply_date, _tariff(db_path, args))
+
+
+def cmd_verify(db_path, args):
+    if not args.dry_run:
+        return _verify(db_path, args)
+    # Chỉ báo cáo: kiểm tra trên bản chụp, file gốc không bị ghi
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, os.path.basename(db_path))
+        snapshot_db(db_path, copy)
+        return _verify(copy, args)
+
+
+def _has_table(cursor, name):
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def cmd_stats(db_path, args):
+    # Chỉ đọc (mode=ro): không migrate/đổi journal của file đang được Home Assistant dùng.
+    # DB của bản cũ có thể chưa có daily_archive/hourly_usage: tính là 0.
+    billing_day, apply_date = _billing_config(db_path, args)
+    conn = connect_db(db_path, read_only=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), MIN(printf('%04d-%02d-%02d', nam, thang, ngay)),
+                   MAX(printf('%04d-%02d-%02d', nam, thang, ngay))
+            FROM daily_usage
+        """)
+        days, first, last = cursor.fetchone()
+        archived_years, archived_days = 0, 0
+        if _has_table(cursor, "daily_archive"):
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(so_ngay_co_du_lieu), 0) FROM daily_archive")
+            archived_years, archived_days = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) FROM monthly_bill")
+        periods = cursor.fetchone()[0]
+        hourly_rows = 0
+        if _has_table(cursor, "hourly_usage"):
+            cursor.execute("SELECT COUNT(*) FROM hourly_usage")
+            hourly_rows = cursor.fetchone()[0]
+        cursor.execute("SELECT tong_san_luong, tong_tien_tich_luy, tong_tien_tich_luy_sau_thue FROM total_usage")
+        total = cursor.fetchone() or (0, 0, 0)
+        page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+        pages = cursor.execute("PRAGMA page_count").fetchone()[0]
+        free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    wal = db_path + "-wal"
+    return {
+        "billing_day": billing_day, "apply_date": apply_date,
+        "days": days, "first_day": first, "last_day": last,
+        "archived_years": archived_years, "archived_days": archived_days,
+        "periods": periods, "hourly_rows": hourly_rows,
+        "kwh": round(total[0] or 0, 2), "cost": total[1] or 0, "cost_after_tax": total[2] or 0,
+        "file_bytes": os.path.getsize(db_path),
+        "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+        "free_bytes": free * page_size, "pages": pages,
+    }
+
+
+def _timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    return round((time.perf_counter() - start) / repeat * 1000, 3)
+
+
+def cmd_bench(db_path, args):
+    """Đo các đường nóng trên bản chụp của DB (ms/lần)."""
+    repeat = args.repeat
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, os.path.basename(db_path))
+        snapshot_db(db_path, copy)
+        init_db(copy)
+        billing_day, apply_date_str = _billing_config(copy, args)
+        apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+        tariff = _tariff(copy, args)
+        conn = connect_db(copy)
+        try:
+            cursor = conn.cursor()
+            today = day_bounds(cursor)[1]
+            if today is None:
+                return {"skipped": "không có dữ liệu"}
+            cursor.execute("SELECT san_luong FROM daily_values WHERE nam=? AND thang=? AND ngay=?",
+                           (today.year, today.month, today.day))
+            val = cursor.fetchone()[0] or 0.0
+            old = today - timedelta(days=400)
+
+            cache = OpenPeriodCache(billing_day, apply_date, tariff)
+            cache.load(cursor, today)
+            conn.commit()
+
+            def tick_cached():
+                perform_db_calculation(cursor, today.year, today.month, today.day, val, billing_day, apply_date_str, cache, tariff)
+                conn.commit()
+
+            def tick_sql():
+                perform_db_calculation(cursor, today.year, today.month, today.day, val, billing_day, apply_date_str, None, tariff)
+                conn.commit()
+
+            def override_old():
+                perform_db_calculation(cursor, old.year, old.month, old.day, 1.0, billing_day, apply_date_str, cache, tariff)
+                conn.commit()
+
+            cursor.execute("SELECT DISTINCT ky_nam, ky_thang FROM daily_values ORDER BY ky_nam, ky_thang")
+            months = [(r[0], r[1]) for r in cursor.fetchall()]
+
+            def all_months():
+                _calculate_months(cursor, months, billing_day, apply_date, tariff)
+                conn.rollback()
+
+            result = {
+                "days": cursor.execute("SELECT COUNT(*) FROM daily_values").fetchone()[0],
+                "tick_cached_ms": _timed(tick_cached, repeat),
+                "tick_sql_ms": _timed(tick_sql, repeat),
+                "override_old_ms": _timed(override_old, max(repeat // 10, 1)),
+                "calculate_all_months_ms": _timed(all_months, max(repeat // 50, 1)),
+            }
+        finally:
+            conn.close()
+
+        columns = EntryColumns(copy)
+        result["columns_refresh_ms"] = _timed(columns.refresh, max(repeat // 10, 1))
+        result["verify_ms"] = _timed(lambda: verify_db(copy, billing_day, apply_date_str, tariff), max(repeat // 50, 1))
+        result["rebuild_full_ms"] = _timed(
+            lambda: rebuild_history(copy, billing_day, apply_date_str, tariff, full=True), max(repeat // 50, 1))
+    return result
+
+
+COMMANDS = {"rebuild": cmd_rebuild, "verify": cmd_verify, "stats": cmd_stats, "bench": cmd_bench}
+
+
+def bench_scale(paths, args):
+    """Rebuild toàn bộ bản chụp của mọi DB qua RebuildScheduler với 1, 2, 4... đến --workers luồng.
+
+    Mỗi mức lấy lần nhanh nhất trong --repeat lần; speedup = thời gian 1 luồng / thời gian n luồng.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = []
+        for i, path in enumerate(paths):
+            copy = os.path.join(tmp, f"{i}_{os.path.basename(path)}")
+            snapshot_db(path, copy)
+            init_db(copy)
+            jobs.append((copy,) + _billing_config(copy, args) + (_tariff(copy, args),))
+
+        def run(workers):
+            scheduler = RebuildScheduler(max_workers=workers)
+            start = time.perf_counter()
+            tasks = [scheduler.submit(copy, "bench", rebuild_history, copy, billing_day, apply_date, tariff, True)
+                     for copy, billing_day, apply_date, tariff in jobs]
+            for task in tasks: task.future.result()
+            elapsed = time.perf_counter() - start
+            scheduler.shutdown()
+            return elapsed
+
+        run(1)  # làm nóng page cache
+        counts = [1]
+        while counts[-1] < args.workers: counts.append(min(counts[-1] * 2, args.workers))
+        result = {"entries": len(jobs)}
+        base = None
+        for workers in counts:
+            seconds = min(run(workers) for _ in range(max(args.repeat, 1)))
+            base = base or seconds
+            result[f"workers_{workers}"] = {
+                "seconds": round(seconds, 3), "speedup": round(base / seconds, 2),
+                "efficiency": round(base / seconds / workers, 2),
+            }
+    return result
+
+
+def _run(command, db_path, args):
+    try:
+        return db_path, COMMANDS[command](db_path, args), None
+    except Exception as e:
+        return db_path, None, f"{type(e).__name__}: {e}"
+
+
+def _print_result(db_path, result, error, as_json):
+    if as_json:
+        print(json.dumps({"db": db_path, "result": result, "error": error}, ensure_ascii=False, default=str))
+    elif error:
+        print(f"{db_path}: LỖI {error}")
+    else:
+        print(f"{db_path}:")
+        for key, value in result.items():
+            print(f"  {key}: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m electricity_consumption_tracker",
+        description="Bảo trì các file electricity_data_*.db ngoài Home Assistant.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    helps = {
+        "rebuild": "tính lại monthly/yearly/total từ daily_usage",
+        "verify": "kiểm tra checksum các kỳ và sửa chỗ lệch",
+        "stats": "thống kê số ngày, số kỳ, tổng và dung lượng",
+        "bench": "đo thời gian các đường nóng trên bản chụp",
+        "scale": "đo tốc độ rebuild song song của nhiều DB theo số luồng",
+    }
+    for name, text in helps.items():
+        p = sub.add_parser(name, help=text)
+        p.add_argument("paths", nargs="+", help="file .db hoặc thư mục chứa electricity_data_*.db")
+        p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="số tiến trình song song")
+        p.add_argument("--json", action="store_true", help="in mỗi file một dòng JSON")
+        p.add_argument("--billing-day", type=int, help="ngày chốt số (mặc định: theo billing_config của DB)")
+        p.add_argument("--apply-date", help="ngày áp dụng YYYY-MM-DD (mặc định: theo billing_config của DB)")
+        p.add_argument("--tariff", choices=TARIFF_TYPES, help="loại bảng giá (mặc định: theo billing_config của DB)")
+        p.add_argument("--fixed-price", type=float)
+        p.add_argument("--tou-peak-share", type=float)
+        p.add_argument("--tou-offpeak-share", type=float)
+        p.add_argument("--tariff-file", help="tariffs.json/tariffs.yaml thay cho bảng giá có sẵn")
+    sub.choices["rebuild"].add_argument("--full", action="store_true", help="tính lại toàn bộ lịch sử")
+    sub.choices["verify"].add_argument("--dry-run", action="store_true", help="chỉ báo cáo, không ghi vào file gốc")
+    sub.choices["bench"].add_argument("--repeat", type=int, default=BENCH_REPEAT, help="số lần lặp mỗi phép đo")
+    sub.choices["scale"].add_argument("--repeat", type=int, default=SCALE_REPEAT, help="số lần chạy mỗi mức luồng")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    paths = _expand_paths(args.paths)
+    if not paths:
+        print("Không tìm thấy file DB nào", file=sys.stderr)
+        return 2
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        print(f"Không tìm thấy: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    _worker_init(args.tariff_file)
+    if args.command == "scale":
+        # Một phép đo cho cả nhóm file (chạy trong tiến trình chính, pool luồng như trong Home Assistant)
+        try:
+            result, error = bench_scale(paths, args), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        _print_result(", ".join(paths), result, error, args.json)
+        return 1 if error else 0
+
+    failed = 0
+    workers = max(1, min(args.workers, len(paths)))
+    if workers == 1:
+        results = (_run(args.command, p, args) for p in paths)
+        for db_path, result, error in results:
+            failed += error is not None
+            _print_result(db_path, result, error, args.json)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, initargs=(args.tariff_file,)) as pool:
+            for db_path, result, error in pool.map(_run, [args.command] * len(paths), paths, [args] * len(paths)):
+                failed += error is not None
+                _print_result(db_path, result, error, args.json)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
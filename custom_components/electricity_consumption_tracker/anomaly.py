@@ -0,0 +1,183 @@
+"""Daily consumption anomaly detection for the Electricity Consumption Tracker integration."""
+import math
+from datetime import date, timedelta
+
+# Cửa sổ thống kê: các ngày đã hoàn tất trong ANOMALY_WINDOW_WEEKS tuần trước ngày mốc
+ANOMALY_WINDOW_WEEKS = 8
+ANOMALY_WINDOW_DAYS = ANOMALY_WINDOW_WEEKS * 7
+# Cần ít nhất chừng này mẫu cùng thứ mới đánh giá
+ANOMALY_MIN_SAMPLES = 4
+ANOMALY_Z = 3.0
+# Độ lệch chuẩn tối thiểu (kWh và tỷ lệ so với trung bình), tránh báo động khi các tuần gần như bằng nhau
+ANOMALY_MIN_STD_KWH = 0.5
+ANOMALY_MIN_STD_RATIO = 0.1
+# Cùng ngày năm trước (52 tuần, cùng thứ) cũng lệch ít nhất chừng này mới tính là bất thường
+ANOMALY_YOY_RATIO = 0.5
+
+_YEAR_AGO = timedelta(days=364)
+
+
+def _add(stat, x):
+    n, mean, m2 = stat
+    n += 1
+    delta = x - mean
+    mean += delta / n
+    return n, mean, m2 + delta * (x - mean)
+
+
+def _remove(stat, x):
+    n, mean, m2 = stat
+    if n <= 1: return 0, 0.0, 0.0
+    n -= 1
+    delta = x - mean
+    mean -= delta / n
+    return n, mean, max(m2 - delta * (x - mean), 0.0)
+
+
+def _day_value(cursor, d):
+    cursor.execute("SELECT san_luong FROM daily_values WHERE nam=? AND thang=? AND ngay=?", (d.year, d.month, d.day))
+    row = cursor.fetchone()
+    return (row[0] or 0.0) if row else None
+
+
+def _load(cursor):
+    cursor.execute("SELECT ngay_moc FROM anomaly_state WHERE id = 1")
+    row = cursor.fetchone()
+    anchor = date.fromisoformat(row[0]) if row and row[0] else None
+    cursor.execute("SELECT thu, so_mau, trung_binh, m2 FROM weekday_stats")
+    stats = {thu: (0, 0.0, 0.0) for thu in range(7)}
+    stats.update({r[0]: (r[1], r[2], r[3]) for r in cursor.fetchall()})
+    return anchor, stats
+
+
+def _save(cursor, anchor, stats, result=None):
+    cursor.executemany("INSERT OR REPLACE INTO weekday_stats (thu, so_mau, trung_binh, m2) VALUES (?, ?, ?, ?)",
+                       [(thu, *stat) for thu, stat in stats.items()])
+    cursor.execute("INSERT OR IGNORE INTO anomaly_state (id) VALUES (1)")
+    cursor.execute("UPDATE anomaly_state SET ngay_moc = ? WHERE id = 1", (anchor.isoformat(),))
+    if result is None: return
+    # Trạng thái chỉ giữ ngày đánh giá mới nhất (sửa một ngày cũ vẫn phát sự kiện nhưng không đè trạng thái)
+    cursor.execute("""
+        UPDATE anomaly_state
+        SET ngay = ?, san_luong = ?, trung_binh = ?, do_lech_chuan = ?, so_mau = ?, z = ?, nam_truoc = ?, bat_thuong = ?
+        WHERE id = 1 AND (ngay IS NULL OR ngay <= ?)
+    """, (result["ngay"], result["san_luong"], result["trung_binh"], result["do_lech_chuan"], result["so_mau"],
+          result["z"], result["nam_truoc"], int(result["bat_thuong"]), result["ngay"]))
+
+
+def _window_stats(cursor, anchor):
+    """Dựng lại thống kê từ các ngày trong [anchor - cửa sổ, anchor) (1 câu SQL)."""
+    start = anchor - timedelta(days=ANOMALY_WINDOW_DAYS)
+    cursor.execute("""
+        SELECT nam, thang, ngay, san_luong FROM daily_values
+        WHERE (nam, thang, ngay) >= (?, ?, ?) AND (nam, thang, ngay) < (?, ?, ?) AND nam BETWEEN ? AND ?
+    """, (start.year, start.month, start.day, anchor.year, anchor.month, anchor.day, start.year, anchor.year))
+    stats = {thu: (0, 0.0, 0.0) for thu in range(7)}
+    for r in cursor.fetchall():
+        thu = date(r[0], r[1], r[2]).weekday()
+        stats[thu] = _add(stats[thu], r[3] or 0.0)
+    return stats
+
+
+def _evaluate(cursor, stats, d, val):
+    n, mean, m2 = stats[d.weekday()]
+    std = math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+    scale = max(std, ANOMALY_MIN_STD_KWH, abs(mean) * ANOMALY_MIN_STD_RATIO)
+    z = (val - mean) / scale if n >= ANOMALY_MIN_SAMPLES else None
+    last_year = _day_value(cursor, d - _YEAR_AGO)
+    yoy = (val - last_year) / last_year if last_year else None
+    return {
+        "ngay": d.isoformat(),
+        "san_luong": val,
+        "trung_binh": mean,
+        "do_lech_chuan": std,
+        "so_mau": n,
+        "z": z,
+        "nam_truoc": last_year,
+        "chenh_lech_nam_truoc": yoy,
+        "bat_thuong": z is not None and abs(z) >= ANOMALY_Z and (yoy is None or abs(yoy) >= ANOMALY_YOY_RATIO),
+    }
+
+
+def update_anomaly_stats(cursor, d, val):
+    """Cập nhật thống kê khi ngày d sắp được ghi giá trị val (gọi TRƯỚC khi ghi daily_usage).
+
+    Ngày mốc là ngày mới nhất đã ghi (hôm nay, còn đang tăng nên không đưa vào thống kê).
+    - d = mốc: không đổi gì.
+    - d > mốc: mốc cũ đã hoàn tất -> đánh giá rồi cộng vào, bỏ các ngày trượt ra khỏi cửa sổ.
+    - d < mốc, trong cửa sổ (override): bỏ giá trị cũ, đánh giá, cộng giá trị mới.
+    Mỗi lần ghi chỉ tốn vài truy vấn theo khóa chính, không quét lại lịch sử.
+    Trả về kết quả đánh giá (dict) hoặc None.
+    """
+    anchor, stats = _load(cursor)
+    result = None
+
+    if anchor is None:
+        # DB cũ / mới: dựng cửa sổ một lần
+        stats = _window_stats(cursor, d)
+        anchor = d
+    elif d == anchor:
+        return None
+    elif d > anchor:
+        old_val = _day_value(cursor, anchor)
+        if old_val is not None:
+            result = _evaluate(cursor, stats, anchor, old_val)
+        if (d - anchor).days > ANOMALY_WINDOW_DAYS:
+            stats = _window_stats(cursor, d)
+        else:
+            x = anchor
+            while x < d:
+                v = old_val if x == anchor else _day_value(cursor, x)
+                if v is not None: stats[x.weekday()] = _add(stats[x.weekday()], v)
+                x += timedelta(days=1)
+            x = anchor - timedelta(days=ANOMALY_WINDOW_DAYS)
+            while x < d - timedelta(days=ANOMALY_WINDOW_DAYS):
+                v = _day_value(cursor, x)
+                if v is not None: stats[x.weekday()] = _remove(stats[x.weekday()], v)
+                x += timedelta(days=1)
+        anchor = d
+    elif d >= anchor - timedelta(days=ANOMALY_WINDOW_DAYS):
+        thu = d.weekday()
+        old_val = _day_value(cursor, d)
+        if old_val is not None: stats[thu] = _remove(stats[thu], old_val)
+        result = _evaluate(cursor, stats, d, val)
+        stats[thu] = _add(stats[thu], val)
+    else:
+        return None
+
+    _save(cursor, anchor, stats, result)
+    return result
+
+
+def refresh_anomaly_stats(cursor, days):
+    """Sau khi ghi/xóa nhiều ngày cùng lúc: dựng lại cửa sổ nếu có ngày rơi vào cửa sổ hoặc mới hơn mốc.
+
+    Nếu mốc tiến lên thì mốc cũ đã hoàn tất và được đánh giá (chỉ cập nhật trạng thái, không trả về sự kiện).
+    """
+    if not days: return
+    anchor, stats = _load(cursor)
+    newest = max(days)
+    if anchor is not None and newest < anchor - timedelta(days=ANOMALY_WINDOW_DAYS): return
+
+    result = None
+    if anchor is not None and newest > anchor:
+        old_val = _day_value(cursor, anchor)
+        if old_val is not None: result = _evaluate(cursor, stats, anchor, old_val)
+    anchor = newest if anchor is None else max(anchor, newest)
+    _save(cursor, anchor, _window_stats(cursor, anchor), result)
+
+
+def read_anomaly_state(cursor):
+    """Kết quả đánh giá mới nhất (dict) hoặc None."""
+    cursor.execute("""
+        SELECT ngay, san_luong, trung_binh, do_lech_chuan, so_mau, z, nam_truoc, bat_thuong
+        FROM anomaly_state WHERE id = 1 AND ngay IS NOT NULL
+    """)
+    row = cursor.fetchone()
+    if row is None: return None
+    keys = ("ngay", "san_luong", "trung_binh", "do_lech_chuan", "so_mau", "z", "nam_truoc", "bat_thuong")
+    result = dict(zip(keys, row))
+    result["bat_thuong"] = bool(result["bat_thuong"])
+    last_year = result["nam_truoc"]
+    result["chenh_lech_nam_truoc"] = (result["san_luong"] - last_year) / last_year if last_year else None
+    return result
@@ -0,0 +1,112 @@
+"""State attributes of the columnar sensors, built from EntryColumns (no Home Assistant import)."""
+from .const import ATTR_SCHEMA_VERSION, SCHEMA_VERSION_COMPACT, SCHEMA_VERSION_LEGACY
+
+
+def _series(rows):
+    """[(khóa nguyên liên tiếp, kWh, tiền, sau thuế)] tăng dần -> (khóa đầu, [kWh], [tiền], [sau thuế]).
+
+    Khóa bị thiếu ở giữa được lấp bằng None để vị trí trong mảng = khóa - khóa đầu.
+    """
+    if not rows: return None, [], [], []
+    start = rows[0][0]
+    size = rows[-1][0] - start + 1
+    kwh, cost, post = [None] * size, [None] * size, [None] * size
+    for key, k, c, p in rows:
+        kwh[key - start], cost[key - start], post[key - start] = k, c, p
+    return start, kwh, cost, post
+
+
+def _post_tax(pre_tax, db_post_tax, vat_val):
+    if db_post_tax and db_post_tax > 0: return int(db_post_tax)
+    return int(pre_tax * (1 + vat_val / 100))
+
+
+def month_attributes(columns, year, month, compact=False):
+    """Attribute của sensor kỳ (năm, tháng); compact=True: ngày bắt đầu + mảng kWh (schema_version 2)."""
+    res = columns.month(year, month)
+    if res is None: return None
+    cost, kwh, db_post_tax, vat, start_date_str, end_date_str = res
+    pre_tax = int(cost) if cost else 0
+    vat_val = vat if vat is not None else 8
+
+    attrs = {
+        "tong_san_luong_kwh": round(kwh, 2),
+        "tong_tien_truoc_thue": pre_tax,
+        "tong_tien_sau_thue": _post_tax(pre_tax, db_post_tax, vat_val),
+        "vat_rate": f"{vat_val}%",
+        "ky_hoa_don": f"{start_date_str} -> {end_date_str}",
+    }
+    if compact:
+        start, values = columns.month_series(year, month)
+        attrs.update({ATTR_SCHEMA_VERSION: SCHEMA_VERSION_COMPACT, "ngay_bat_dau": start, "san_luong_ngay": values})
+    else:
+        attrs[ATTR_SCHEMA_VERSION] = SCHEMA_VERSION_LEGACY
+        attrs["chi_tiet_ngay"] = {f"Ngay_{d:02d}": round(v, 2) for d, v in columns.month_days(year, month)}
+    attrs["data_source"] = "Monthly Detail"
+    return attrs
+
+
+def year_attributes(columns, year, compact=False):
+    """Attribute của sensor năm; compact=True: tháng bắt đầu + các mảng theo tháng."""
+    res = columns.year(year)
+    if res is None: return None
+    pre_tax = int(res[0]) if res[0] else 0
+    vat_val = res[3] if res[3] is not None else 8
+
+    attrs = {
+        "tong_san_luong_nam": round(res[1], 2),
+        "tong_tien_truoc_thue": pre_tax,
+        "tong_tien_sau_thue": _post_tax(pre_tax, res[2], vat_val),
+        "vat_rate": f"{vat_val}%",
+    }
+    months = [
+        (r[0], round(r[1], 2), int(r[2]), int(r[3]) if r[3] and r[3] > 0 else int(r[2] * (1 + vat_val/100)))
+        for r in columns.year_months(year)
+    ]
+    if compact:
+        start, kwh, cost, post = _series(months)
+        attrs.update({
+            ATTR_SCHEMA_VERSION: SCHEMA_VERSION_COMPACT, "thang_bat_dau": start,
+            "san_luong_thang": kwh, "tien_thang": cost, "tien_sau_thue_thang": post,
+        })
+    else:
+        attrs[ATTR_SCHEMA_VERSION] = SCHEMA_VERSION_LEGACY
+        attrs["chi_tiet_cac_thang"] = {
+            f"Thang_{m:02d}": {"san_luong_kwh": kwh, "thanh_tien_vnd": cost, "thanh_tien_sau_thue_vnd": post}
+            for m, kwh, cost, post in months
+        }
+    return attrs
+
+
+def total_attributes(columns, compact=False):
+    """Attribute của sensor tổng; compact=True: năm bắt đầu + các mảng theo năm (tăng dần)."""
+    res = columns.total
+    if res is None: return None
+    total_pre = int(res[4]) if res[4] else 0
+    vat_val = res[6] if res[6] is not None else 8
+
+    attrs = {
+        "tong_so_thang_du_lieu": res[1],
+        "thoi_diem_bat_dau": res[2],
+        "thoi_diem_ket_thuc": res[3],
+        "tong_tien_tich_luy": total_pre,
+        "tong_tien_tich_luy_sau_thue": _post_tax(total_pre, res[5], vat_val),
+        "current_vat_ref": f"{vat_val}%",
+    }
+    years = [
+        (y[0], round(y[1], 2), int(y[2]), int(y[3]) if y[3] and y[3] > 0 else int(y[2] * (1 + (y[4] or 8)/100)))
+        for y in columns.years()
+    ]
+    if compact:
+        start, kwh, cost, post = _series(years[::-1])
+        attrs.update({
+            ATTR_SCHEMA_VERSION: SCHEMA_VERSION_COMPACT, "nam_bat_dau": start,
+            "san_luong_nam": kwh, "tien_nam": cost, "tien_sau_thue_nam": post,
+        })
+    else:
+        attrs[ATTR_SCHEMA_VERSION] = SCHEMA_VERSION_LEGACY
+        attrs["chi_tiet_tung_nam"] = {
+            f"Nam_{y}": {"tong_san_luong_kwh": kwh, "tong_tien_vnd": cost, "tong_tien_sau_thue_vnd": post}
+            for y, kwh, cost, post in years
+        }
+    return attrs
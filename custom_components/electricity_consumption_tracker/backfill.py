@@ -0,0 +1,68 @@
+"""Recorder backfill for days missing from the Electricity Consumption Tracker database."""
+import logging
+from datetime import timedelta
+
+import homeassistant.util.dt as dt_util
+from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+# Chạy bù dữ liệu sau nửa đêm, khi giá trị của hôm qua đã được recorder tổng hợp
+BACKFILL_HOUR = 0
+BACKFILL_MINUTE = 15
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def async_fetch_daily_values(hass: HomeAssistant, entity_id, days, offset=0):
+    """Lấy sản lượng các ngày `days` của sensor nguồn từ recorder: {date: kWh}.
+
+    Thống kê "day" (max, dự phòng state) và lịch sử trạng thái được đọc trong một lần
+    cho cả khoảng ngày; lịch sử (chi tiết hơn) ưu tiên hơn thống kê nếu còn.
+    Sensor nguồn là sản lượng trong ngày nên giá trị của ngày là giá trị lớn nhất.
+    offset=1: sensor báo sản lượng hôm qua, giá trị của ngày D là giá trị cuối cùng trong ngày D+1.
+    """
+    if not days or "recorder" not in hass.config.components: return {}
+
+    from homeassistant.components.recorder import get_instance, history
+    from homeassistant.components.recorder.statistics import statistics_during_period
+
+    shift = timedelta(days=offset)
+    wanted = {d + shift for d in days}
+    start = dt_util.start_of_local_day(min(wanted))
+    end = dt_util.start_of_local_day(max(wanted) + timedelta(days=1))
+
+    def fetch():
+        stats = statistics_during_period(hass, start, end, {entity_id}, "day", None, {"max", "state"})
+        states = history.get_significant_states(
+            hass, start, end, [entity_id],
+            include_start_time_state=False, significant_changes_only=False, no_attributes=True,
+        )
+        return stats.get(entity_id, []), states.get(entity_id, [])
+
+    stats, states = await get_instance(hass).async_add_executor_job(fetch)
+
+    values = {}
+    for row in stats:
+        row_start = row["start"]
+        if isinstance(row_start, (int, float)): row_start = dt_util.utc_from_timestamp(row_start)
+        day = dt_util.as_local(row_start).date()
+        val = _to_float(row.get("max")) if not offset else None
+        if val is None: val = _to_float(row.get("state"))
+        if val is not None: values[day] = val
+
+    from_history = {}
+    for state in states:
+        val = _to_float(state.state)
+        if val is None: continue
+        day = dt_util.as_local(state.last_updated).date()
+        # Lịch sử theo thứ tự thời gian: nguồn "hôm qua" lấy giá trị cuối cùng của ngày
+        from_history[day] = val if offset else max(val, from_history.get(day, val))
+    values.update(from_history)
+
+    return {d - shift: v for d, v in values.items() if d in wanted}
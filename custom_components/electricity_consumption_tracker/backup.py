@@ -0,0 +1,27 @@
+"""Backup platform for the Electricity Consumption Tracker integration."""
+import logging
+
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .db import checkpoint_db
+from .integration import async_backup_entries
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_pre_backup(hass: HomeAssistant) -> None:
+    """Trước khi HA tạo backup: chụp DB của mọi entry vào thư mục backup (bản nhất quán để khôi phục)."""
+    results = await async_backup_entries(hass)
+    _LOGGER.info(f"Snapshotted {len(results)} database(s) before Home Assistant backup")
+
+    # File .db đang dùng vẫn được HA sao chép: dồn WAL vào file chính để bản sao ít phụ thuộc file -wal
+    for entry_id, entry_data in hass.data.get(DOMAIN, {}).items():
+        try:
+            await hass.async_add_executor_job(checkpoint_db, entry_data["db_path"])
+        except Exception as e:
+            _LOGGER.debug(f"Pre-backup checkpoint error {entry_id}: {e}")
+
+
+async def async_post_backup(hass: HomeAssistant) -> None:
+    """Không có gì cần khôi phục: việc ghi không bị tạm dừng trong lúc chụp."""
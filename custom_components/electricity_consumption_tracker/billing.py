@@ -0,0 +1,409 @@
+"""Billing calculations for the Electricity Consumption Tracker integration."""
+import math
+from datetime import timedelta, date, datetime
+
+from .db import connect_db, sync_billing_config, refresh_yoy, archive_years_sql, day_bounds
+from .tariff import DEFAULT_TARIFF, get_vat_rate
+from .anomaly import update_anomaly_stats, refresh_anomaly_stats
+
+# Số kỳ tính trong một lượt khi rebuild; giữa các lượt kiểm tra cờ hủy và báo tiến độ
+REBUILD_CHUNK_MONTHS = 12
+
+# Checksum của kỳ: mỗi ngày đóng góp (YYYYMMDD * sản lượng tính bằng 0.01 kWh).
+# Phát hiện được ngày thiếu/thừa, giá trị sai và ngày bị gán nhầm kỳ.
+CHECKSUM_SQL = "SUM((nam * 10000 + thang * 100 + ngay) * CAST(ROUND(san_luong * 100) AS INTEGER))"
+VERIFY_KWH_TOLERANCE = 0.001
+# Kiểm tra nền mỗi ngày vào giờ này (và một lần sau khi khởi động)
+VERIFY_HOUR = 4
+VERIFY_MINUTE = 0
+
+# Tìm ngày bị thiếu trong chừng này ngày gần nhất (đủ cho lịch sử/thống kê của recorder)
+GAP_LOOKBACK_DAYS = 30
+
+
+class RebuildCancelled(Exception):
+    """Rebuild bị hủy giữa chừng (transaction đã rollback)."""
+
+class RebuildSuperseded(RebuildCancelled):
+    """Rebuild bị hủy vì có rebuild cùng loại mới hơn cho cùng entry."""
+
+def get_billing_period(current_date: date, billing_day: int, apply_date: date):
+    if current_date < apply_date:
+        return current_date.year, current_date.month
+
+    if billing_day == 1:
+        return current_date.year, current_date.month
+    
+    if current_date.day < billing_day:
+        return current_date.year, current_date.month
+    else:
+        next_month = current_date.month + 1
+        year = current_date.year
+        if next_month > 12:
+            next_month = 1
+            year += 1
+        return year, next_month
+
+def get_accurate_billing_range(year, month, billing_day, apply_date):
+    anchor_date = date(year, month, 1)
+    
+    start_date = anchor_date
+    end_date = anchor_date
+
+    for i in range(1, 45):
+        prev_d = anchor_date - timedelta(days=i)
+        p_y, p_m = get_billing_period(prev_d, billing_day, apply_date)
+        if p_y == year and p_m == month:
+            start_date = prev_d
+        else:
+            break
+
+    for i in range(1, 45):
+        next_d = anchor_date + timedelta(days=i)
+        n_y, n_m = get_billing_period(next_d, billing_day, apply_date)
+        if n_y == year and n_m == month:
+            end_date = next_d
+        else:
+            break
+
+    return start_date, end_date
+
+def day_checksum(d, val):
+    """Phần đóng góp của một ngày vào checksum kỳ (cùng cách làm tròn với ROUND của SQLite)."""
+    cents = (val or 0) * 100
+    cents = math.floor(cents + 0.5) if cents >= 0 else math.ceil(cents - 0.5)
+    return (d.year * 10000 + d.month * 100 + d.day) * int(cents)
+
+def get_tier_position(kwh, tiers):
+    """Trả về (bậc hiện tại tính từ 1, số kWh còn lại trước khi sang bậc kế; None nếu là bậc cuối)."""
+    upper = 0
+    for i, (limit, _price) in enumerate(tiers, 1):
+        if limit == float('inf'): return i, None
+        upper += limit
+        if kwh < upper: return i, upper - kwh
+    return len(tiers), None
+
+def calculate_cost(kwh, year, month, tariff=None):
+    return (tariff or DEFAULT_TARIFF).price(kwh, year, month)
+
+def perform_db_calculation(cursor, y, m, d, val, billing_day, apply_date_str, cache=None, tariff=None):
+    """Ghi một ngày và cập nhật kỳ/năm/tổng. Trả về kết quả đánh giá bất thường (xem anomaly.py) hoặc None."""
+    apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+    current_date_obj = date(y, m, d)
+    # Thống kê theo thứ cần giá trị cũ của ngày nên phải chạy trước khi ghi
+    anomaly = update_anomaly_stats(cursor, current_date_obj, val)
+
+    # [NEW] Ngày thuộc kỳ đang mở: cập nhật cache tại chỗ, không SUM lại
+    if cache is not None and cache.loaded:
+        if current_date_obj > cache.end:
+            cache.load(cursor, current_date_obj)
+        if cache.contains(current_date_obj):
+            cache.apply(cursor, current_date_obj, val)
+            return anomaly
+
+    b_year, b_month = get_billing_period(current_date_obj, billing_day, apply_date)
+
+    cursor.execute("""
+        INSERT OR REPLACE INTO daily_usage (nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang)
+        VALUES (?, ?, ?, ?, 'kWh', ?, ?)
+    """, (y, m, d, val, b_year, b_month))
+    
+    _calculate_single_month(cursor, b_year, b_month, billing_day, apply_date, tariff)
+    _calculate_single_year(cursor, b_year)
+    recalculate_total_usage(cursor)
+
+    # Kỳ cũ thay đổi thì phần "đã đóng" trong cache phải đọc lại
+    if cache is not None and cache.loaded:
+        cache.reload_base(cursor)
+    return anomaly
+
+def _calculate_single_month(cursor, b_year, b_month, billing_day, apply_date, tariff=None):
+    _calculate_months(cursor, [(b_year, b_month)], billing_day, apply_date, tariff)
+
+def _calculate_months(cursor, months, billing_day, apply_date, tariff=None):
+    """Tính lại nhiều kỳ: 1 câu GROUP BY trên index (ky_nam, ky_thang) rồi định giá cả lô."""
+    if not months: return
+    first, last = min(months), max(months)
+    cursor.execute(f"""
+        SELECT ky_nam, ky_thang, SUM(san_luong), COUNT(*), {CHECKSUM_SQL}
+        FROM daily_values
+        WHERE (ky_nam, ky_thang) BETWEEN (:y1, :m1) AND (:y2, :m2) AND {archive_years_sql(":y1", ":y2")}
+        GROUP BY ky_nam, ky_thang
+    """, {"y1": first[0], "m1": first[1], "y2": last[0], "m2": last[1]})
+    sums = {(r[0], r[1]): r[2:] for r in cursor.fetchall()}
+
+    periods = []
+    for b_year, b_month in months:
+        start_date, end_date = get_accurate_billing_range(b_year, b_month, billing_day, apply_date)
+        
+        start_str = start_date.strftime("%Y-%m-%d")
+        end_str = end_date.strftime("%Y-%m-%d")
+
+        monthly_sum, so_ngay, checksum = sums.get((b_year, b_month), (0.0, 0, 0))
+        periods.append((b_year, b_month, monthly_sum or 0.0, start_str, end_str, end_date, so_ngay, checksum or 0))
+
+    costs = (tariff or DEFAULT_TARIFF).price_many([(p[0], p[1], p[2]) for p in periods])
+
+    rows = []
+    for (b_year, b_month, monthly_sum, start_str, end_str, end_date, so_ngay, checksum), monthly_cost in zip(periods, costs):
+        vat_rate = get_vat_rate(end_date.year, end_date.month, end_date.day)
+        vat_int = int(vat_rate * 100)
+        post_tax_cost = int(monthly_cost * (1 + vat_rate))
+        rows.append((b_year, b_month, monthly_sum, monthly_cost, post_tax_cost, vat_int, start_str, end_str,
+                     so_ngay, checksum))
+
+    # LƯU NGÀY BẮT ĐẦU VÀ KẾT THÚC VÀO DB ĐỂ SENSOR ĐỌC
+    cursor.executemany("""
+        INSERT OR REPLACE INTO monthly_bill 
+        (nam, thang, tong_san_luong, don_vi_san_luong, thanh_tien, don_vi_tien, 
+         thanh_tien_sau_thue, vat, ngay_bat_dau, ngay_ket_thuc, so_ngay, checksum)
+        VALUES (?, ?, ?, 'kWh', ?, 'đ', ?, ?, ?, ?, ?, ?)
+    """, rows)
+    refresh_yoy(cursor, {r[1] for r in rows})
+
+def _calculate_single_year(cursor, year):
+    cursor.execute("""
+        SELECT SUM(tong_san_luong), SUM(thanh_tien), SUM(thanh_tien_sau_thue) 
+        FROM monthly_bill WHERE nam=?
+    """, (year,))
+    row_year = cursor.fetchone()
+    
+    cursor.execute("SELECT vat FROM monthly_bill WHERE nam=? ORDER BY thang DESC LIMIT 1", (year,))
+    vat_res = cursor.fetchone()
+    vat_year = vat_res[0] if vat_res else 8
+
+    if row_year:
+        cursor.execute("""
+            INSERT OR REPLACE INTO yearly_bill
+            (nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat)
+            VALUES (?, ?, ?, ?, ?)
+        """, (year, row_year[0] or 0, row_year[1] or 0, row_year[2] or 0, vat_year))
+
+def recalculate_total_usage(cursor):
+    cursor.execute("SELECT SUM(tong_san_luong), SUM(thanh_tien), SUM(thanh_tien_sau_thue) FROM monthly_bill")
+    row_total = cursor.fetchone()
+    
+    total_kwh = row_total[0] or 0.0
+    total_money = row_total[1] or 0
+    total_money_post_tax = row_total[2] or 0
+    
+    cursor.execute("SELECT COUNT(*) FROM monthly_bill")
+    total_months = cursor.fetchone()[0] or 0
+    
+    start_str = "N/A"
+    end_str = "N/A"
+    
+    first, last = day_bounds(cursor)
+    if first is not None:
+        start_str = first.strftime("%d/%m/%Y")
+
+    current_vat = 8
+    if last is not None:
+        end_str = last.strftime("%d/%m/%Y")
+        current_vat = int(get_vat_rate(last.year, last.month, last.day) * 100)
+
+    cursor.execute("DELETE FROM total_usage")
+    cursor.execute("""
+        INSERT INTO total_usage 
+        (tong_san_luong, don_vi, tong_so_thang, thoi_diem_bat_dau, thoi_diem_ket_thuc, 
+         tong_tien_tich_luy, tong_tien_tich_luy_sau_thue, vat) 
+        VALUES (?, 'kWh', ?, ?, ?, ?, ?, ?)
+    """, (total_kwh, total_months, start_str, end_str, total_money, total_money_post_tax, current_vat))
+
+def _calculate_months_chunked(cursor, months, billing_day, apply_date, tariff=None, cancel_event=None, progress=None):
+    total = len(months)
+    for i in range(0, total, REBUILD_CHUNK_MONTHS):
+        if cancel_event is not None and cancel_event.is_set(): raise RebuildCancelled()
+        _calculate_months(cursor, months[i:i + REBUILD_CHUNK_MONTHS], billing_day, apply_date, tariff)
+        if progress is not None: progress(min(i + REBUILD_CHUNK_MONTHS, total), total)
+    if cancel_event is not None and cancel_event.is_set(): raise RebuildCancelled()
+
+    for y_c in sorted(set(m[0] for m in months)):
+        _calculate_single_year(cursor, y_c)
+
+def recompute_from_date(cursor, since_str, billing_day, apply_date, tariff=None, cancel_event=None, progress=None):
+    """Tính lại các kỳ kết thúc từ ngày since_str trở đi (sau khi đổi bảng giá/VAT)."""
+    cursor.execute("""
+        SELECT nam, thang FROM monthly_bill
+        WHERE ngay_ket_thuc IS NULL OR ngay_ket_thuc >= ?
+        ORDER BY nam, thang
+    """, (since_str,))
+    months = [(r[0], r[1]) for r in cursor.fetchall()]
+    if not months: return months
+
+    _calculate_months_chunked(cursor, months, billing_day, apply_date, tariff, cancel_event, progress)
+    recalculate_total_usage(cursor)
+    return months
+
+def rebuild_history(db_path, billing_day, apply_date_str, tariff=None, full=False, cancel_event=None, progress=None):
+    """Xóa và tính lại monthly/yearly/total từ năm bị ảnh hưởng (full=True: toàn bộ lịch sử).
+
+    Chạy trong 1 transaction: bị hủy hoặc lỗi thì rollback, dữ liệu cũ giữ nguyên.
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+        # Đổi ngày chốt số/ngày áp dụng: gán lại kỳ cho mọi ngày bằng 1 câu UPDATE
+        sync_billing_config(cursor, billing_day, apply_date_str)
+        
+        if full:
+            # Ngày đầu tiên lấy thẳng từ hai bảng gốc, không quét view qua mọi năm lưu trữ
+            first_day = day_bounds(cursor)[0]
+            first_impact = (first_day.year, first_day.month, first_day.day) if first_day else None
+        else:
+            # Lọc thêm theo nam để view chỉ giải nén các năm lưu trữ từ năm áp dụng trở đi
+            cursor.execute("""
+                SELECT nam, thang, ngay FROM daily_values 
+                WHERE (nam, thang, ngay) >= (:y, :m, :d) AND nam >= :y
+                ORDER BY nam, thang, ngay ASC LIMIT 1
+            """, {"y": apply_date.year, "m": apply_date.month, "d": apply_date.day})
+            first_impact = cursor.fetchone()
+        sorted_months = []
+        
+        if first_impact:
+            start_year_wipe = first_impact[0]
+            if first_impact[1] == 1 and billing_day > 1:
+                start_year_wipe -= 1
+            
+            cursor.execute("DELETE FROM monthly_bill WHERE nam >= ?", (start_year_wipe,))
+            cursor.execute("DELETE FROM yearly_bill WHERE nam >= ?", (start_year_wipe,))
+            
+            cursor.execute("""
+                SELECT DISTINCT ky_nam, ky_thang
+                FROM daily_values 
+                WHERE nam >= ?
+                ORDER BY ky_nam, ky_thang
+            """, (start_year_wipe,))
+            
+            sorted_months = [(r[0], r[1]) for r in cursor.fetchall()]
+            _calculate_months_chunked(cursor, sorted_months, billing_day, apply_date, tariff, cancel_event, progress)
+            # Kỳ bị xóa mà không còn ngày nào (đổi ngày chốt số) cũng phải biến mất khỏi bảng so sánh
+            refresh_yoy(cursor)
+            
+        recalculate_total_usage(cursor)
+        conn.commit()
+        return len(sorted_months)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def verify_db(db_path, billing_day, apply_date_str, tariff=None):
+    """So checksum/số ngày/sản lượng của daily_usage với monthly_bill, yearly_bill, total_usage.
+
+    Chỉ tính lại các kỳ/năm lệch, trả về báo cáo những gì đã sửa.
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+
+        cursor.execute(f"""
+            SELECT ky_nam, ky_thang, COUNT(*), {CHECKSUM_SQL}, SUM(san_luong)
+            FROM daily_values GROUP BY ky_nam, ky_thang
+        """)
+        daily = {(r[0], r[1]): (r[2], r[3] or 0, r[4] or 0.0) for r in cursor.fetchall()}
+        cursor.execute("SELECT nam, thang, so_ngay, checksum, tong_san_luong FROM monthly_bill")
+        stored = {(r[0], r[1]): (r[2], r[3], r[4] or 0.0) for r in cursor.fetchall()}
+
+        repaired, backfilled = [], []
+        for key, (count, checksum, kwh) in daily.items():
+            row = stored.get(key)
+            if row is not None and row[0] == count and row[1] == checksum and abs(row[2] - kwh) <= VERIFY_KWH_TOLERANCE:
+                continue
+            # Dòng tạo trước khi có checksum nhưng sản lượng vẫn khớp: chỉ điền checksum
+            if row is not None and row[1] is None and abs(row[2] - kwh) <= VERIFY_KWH_TOLERANCE:
+                backfilled.append(key)
+            else:
+                repaired.append(key)
+        # Kỳ còn số liệu nhưng không còn ngày nào trong daily_usage
+        repaired += [key for key, row in stored.items() if key not in daily and (row[0] or row[2])]
+
+        months = sorted(repaired + backfilled)
+        if months:
+            _calculate_months(cursor, months, billing_day, apply_date, tariff)
+
+        cursor.execute("""
+            SELECT m.nam FROM monthly_bill m LEFT JOIN yearly_bill y ON y.nam = m.nam
+            GROUP BY m.nam
+            HAVING y.nam IS NULL OR ABS(SUM(m.tong_san_luong) - MAX(y.tong_san_luong)) > ?
+                OR ABS(SUM(m.thanh_tien) - MAX(y.tong_tien)) > 0.5
+        """, (VERIFY_KWH_TOLERANCE,))
+        years = sorted(set(r[0] for r in cursor.fetchall()) | set(m[0] for m in repaired))
+        for y_c in years:
+            _calculate_single_year(cursor, y_c)
+
+        cursor.execute("SELECT SUM(tong_san_luong), COUNT(*) FROM monthly_bill")
+        m_kwh, m_count = cursor.fetchone()
+        cursor.execute("SELECT tong_san_luong, tong_so_thang FROM total_usage")
+        total = cursor.fetchone()
+        total_repaired = bool(years) or total is None or total[1] != m_count \
+            or abs((total[0] or 0) - (m_kwh or 0)) > VERIFY_KWH_TOLERANCE
+        if total_repaired:
+            recalculate_total_usage(cursor)
+
+        conn.commit()
+        return {
+            "periods_checked": len(daily),
+            "periods_repaired": [f"{m:02d}/{y}" for y, m in sorted(repaired)],
+            "periods_backfilled": len(backfilled),
+            "years_repaired": years,
+            "total_repaired": total_repaired,
+        }
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def find_missing_days(cursor, end_date, lookback_days=GAP_LOOKBACK_DAYS):
+    """Các ngày chưa có dữ liệu (kể cả năm đã nén), từ max(ngày đầu tiên có dữ liệu, end_date - lookback) đến end_date."""
+    first = day_bounds(cursor)[0]
+    if first is None: return []
+    start_date = max(end_date - timedelta(days=lookback_days - 1), first)
+    if start_date > end_date: return []
+
+    # Dãy ngày sinh bằng CTE, mỗi ngày tra khóa chính của daily_usage (hoặc năm nén) qua view
+    cursor.execute("""
+        WITH RECURSIVE d(x) AS (
+            SELECT date(?) UNION ALL SELECT date(x, '+1 day') FROM d WHERE x < date(?)
+        )
+        SELECT x FROM d WHERE NOT EXISTS (
+            SELECT 1 FROM daily_values u
+            WHERE u.nam = CAST(substr(x, 1, 4) AS INTEGER)
+              AND u.thang = CAST(substr(x, 6, 2) AS INTEGER)
+              AND u.ngay = CAST(substr(x, 9, 2) AS INTEGER)
+        )
+    """, (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
+    return [datetime.strptime(r[0], "%Y-%m-%d").date() for r in cursor.fetchall()]
+
+def backfill_days(cursor, values, billing_day, apply_date_str, tariff=None, removed_days=None):
+    """Ghi nhiều ngày ({date: kWh}), xóa removed_days, rồi tính lại các kỳ, năm, tổng bị ảnh hưởng một lần."""
+    apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+    rows = []
+    months = set()
+    for d, val in sorted(values.items()):
+        b_year, b_month = get_billing_period(d, billing_day, apply_date)
+        months.add((b_year, b_month))
+        rows.append((d.year, d.month, d.day, val, b_year, b_month))
+    removed_days = removed_days or []
+    for d in removed_days:
+        months.add(get_billing_period(d, billing_day, apply_date))
+    if not months: return []
+
+    cursor.executemany("""
+        INSERT OR REPLACE INTO daily_usage (nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang)
+        VALUES (?, ?, ?, ?, 'kWh', ?, ?)
+    """, rows)
+    cursor.executemany("DELETE FROM daily_usage WHERE nam=? AND thang=? AND ngay=?",
+                       [(d.year, d.month, d.day) for d in removed_days])
+
+    months = sorted(months)
+    _calculate_months(cursor, months, billing_day, apply_date, tariff)
+    for y_c in sorted(set(m[0] for m in months)):
+        _calculate_single_year(cursor, y_c)
+    recalculate_total_usage(cursor)
+    refresh_anomaly_stats(cursor, list(values) + list(removed_days))
+    return months
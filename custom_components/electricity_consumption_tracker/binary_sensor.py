@@ -0,0 +1,74 @@
+"""Binary sensor platform for Electricity Consumption Tracker."""
+import os
+import logging
+from homeassistant.components.binary_sensor import (
+    BinarySensorEntity,
+    BinarySensorDeviceClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from .const import DOMAIN, SIGNAL_UPDATE_SENSORS
+from .anomaly import read_anomaly_state
+from .db import connect_db
+
+_LOGGER = logging.getLogger(__name__)
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
+    db_path = hass.data[DOMAIN][entry.entry_id]["db_path"]
+    friendly_name = entry.data.get("friendly_name", "Electricity")
+    async_add_entities([ConsumptionAnomalySensor(db_path, f"{friendly_name} Sản lượng bất thường", entry.entry_id)])
+
+def _read_state(db_path):
+    if not os.path.exists(db_path): return None
+    conn = connect_db(db_path, read_only=True)
+    try:
+        return read_anomaly_state(conn.cursor())
+    finally:
+        conn.close()
+
+class ConsumptionAnomalySensor(BinarySensorEntity):
+    """Bật khi ngày hoàn tất gần nhất lệch bất thường so với cùng thứ các tuần trước (và cùng ngày năm trước)."""
+
+    _attr_should_poll = False
+    _attr_has_entity_name = False
+    _attr_device_class = BinarySensorDeviceClass.PROBLEM
+    _attr_icon = "mdi:chart-bell-curve"
+
+    def __init__(self, db_path, name, entry_id):
+        self._db_path = db_path
+        self._entry_id = entry_id
+        self._attr_name = name
+        self._attr_unique_id = f"{entry_id}_anomaly"
+        self._attr_device_info = {"identifiers": {(DOMAIN, entry_id)}, "name": entry_id}
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_dispatcher_connect(self.hass, f"{SIGNAL_UPDATE_SENSORS}_{self._entry_id}", self._async_refresh)
+        )
+        await self._async_refresh()
+
+    async def _async_refresh(self, _days=None):
+        try:
+            state = await self.hass.async_add_executor_job(_read_state, self._db_path)
+        except Exception as e:
+            _LOGGER.error(f"Anomaly state error {self._entry_id}: {e}")
+            return
+        if state is None:
+            self._attr_is_on = None
+            self._attr_extra_state_attributes = {}
+        else:
+            self._attr_is_on = state["bat_thuong"]
+            self._attr_extra_state_attributes = {
+                "ngay": state["ngay"],
+                "san_luong_kwh": round(state["san_luong"], 2),
+                "trung_binh_cung_thu_kwh": round(state["trung_binh"], 2),
+                "do_lech_chuan_kwh": round(state["do_lech_chuan"], 2),
+                "so_mau": state["so_mau"],
+                "z": round(state["z"], 2) if state["z"] is not None else None,
+                "nam_truoc_kwh": round(state["nam_truoc"], 2) if state["nam_truoc"] is not None else None,
+                "chenh_lech_nam_truoc": f"{state['chenh_lech_nam_truoc'] * 100:.0f}%" if state["chenh_lech_nam_truoc"] is not None else None,
+            }
+        self.async_write_ha_state()
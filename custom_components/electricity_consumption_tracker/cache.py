@@ -0,0 +1,241 @@
+"""In-memory cache of the open billing period for Electricity Consumption Tracker."""
+import threading
+from datetime import date
+
+from .billing import get_billing_period, get_accurate_billing_range, calculate_cost, get_tier_position, day_checksum
+from .tariff import DEFAULT_TARIFF, get_vat_rate
+from .db import refresh_yoy, day_bounds
+
+
+class OpenPeriodCache:
+    """Kỳ hóa đơn đang mở của một entry, giữ trong RAM.
+
+    Tick/override rơi vào kỳ này được cộng dồn tại chỗ và ghi thẳng các dòng
+    daily_usage, monthly_bill, yearly_bill, total_usage (O(1) câu SQL), không
+    cần SUM lại. Các kỳ cũ hơn vẫn đi đường SQL rồi gọi reload_base().
+
+    self.lock chỉ bảo vệ trạng thái trong RAM; các dòng tính trong apply() được commit sau khi nhả
+    lock, nên mọi lần ghi của entry phải chạy tuần tự dưới khóa ghi của entry ("write_lock").
+    """
+
+    def __init__(self, billing_day, apply_date, tariff=None):
+        self.billing_day = billing_day
+        self.apply_date = apply_date
+        self.tariff = tariff or DEFAULT_TARIFF
+        self.lock = threading.Lock()
+        self.loaded = False
+
+        self.b_year = None
+        self.b_month = None
+        self.start = None
+        self.end = None
+        self.days = {}
+        self.kwh = 0.0
+        self.cost = 0
+        self.vat = 8
+        self.post_tax = 0
+        self.checksum = 0
+
+        # Bậc giá và dữ liệu dự báo, cập nhật mỗi tick trong O(1)
+        self.tiers = []
+        self.tier = 1
+        self.tier_left = None
+        self.last_day = None
+        self.tier_crossed = None
+
+        # Phần "đã đóng" (không gồm kỳ đang mở), dùng để suy ra năm và tổng trong O(1)
+        self.year_base = (0.0, 0, 0)
+        self.year_base_last = (0, 8)
+        self.total_base = (0.0, 0, 0, 0)
+        self.years = {}
+        self.first_date = None
+        self.last_date = None
+
+    # --- LOAD ---
+
+    def invalidate(self):
+        """Đánh dấu cache hỏng (ví dụ transaction lỗi), lần ghi sau sẽ nạp lại."""
+        with self.lock:
+            self.loaded = False
+
+    def contains(self, d):
+        return self.loaded and self.start <= d <= self.end
+
+    def load(self, cursor, today):
+        """Nạp kỳ chứa ngày `today` (1 lần khi setup hoặc khi sang kỳ mới)."""
+        b_year, b_month = get_billing_period(today, self.billing_day, self.apply_date)
+        start, end = get_accurate_billing_range(b_year, b_month, self.billing_day, self.apply_date)
+
+        cursor.execute("""
+            SELECT nam, thang, ngay, san_luong FROM daily_values
+            WHERE (nam, thang, ngay) >= (?, ?, ?) AND (nam, thang, ngay) <= (?, ?, ?) AND nam BETWEEN ? AND ?
+        """, (start.year, start.month, start.day, end.year, end.month, end.day, start.year, end.year))
+        days = {date(r[0], r[1], r[2]): r[3] or 0.0 for r in cursor.fetchall()}
+
+        with self.lock:
+            self.b_year, self.b_month = b_year, b_month
+            self.start, self.end = start, end
+            self.days = days
+            self.tiers = self.tariff.tiers(b_year, b_month)
+            self.last_day = max(days) if days else None
+            self.tier_crossed = None
+            self._recompute_period()
+            self.loaded = True
+        self.reload_base(cursor)
+
+    def reload_base(self, cursor):
+        """Đọc lại phần đã đóng (sau khi ghi kỳ cũ bằng SQL)."""
+        cursor.execute("""
+            SELECT SUM(tong_san_luong), SUM(thanh_tien), SUM(thanh_tien_sau_thue), COUNT(*)
+            FROM monthly_bill WHERE NOT (nam=? AND thang=?)
+        """, (self.b_year, self.b_month))
+        t = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT SUM(tong_san_luong), SUM(thanh_tien), SUM(thanh_tien_sau_thue)
+            FROM monthly_bill WHERE nam=? AND thang<>?
+        """, (self.b_year, self.b_month))
+        yb = cursor.fetchone()
+        cursor.execute("SELECT thang, vat FROM monthly_bill WHERE nam=? AND thang<>? ORDER BY thang DESC LIMIT 1",
+                       (self.b_year, self.b_month))
+        yl = cursor.fetchone()
+
+        cursor.execute("SELECT nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat FROM yearly_bill")
+        years = {r[0]: (r[1] or 0.0, r[2] or 0, r[3] or 0, r[4]) for r in cursor.fetchall()}
+
+        first, last = day_bounds(cursor)
+
+        with self.lock:
+            self.total_base = (t[0] or 0.0, t[1] or 0, t[2] or 0, t[3] or 0)
+            self.year_base = (yb[0] or 0.0, yb[1] or 0, yb[2] or 0)
+            self.year_base_last = (yl[0], yl[1] if yl[1] is not None else 8) if yl else (0, 8)
+            self.years = years
+            self.first_date, self.last_date = first, last
+
+    def _recompute_period(self):
+        self.kwh = sum(self.days.values())
+        self.checksum = sum(day_checksum(d, v) for d, v in self.days.items())
+        self._reprice()
+
+    def _reprice(self):
+        self.cost = calculate_cost(self.kwh, self.b_year, self.b_month, self.tariff)
+        vat_rate = get_vat_rate(self.end.year, self.end.month, self.end.day)
+        self.vat = int(vat_rate * 100)
+        self.post_tax = int(self.cost * (1 + vat_rate))
+        self.tier, self.tier_left = get_tier_position(self.kwh, self.tiers)
+
+    # --- WRITE ---
+
+    def apply(self, cursor, d, val):
+        """Ghi giá trị một ngày thuộc kỳ đang mở và cập nhật cache tại chỗ."""
+        with self.lock:
+            old = self.days.get(d, 0.0)
+            old_tier = self.tier
+            self.days[d] = val
+            self.kwh += val - old
+            self.checksum += day_checksum(d, val) - day_checksum(d, old)
+            self._reprice()
+            if self.last_day is None or d > self.last_day: self.last_day = d
+            if self.tier > old_tier:
+                self.tier_crossed = (old_tier, self.tier)
+            if self.first_date is None or d < self.first_date: self.first_date = d
+            if self.last_date is None or d > self.last_date: self.last_date = d
+            month_row, year_row, total_row = self._rows()
+
+        cursor.execute("""
+            INSERT OR REPLACE INTO daily_usage (nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang)
+            VALUES (?, ?, ?, ?, 'kWh', ?, ?)
+        """, (d.year, d.month, d.day, val, month_row[0], month_row[1]))
+        cursor.execute("""
+            INSERT OR REPLACE INTO monthly_bill
+            (nam, thang, tong_san_luong, don_vi_san_luong, thanh_tien, don_vi_tien,
+             thanh_tien_sau_thue, vat, ngay_bat_dau, ngay_ket_thuc, so_ngay, checksum)
+            VALUES (?, ?, ?, 'kWh', ?, 'đ', ?, ?, ?, ?, ?, ?)
+        """, month_row)
+        refresh_yoy(cursor, (self.b_month,))
+        cursor.execute("""
+            INSERT OR REPLACE INTO yearly_bill
+            (nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat)
+            VALUES (?, ?, ?, ?, ?)
+        """, year_row)
+        cursor.execute("DELETE FROM total_usage")
+        cursor.execute("""
+            INSERT INTO total_usage
+            (tong_san_luong, don_vi, tong_so_thang, thoi_diem_bat_dau, thoi_diem_ket_thuc,
+             tong_tien_tich_luy, tong_tien_tich_luy_sau_thue, vat)
+            VALUES (?, 'kWh', ?, ?, ?, ?, ?, ?)
+        """, total_row)
+
+    def _rows(self):
+        month_row = (self.b_year, self.b_month, self.kwh, self.cost, self.post_tax, self.vat,
+                     self.start.strftime("%Y-%m-%d"), self.end.strftime("%Y-%m-%d"), len(self.days), self.checksum)
+
+        y_kwh, y_money, y_post = self.year_base
+        last_month, last_vat = self.year_base_last
+        year_vat = self.vat if self.b_month >= last_month else last_vat
+        year_row = (self.b_year, y_kwh + self.kwh, y_money + self.cost, y_post + self.post_tax, year_vat)
+        self.years[self.b_year] = year_row[1:]
+
+        t_kwh, t_money, t_post, t_months = self.total_base
+        start_str = self.first_date.strftime("%d/%m/%Y") if self.first_date else "N/A"
+        end_str = self.last_date.strftime("%d/%m/%Y") if self.last_date else "N/A"
+        current_vat = int(get_vat_rate(self.last_date.year, self.last_date.month, self.last_date.day) * 100) if self.last_date else 8
+        total_row = (t_kwh + self.kwh, t_months + 1, start_str, end_str,
+                     t_money + self.cost, t_post + self.post_tax, current_vat)
+        return month_row, year_row, total_row
+
+    def pop_tier_crossed(self):
+        """Lấy (bậc cũ, bậc mới) nếu tick vừa rồi làm kỳ sang bậc giá cao hơn."""
+        with self.lock:
+            crossed, self.tier_crossed = self.tier_crossed, None
+            return crossed
+
+    # --- READ (sensor) ---
+
+    def projection(self, today):
+        """Dự báo cuối kỳ từ tổng và số ngày đã có dữ liệu (không quét lại daily_usage)."""
+        with self.lock:
+            count = len(self.days)
+            days_remaining = max((self.end - today).days, 0)
+            result = {
+                "b_year": self.b_year, "b_month": self.b_month,
+                "start": self.start.strftime("%Y-%m-%d"), "end": self.end.strftime("%Y-%m-%d"),
+                "days_remaining": days_remaining, "kwh": self.kwh, "cost": self.cost,
+                "tier": self.tier, "tier_left": self.tier_left, "tier_count": len(self.tiers),
+                "projected_kwh": None, "projected_cost": None, "projected_post_tax": None,
+            }
+            if not count: return result
+            avg = self.kwh / count
+            remaining_after_last = max((self.end - self.last_day).days, 0)
+            projected_kwh = self.kwh + avg * remaining_after_last
+            projected_cost = calculate_cost(projected_kwh, self.b_year, self.b_month, self.tariff)
+            vat_rate = get_vat_rate(self.end.year, self.end.month, self.end.day)
+            result.update({
+                "avg_kwh": avg, "projected_kwh": projected_kwh, "projected_cost": projected_cost,
+                "projected_post_tax": int(projected_cost * (1 + vat_rate)),
+            })
+            return result
+
+    def month_snapshot(self):
+        """Số liệu kỳ đang mở (không đọc DB), dùng cho sensor của kỳ này."""
+        with self.lock:
+            return {
+                "kwh": self.kwh, "cost": self.cost, "post_tax": self.post_tax, "vat": self.vat,
+                "start": self.start.strftime("%Y-%m-%d"), "end": self.end.strftime("%Y-%m-%d"),
+                "days": sorted(self.days.items()),
+            }
+
+    def total_snapshot(self):
+        """Tổng toàn thời gian và các năm = phần đã đóng + kỳ đang mở (không đọc DB)."""
+        with self.lock:
+            if not self.days and not self.total_base[3]: return None
+            t_kwh, t_money, t_post, t_months = self.total_base
+            has_open = 1 if self.days else 0
+            return {
+                "kwh": t_kwh + self.kwh, "months": t_months + has_open,
+                "start": self.first_date.strftime("%d/%m/%Y") if self.first_date else "N/A",
+                "end": self.last_date.strftime("%d/%m/%Y") if self.last_date else "N/A",
+                "money": t_money + self.cost, "post_tax": t_post + self.post_tax,
+                "vat": int(get_vat_rate(self.last_date.year, self.last_date.month, self.last_date.day) * 100) if self.last_date else 8,
+                "years": sorted(self.years.items(), reverse=True),
+            }
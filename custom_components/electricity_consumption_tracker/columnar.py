@@ -0,0 +1,416 @@
+"""Shared per-entry columnar cache read by the Electricity Consumption Tracker sensors."""
+import math
+import threading
+from array import array
+from datetime import date
+
+from .db import connect_db
+
+_NAN = math.nan
+
+
+def _ordinal(date_str):
+    try:
+        return date.fromisoformat(date_str).toordinal()
+    except (TypeError, ValueError):
+        return -1
+
+
+def _month_index(year, month):
+    return year * 12 + month - 1
+
+
+def _cover(base, columns, lo, hi):
+    """Mở rộng các mảng song song [(mảng, giá trị lấp)] để chỉ số lo..hi nằm trong mảng. Trả về base mới."""
+    size = len(columns[0][0])
+    if not size:
+        for arr, fill in columns: arr.extend([fill] * (hi - lo + 1))
+        return lo
+    head, tail = max(base - lo, 0), max(hi - base - size + 1, 0)
+    for arr, fill in columns:
+        if head: arr[0:0] = array(arr.typecode, [fill] * head)
+        if tail: arr.extend([fill] * tail)
+    return base - head
+
+
+class EntryColumns:
+    """Số liệu của một entry dưới dạng mảng (array) thay vì dict/attribute của từng entity.
+
+    - Ngày: day_kwh[ordinal - day_base] (NaN = không có dữ liệu).
+    - Kỳ: các mảng song song đánh chỉ số theo năm*12 + tháng - 1 - month_base.
+    - Năm: các mảng song song đánh chỉ số theo năm - year_base.
+
+    Sensor chỉ giữ khóa (năm, tháng) và tạo attribute khi HA cần ghi state.
+    Nạp toàn bộ bằng refresh() một lần (setup, rebuild, import); mỗi lần ghi sau đó chỉ
+    cập nhật các kỳ bị ảnh hưởng bằng read_periods() + apply().
+    """
+
+    __slots__ = (
+        "db_path", "lock", "loaded",
+        "day_base", "day_kwh",
+        "month_base", "month_kwh", "month_cost", "month_post", "month_vat", "month_start", "month_end",
+        "year_base", "year_kwh", "year_cost", "year_post", "year_vat",
+        "total", "yoy",
+    )
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.loaded = False
+
+        self.day_base = 0
+        self.day_kwh = array("d")
+
+        self.month_base = 0
+        self.month_kwh = array("d")
+        self.month_cost = array("d")
+        self.month_post = array("d")
+        self.month_vat = array("h")
+        self.month_start = array("l")
+        self.month_end = array("l")
+
+        self.year_base = 0
+        self.year_kwh = array("d")
+        self.year_cost = array("d")
+        self.year_post = array("d")
+        self.year_vat = array("h")
+
+        self.total = None
+        # Dòng yoy_comparison: (tháng kỳ, năm, kWh, tiền, chênh lệch năm trước, TB năm khác, chênh lệch TB)
+        self.yoy = ()
+
+    # --- LOAD ---
+
+    def refresh(self):
+        """Đọc lại toàn bộ từ DB (5 câu SQL cho cả entry, kể cả các năm đã nén). Trả về tập khóa đã thay đổi:
+        ("month", năm, tháng), ("year", năm), ("total",), ("yoy",).
+        """
+        conn = connect_db(self.db_path, read_only=True)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT nam, thang, tong_san_luong, thanh_tien, thanh_tien_sau_thue, vat, ngay_bat_dau, ngay_ket_thuc
+                FROM monthly_bill ORDER BY nam, thang
+            """)
+            month_rows = cursor.fetchall()
+            cursor.execute("SELECT nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat FROM yearly_bill ORDER BY nam")
+            year_rows = cursor.fetchall()
+            cursor.execute("""
+                SELECT tong_san_luong, tong_so_thang, thoi_diem_bat_dau, thoi_diem_ket_thuc,
+                       tong_tien_tich_luy, tong_tien_tich_luy_sau_thue, vat
+                FROM total_usage
+            """)
+            total = cursor.fetchone()
+            cursor.execute("SELECT nam, thang, ngay, san_luong FROM daily_values")
+            day_rows = cursor.fetchall()
+            cursor.execute("""
+                SELECT ky_thang, nam, san_luong, thanh_tien, chenh_lech_nam_truoc, trung_binh_nam_khac, chenh_lech_trung_binh
+                FROM yoy_comparison ORDER BY nam, ky_thang
+            """)
+            yoy_rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        new = EntryColumns(self.db_path)
+        new._fill(month_rows, year_rows, total, day_rows)
+        new.yoy = tuple(yoy_rows)
+
+        with self.lock:
+            changed = self._diff(new) if self.loaded else None
+            for name in ("day_base", "day_kwh", "month_base", "month_kwh", "month_cost", "month_post", "month_vat",
+                         "month_start", "month_end", "year_base", "year_kwh", "year_cost", "year_post", "year_vat",
+                         "total", "yoy"):
+                setattr(self, name, getattr(new, name))
+            self.loaded = True
+        return changed if changed is not None else set(new._keys())
+
+    def _fill(self, month_rows, year_rows, total, day_rows):
+        if day_rows:
+            ordinals = [date(r[0], r[1], r[2]).toordinal() for r in day_rows]
+            self.day_base = min(ordinals)
+            self.day_kwh = array("d", [_NAN]) * (max(ordinals) - self.day_base + 1)
+            for o, r in zip(ordinals, day_rows):
+                self.day_kwh[o - self.day_base] = r[3] or 0.0
+
+        if month_rows:
+            self.month_base = _month_index(month_rows[0][0], month_rows[0][1])
+            size = _month_index(month_rows[-1][0], month_rows[-1][1]) - self.month_base + 1
+            self.month_kwh = array("d", [_NAN]) * size
+            self.month_cost = array("d", [0.0]) * size
+            self.month_post = array("d", [0.0]) * size
+            self.month_vat = array("h", [8]) * size
+            self.month_start = array("l", [-1]) * size
+            self.month_end = array("l", [-1]) * size
+            for r in month_rows:
+                i = _month_index(r[0], r[1]) - self.month_base
+                self.month_kwh[i] = r[2] or 0.0
+                self.month_cost[i] = r[3] or 0
+                self.month_post[i] = r[4] or 0
+                self.month_vat[i] = r[5] if r[5] is not None else 8
+                self.month_start[i] = _ordinal(r[6])
+                self.month_end[i] = _ordinal(r[7])
+
+        if year_rows:
+            self.year_base = year_rows[0][0]
+            size = year_rows[-1][0] - self.year_base + 1
+            self.year_kwh = array("d", [_NAN]) * size
+            self.year_cost = array("d", [0.0]) * size
+            self.year_post = array("d", [0.0]) * size
+            self.year_vat = array("h", [8]) * size
+            for r in year_rows:
+                i = r[0] - self.year_base
+                self.year_kwh[i] = r[1] or 0.0
+                self.year_cost[i] = r[2] or 0
+                self.year_post[i] = r[3] or 0
+                self.year_vat[i] = r[4] if r[4] is not None else 8
+
+        self.total = tuple(total) if total else None
+
+    # --- INCREMENTAL ---
+
+    def read_periods(self, periods, cache=None):
+        """Đọc số liệu mới của các kỳ (ky_nam, ky_thang) vừa ghi (chạy trong executor).
+
+        Kỳ đang mở, các năm và tổng lấy từ OpenPeriodCache nếu cache đã nạp. Chỉ kỳ cũ được đọc lại
+        từ DB theo khoảng ngày của kỳ, cùng các dòng yoy_comparison của những tháng kỳ đó.
+        Kết quả đưa vào apply() trên event loop.
+        """
+        periods = sorted(set(periods))
+        open_key = (cache.b_year, cache.b_month) if cache is not None and cache.loaded else None
+        months = []
+        years = {}
+        total = None
+        if open_key is not None:
+            if open_key in periods:
+                snap = cache.month_snapshot()
+                months.append(open_key + (snap["kwh"], snap["cost"], snap["post_tax"], snap["vat"],
+                                          _ordinal(snap["start"]), _ordinal(snap["end"]),
+                                          [(d.toordinal(), v) for d, v in snap["days"]]))
+            snap = cache.total_snapshot()
+            if snap is not None:
+                total = (snap["kwh"], snap["months"], snap["start"], snap["end"], snap["money"], snap["post_tax"], snap["vat"])
+                all_years = dict(snap["years"])
+                years = {y: all_years.get(y) for y in {p[0] for p in periods}}
+
+        conn = connect_db(self.db_path, read_only=True)
+        try:
+            cursor = conn.cursor()
+            for b_year, b_month in periods:
+                if (b_year, b_month) == open_key: continue
+                cursor.execute("""
+                    SELECT tong_san_luong, thanh_tien, thanh_tien_sau_thue, vat, ngay_bat_dau, ngay_ket_thuc
+                    FROM monthly_bill WHERE nam = ? AND thang = ?
+                """, (b_year, b_month))
+                row = cursor.fetchone()
+                if row is None:
+                    months.append((b_year, b_month, None, 0, 0, 8, -1, -1, []))
+                    continue
+                start, end = _ordinal(row[4]), _ordinal(row[5])
+                days = []
+                if start > 0 and end > 0:
+                    s, e = date.fromordinal(start), date.fromordinal(end)
+                    # Điều kiện theo nam giúp SQLite chỉ giải nén năm đã nén nằm trong kỳ (nếu có)
+                    cursor.execute("""
+                        SELECT nam, thang, ngay, san_luong FROM daily_values
+                        WHERE nam BETWEEN ? AND ? AND (nam, thang, ngay) BETWEEN (?, ?, ?) AND (?, ?, ?)
+                    """, (s.year, e.year, s.year, s.month, s.day, e.year, e.month, e.day))
+                    days = [(date(r[0], r[1], r[2]).toordinal(), r[3] or 0.0) for r in cursor.fetchall()]
+                months.append((b_year, b_month, row[0] or 0.0, row[1] or 0, row[2] or 0,
+                               row[3] if row[3] is not None else 8, start, end, days))
+
+            if open_key is None:
+                touched = sorted({p[0] for p in periods})
+                if touched:
+                    cursor.execute(f"""
+                        SELECT nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat FROM yearly_bill
+                        WHERE nam IN ({", ".join("?" * len(touched))})
+                    """, touched)
+                    found = {r[0]: r[1:] for r in cursor.fetchall()}
+                    years = {y: found.get(y) for y in touched}
+                cursor.execute("""
+                    SELECT tong_san_luong, tong_so_thang, thoi_diem_bat_dau, thoi_diem_ket_thuc,
+                           tong_tien_tich_luy, tong_tien_tich_luy_sau_thue, vat
+                    FROM total_usage
+                """)
+                total = cursor.fetchone()
+
+            yoy_months = sorted({p[1] for p in periods})
+            yoy_rows = []
+            if yoy_months:
+                cursor.execute(f"""
+                    SELECT ky_thang, nam, san_luong, thanh_tien, chenh_lech_nam_truoc, trung_binh_nam_khac, chenh_lech_trung_binh
+                    FROM yoy_comparison WHERE ky_thang IN ({", ".join("?" * len(yoy_months))})
+                """, yoy_months)
+                yoy_rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        return {"months": months, "years": years, "total": tuple(total) if total else None,
+                "yoy_months": set(yoy_months), "yoy": yoy_rows}
+
+    def apply(self, delta):
+        """Ghi kết quả read_periods() vào các mảng tại chỗ (trên event loop). Trả về tập khóa đã thay đổi."""
+        changed = set()
+        with self.lock:
+            for b_year, b_month, kwh, cost, post, vat, start, end, days in delta["months"]:
+                i = _month_index(b_year, b_month) - self.month_base
+                had = 0 <= i < len(self.month_kwh) and not math.isnan(self.month_kwh[i])
+                before = self._month_fingerprint(i) if had else None
+                if had:
+                    # Xóa ngày cũ của kỳ trước khi điền lại (ngày bị bỏ khỏi entry ảo)
+                    lo, hi = self.month_start[i], self.month_end[i]
+                    for o in range(max(lo, self.day_base), min(hi, self.day_base + len(self.day_kwh) - 1) + 1):
+                        self.day_kwh[o - self.day_base] = _NAN
+                    if kwh is None: self.month_kwh[i] = _NAN
+                if kwh is not None:
+                    index = _month_index(b_year, b_month)
+                    self.month_base = _cover(self.month_base, self._month_columns(), index, index)
+                    i = index - self.month_base
+                    self.month_kwh[i], self.month_cost[i], self.month_post[i] = kwh, cost, post
+                    self.month_vat[i], self.month_start[i], self.month_end[i] = vat, start, end
+                    if days:
+                        self.day_base = _cover(self.day_base, ((self.day_kwh, _NAN),), days[0][0], days[-1][0])
+                        for o, v in days: self.day_kwh[o - self.day_base] = v
+                if before != (self._month_fingerprint(i) if kwh is not None else None):
+                    changed.add(("month", b_year, b_month))
+                    # Năm có tháng thay đổi cũng phải ghi lại (attribute chi_tiet_cac_thang)
+                    changed.add(("year", b_year))
+
+            for year, row in delta["years"].items():
+                i = year - self.year_base
+                had = 0 <= i < len(self.year_kwh) and not math.isnan(self.year_kwh[i])
+                before = self._year_fingerprint(i) if had else None
+                if row is None:
+                    if had: self.year_kwh[i] = _NAN
+                else:
+                    self.year_base = _cover(self.year_base, self._year_columns(), year, year)
+                    i = year - self.year_base
+                    self.year_kwh[i], self.year_cost[i], self.year_post[i] = row[0] or 0.0, row[1] or 0, row[2] or 0
+                    self.year_vat[i] = row[3] if row[3] is not None else 8
+                if before != (self._year_fingerprint(i) if row is not None else None):
+                    changed.add(("year", year))
+
+            if delta["total"] != self.total:
+                self.total = delta["total"]
+                changed.add(("total",))
+
+            yoy_months = delta["yoy_months"]
+            yoy = [r for r in self.yoy if r[0] not in yoy_months] + [tuple(r) for r in delta["yoy"]]
+            yoy = tuple(sorted(yoy, key=lambda r: (r[1], r[0])))
+            if yoy != self.yoy:
+                self.yoy = yoy
+                changed.add(("yoy",))
+        return changed
+
+    def _month_columns(self):
+        return ((self.month_kwh, _NAN), (self.month_cost, 0.0), (self.month_post, 0.0), (self.month_vat, 8),
+                (self.month_start, -1), (self.month_end, -1))
+
+    def _year_columns(self):
+        return ((self.year_kwh, _NAN), (self.year_cost, 0.0), (self.year_post, 0.0), (self.year_vat, 8))
+
+    # --- DIFF ---
+
+    def _keys(self):
+        for i, kwh in enumerate(self.month_kwh):
+            if not math.isnan(kwh):
+                y, m0 = divmod(self.month_base + i, 12)
+                yield ("month", y, m0 + 1)
+        for i, kwh in enumerate(self.year_kwh):
+            if not math.isnan(kwh): yield ("year", self.year_base + i)
+        yield ("total",)
+        yield ("yoy",)
+
+    def _month_fingerprint(self, i):
+        start, end = self.month_start[i], self.month_end[i]
+        days = self.day_kwh[max(start - self.day_base, 0):max(end - self.day_base + 1, 0)] if start >= 0 else b""
+        return (self.month_kwh[i], self.month_cost[i], self.month_post[i], self.month_vat[i], start, end,
+                bytes(days))
+
+    def _year_fingerprint(self, i):
+        return (self.year_kwh[i], self.year_cost[i], self.year_post[i], self.year_vat[i])
+
+    def _diff(self, new):
+        old_months = {k: self._month_fingerprint(_month_index(k[1], k[2]) - self.month_base)
+                      for k in self._keys() if k[0] == "month"}
+        old_years = {k: self._year_fingerprint(k[1] - self.year_base) for k in self._keys() if k[0] == "year"}
+        changed = set()
+        for k in new._keys():
+            if k[0] == "month":
+                if old_months.get(k) != new._month_fingerprint(_month_index(k[1], k[2]) - new.month_base):
+                    changed.add(k)
+            elif k[0] == "year":
+                if old_years.get(k) != new._year_fingerprint(k[1] - new.year_base):
+                    changed.add(k)
+        if self.total != new.total:
+            changed.add(("total",))
+        if self.yoy != new.yoy:
+            changed.add(("yoy",))
+        # Năm có tháng thay đổi cũng phải ghi lại (attribute chi_tiet_cac_thang)
+        changed |= {("year", k[1]) for k in changed if k[0] == "month"}
+        return changed
+
+    # --- READ (sensor) ---
+
+    def month(self, year, month):
+        """(tiền trước thuế, kWh, tiền sau thuế, vat, ngày bắt đầu, ngày kết thúc) hoặc None."""
+        i = _month_index(year, month) - self.month_base
+        if i < 0 or i >= len(self.month_kwh) or math.isnan(self.month_kwh[i]): return None
+        start, end = self.month_start[i], self.month_end[i]
+        return (self.month_cost[i], self.month_kwh[i], self.month_post[i], self.month_vat[i],
+                date.fromordinal(start).strftime("%Y-%m-%d") if start > 0 else "N/A",
+                date.fromordinal(end).strftime("%Y-%m-%d") if end > 0 else "N/A")
+
+    def month_days(self, year, month):
+        """[(ngày trong tháng, kWh)] của kỳ, theo thứ tự ngày."""
+        i = _month_index(year, month) - self.month_base
+        if i < 0 or i >= len(self.month_kwh): return []
+        start, end = self.month_start[i], self.month_end[i]
+        if start <= 0 or end <= 0:
+            # Dòng cũ chưa có ngày bắt đầu/kết thúc: lấy theo tháng dương lịch
+            start = date(year, month, 1).toordinal()
+            end = (date(year + month // 12, month % 12 + 1, 1)).toordinal() - 1
+        result = []
+        for o in range(max(start, self.day_base), min(end, self.day_base + len(self.day_kwh) - 1) + 1):
+            v = self.day_kwh[o - self.day_base]
+            if not math.isnan(v): result.append((date.fromordinal(o).day, v))
+        return result
+
+    def month_series(self, year, month):
+        """(ngày bắt đầu kỳ, [kWh từng ngày liên tiếp, None = thiếu]) cho định dạng gọn."""
+        i = _month_index(year, month) - self.month_base
+        if i < 0 or i >= len(self.month_kwh): return None, []
+        start, end = self.month_start[i], self.month_end[i]
+        if start <= 0 or end <= 0: return None, []
+        values = []
+        for o in range(start, end + 1):
+            j = o - self.day_base
+            v = self.day_kwh[j] if 0 <= j < len(self.day_kwh) else _NAN
+            values.append(None if math.isnan(v) else round(v, 2))
+        while values and values[-1] is None: values.pop()
+        return date.fromordinal(start).strftime("%Y-%m-%d"), values
+
+    def year(self, year):
+        """(tiền trước thuế, kWh, tiền sau thuế, vat) hoặc None."""
+        i = year - self.year_base
+        if i < 0 or i >= len(self.year_kwh) or math.isnan(self.year_kwh[i]): return None
+        return self.year_cost[i], self.year_kwh[i], self.year_post[i], self.year_vat[i]
+
+    def year_months(self, year):
+        """[(tháng, kWh, tiền trước thuế, tiền sau thuế)] của năm."""
+        result = []
+        for month in range(1, 13):
+            i = _month_index(year, month) - self.month_base
+            if 0 <= i < len(self.month_kwh) and not math.isnan(self.month_kwh[i]):
+                result.append((month, self.month_kwh[i], self.month_cost[i], self.month_post[i]))
+        return result
+
+    def years(self):
+        """[(năm, kWh, tiền trước thuế, tiền sau thuế, vat)] mới nhất trước."""
+        return [(self.year_base + i, self.year_kwh[i], self.year_cost[i], self.year_post[i], self.year_vat[i])
+                for i in range(len(self.year_kwh) - 1, -1, -1) if not math.isnan(self.year_kwh[i])]
+
+    def periods(self):
+        """Các năm và (năm, tháng) đang có số liệu, để tạo sensor mới."""
+        months = [(k[1], k[2]) for k in self._keys() if k[0] == "month"]
+        return sorted(set(y for y, _m in months), reverse=True), months[::-1]
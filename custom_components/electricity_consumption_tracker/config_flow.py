@@ -5,24 +5,84 @@ from homeassistant.core import callback
 from homeassistant.helpers import selector
 from .const import (
     DOMAIN, CONF_SOURCE_SENSOR, CONF_UPDATE_INTERVAL, CONF_FRIENDLY_NAME,
-    CONF_BILLING_DAY, CONF_START_DATE_APPLY
+    CONF_BILLING_DAY, CONF_START_DATE_APPLY,
+    CONF_TARIFF_TYPE, CONF_FIXED_PRICE, CONF_TOU_PEAK_SHARE, CONF_TOU_OFFPEAK_SHARE,
+    TARIFF_RESIDENTIAL, TARIFF_TYPES,
+    CONF_ENTRY_TYPE, CONF_CHILD_ENTRIES, ENTRY_TYPE_METER, ENTRY_TYPE_VIRTUAL,
+    CONF_COMPACT_ATTRIBUTES, CONF_HOURLY_HISTORY, CONF_HOURLY_RETENTION_DAYS, HOURLY_RETENTION_DAYS_DEFAULT,
+    CONF_SOURCE_TYPE, SOURCE_TYPE_TODAY, SOURCE_TYPE_YESTERDAY
 )
+from .virtual import children_map, containers_of, cyclic_children
+
+def tariff_schema(defaults):
+    """Các trường chọn biểu giá, dùng chung cho bước tạo và options."""
+    return {
+        vol.Required(CONF_TARIFF_TYPE, default=defaults.get(CONF_TARIFF_TYPE, TARIFF_RESIDENTIAL)): selector.SelectSelector({
+            "options": TARIFF_TYPES, "mode": "dropdown"
+        }),
+        vol.Optional(CONF_FIXED_PRICE, default=defaults.get(CONF_FIXED_PRICE, 0)): selector.NumberSelector({
+            "min": 0, "step": 1, "unit_of_measurement": "đ/kWh", "mode": "box"
+        }),
+        vol.Optional(CONF_TOU_PEAK_SHARE, default=defaults.get(CONF_TOU_PEAK_SHARE, 20)): selector.NumberSelector({
+            "min": 0, "max": 100, "step": 1, "unit_of_measurement": "%", "mode": "box"
+        }),
+        vol.Optional(CONF_TOU_OFFPEAK_SHARE, default=defaults.get(CONF_TOU_OFFPEAK_SHARE, 30)): selector.NumberSelector({
+            "min": 0, "max": 100, "step": 1, "unit_of_measurement": "%", "mode": "box"
+        }),
+    }
+
+def source_type_selector():
+    """Sensor nguồn báo sản lượng hôm nay (tăng dần trong ngày) hay sản lượng của ngày hôm qua."""
+    return selector.SelectSelector({
+        "options": [
+            {"value": SOURCE_TYPE_TODAY, "label": "Sản lượng hôm nay (tăng dần trong ngày)"},
+            {"value": SOURCE_TYPE_YESTERDAY, "label": "Sản lượng hôm qua (ví dụ sensor EVN)"},
+        ],
+        "mode": "dropdown"
+    })
+
+def child_entries_selector(hass, exclude_entry_id=None):
+    """Chọn nhiều entry con, không gồm chính entry ảo đang sửa và các entry ảo đang chứa nó (tránh vòng)."""
+    entries = hass.config_entries.async_entries(DOMAIN)
+    excluded = {exclude_entry_id} | containers_of(exclude_entry_id, children_map(entries)) if exclude_entry_id else set()
+    return selector.SelectSelector({
+        "options": [
+            {"value": e.entry_id, "label": e.title}
+            for e in entries if e.entry_id not in excluded
+        ],
+        "multiple": True, "mode": "list"
+    })
 
 class ConsumptionTrackerConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
 
     async def async_step_user(self, user_input=None):
+        # Chưa có entry nào thì không thể tạo entry ảo
+        if not self._async_current_entries():
+            return await self.async_step_meter()
+        return self.async_show_menu(
+            step_id="user",
+            menu_options={
+                "meter": "Thiết bị đo (sensor nguồn)",
+                "virtual": "Entry ảo (tổng của nhiều thiết bị)",
+            }
+        )
+
+    async def async_step_meter(self, user_input=None):
         errors = {}
         if user_input is not None:
-            return self.async_create_entry(title=user_input[CONF_FRIENDLY_NAME], data=user_input)
+            return self.async_create_entry(
+                title=user_input[CONF_FRIENDLY_NAME], data={**user_input, CONF_ENTRY_TYPE: ENTRY_TYPE_METER}
+            )
 
         return self.async_show_form(
-            step_id="user",
+            step_id="meter",
             data_schema=vol.Schema({
                 vol.Required(CONF_FRIENDLY_NAME, default="Electricity Home"): str,
                 vol.Required(CONF_SOURCE_SENSOR): selector.EntitySelector({
                     "domain": "sensor"
                 }),
+                vol.Required(CONF_SOURCE_TYPE, default=SOURCE_TYPE_TODAY): source_type_selector(),
                 vol.Required(CONF_UPDATE_INTERVAL, default=1): selector.NumberSelector({
                     "min": 1, "max": 24, "step": 1, "unit_of_measurement": "giờ", "mode": "box"
                 }),
@@ -30,6 +90,30 @@ class ConsumptionTrackerConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Required(CONF_BILLING_DAY, default=1): selector.NumberSelector({
                     "min": 1, "max": 28, "mode": "box"
                 }),
+                **tariff_schema({}),
+            }),
+            errors=errors
+        )
+
+    async def async_step_virtual(self, user_input=None):
+        errors = {}
+        if user_input is not None:
+            if not user_input.get(CONF_CHILD_ENTRIES):
+                errors[CONF_CHILD_ENTRIES] = "no_children"
+            else:
+                return self.async_create_entry(
+                    title=user_input[CONF_FRIENDLY_NAME], data={**user_input, CONF_ENTRY_TYPE: ENTRY_TYPE_VIRTUAL}
+                )
+
+        return self.async_show_form(
+            step_id="virtual",
+            data_schema=vol.Schema({
+                vol.Required(CONF_FRIENDLY_NAME, default="Tổng nhà"): str,
+                vol.Required(CONF_CHILD_ENTRIES, default=[]): child_entries_selector(self.hass),
+                vol.Required(CONF_BILLING_DAY, default=1): selector.NumberSelector({
+                    "min": 1, "max": 28, "mode": "box"
+                }),
+                **tariff_schema({}),
             }),
             errors=errors
         )
@@ -44,8 +128,16 @@ class ConsumptionTrackerOptionsFlowHandler(config_entries.OptionsFlow):
         self._config_entry = config_entry 
 
     async def async_step_init(self, user_input=None):
+        errors = {}
         if user_input is not None:
-            return self.async_create_entry(title="", data=user_input)
+            # Danh sách có thể đã cũ (entry ảo khác vừa được sửa): kiểm tra lại vòng trước khi lưu
+            children_of = children_map(self.hass.config_entries.async_entries(DOMAIN))
+            if cyclic_children(self._config_entry.entry_id, user_input.get(CONF_CHILD_ENTRIES, []), children_of):
+                errors[CONF_CHILD_ENTRIES] = "child_cycle"
+            elif self._config_entry.data.get(CONF_ENTRY_TYPE) == ENTRY_TYPE_VIRTUAL and not user_input.get(CONF_CHILD_ENTRIES):
+                errors[CONF_CHILD_ENTRIES] = "no_children"
+            else:
+                return self.async_create_entry(title="", data=user_input)
 
         current_interval = self._config_entry.options.get(
             CONF_UPDATE_INTERVAL, self._config_entry.data.get(CONF_UPDATE_INTERVAL, 1)
@@ -60,6 +152,34 @@ class ConsumptionTrackerOptionsFlowHandler(config_entries.OptionsFlow):
         current_apply_date = self._config_entry.options.get(
             CONF_START_DATE_APPLY, self._config_entry.data.get(CONF_START_DATE_APPLY, "2024-01-01")
         )
+        # [NEW] Định dạng attribute gọn cho biểu đồ (mặc định tắt để không vỡ thẻ cũ)
+        current_compact = self._config_entry.options.get(CONF_COMPACT_ATTRIBUTES, False)
+        current_source_type = self._config_entry.options.get(
+            CONF_SOURCE_TYPE, self._config_entry.data.get(CONF_SOURCE_TYPE, SOURCE_TYPE_TODAY)
+        )
+        # [NEW] Lưu sản lượng theo giờ (chỉ thiết bị đo, mặc định tắt)
+        current_hourly = self._config_entry.options.get(CONF_HOURLY_HISTORY, False)
+        current_retention = self._config_entry.options.get(CONF_HOURLY_RETENTION_DAYS, HOURLY_RETENTION_DAYS_DEFAULT)
+
+        if self._config_entry.data.get(CONF_ENTRY_TYPE) == ENTRY_TYPE_VIRTUAL:
+            current_children = self._config_entry.options.get(
+                CONF_CHILD_ENTRIES, self._config_entry.data.get(CONF_CHILD_ENTRIES, [])
+            )
+            return self.async_show_form(
+                step_id="init",
+                data_schema=vol.Schema({
+                    vol.Required(CONF_CHILD_ENTRIES, default=current_children): child_entries_selector(
+                        self.hass, self._config_entry.entry_id
+                    ),
+                    vol.Required(CONF_BILLING_DAY, default=current_billing_day): selector.NumberSelector({
+                        "min": 1, "max": 28, "mode": "box"
+                    }),
+                    vol.Required(CONF_START_DATE_APPLY, default=current_apply_date): selector.TextSelector(),
+                    **tariff_schema({**self._config_entry.data, **self._config_entry.options}),
+                    vol.Optional(CONF_COMPACT_ATTRIBUTES, default=current_compact): selector.BooleanSelector(),
+                }),
+                errors=errors
+            )
 
         return self.async_show_form(
             step_id="init",
@@ -67,6 +187,7 @@ class ConsumptionTrackerOptionsFlowHandler(config_entries.OptionsFlow):
                 vol.Required(CONF_SOURCE_SENSOR, default=current_sensor): selector.EntitySelector({
                     "domain": "sensor"
                 }),
+                vol.Required(CONF_SOURCE_TYPE, default=current_source_type): source_type_selector(),
                 vol.Required(CONF_UPDATE_INTERVAL, default=current_interval): selector.NumberSelector({
                     "min": 1, "max": 24, "step": 1, "unit_of_measurement": "giờ", "mode": "box"
                 }),
@@ -74,5 +195,11 @@ class ConsumptionTrackerOptionsFlowHandler(config_entries.OptionsFlow):
                     "min": 1, "max": 28, "mode": "box"
                 }),
                 vol.Required(CONF_START_DATE_APPLY, default=current_apply_date): selector.TextSelector(),
+                **tariff_schema({**self._config_entry.data, **self._config_entry.options}),
+                vol.Optional(CONF_COMPACT_ATTRIBUTES, default=current_compact): selector.BooleanSelector(),
+                vol.Optional(CONF_HOURLY_HISTORY, default=current_hourly): selector.BooleanSelector(),
+                vol.Optional(CONF_HOURLY_RETENTION_DAYS, default=current_retention): selector.NumberSelector({
+                    "min": 7, "max": 3650, "step": 1, "unit_of_measurement": "ngày", "mode": "box"
+                }),
             })
         )
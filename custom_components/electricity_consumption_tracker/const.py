@@ -10,7 +10,7 @@ CONF_FRIENDLY_NAME = "friendly_name"
 CONF_BILLING_DAY = "billing_day"
 CONF_START_DATE_APPLY = "start_date_apply"
 
-# Lịch sử thuế VAT
+# Lịch sử thuế VAT (mặc định; giá trị đang dùng: tariff.get_vat_rate)
 VAT_HISTORY = {
     "2019-01-01": 0.10,
     "2022-02-01": 0.08, 
@@ -20,20 +20,70 @@ VAT_HISTORY = {
     "2026-01-01": 0.08  
 }
 
-def get_vat_rate(year, month, day):
-    target_date = f"{year}-{month:02d}-{day:02d}"
-    valid_dates = [d for d in VAT_HISTORY if d <= target_date]
-    if not valid_dates:
-        return VAT_HISTORY[sorted(VAT_HISTORY.keys())[0]]
-    else:
-        return VAT_HISTORY[sorted(valid_dates)[-1]]
-
 # Biểu giá điện sinh hoạt (EVN)
+# Bảng mặc định; khi chạy, tariff.py dùng bản sao được thay bằng nội dung file tariffs.json/tariffs.yaml
+# trong thư mục dữ liệu (xem tariff.apply_tariff_tables)
 PRICE_HISTORY = {
     "2019-03-20": [(50, 1678), (50, 1734), (100, 2014), (100, 2536), (100, 2834), (float('inf'), 2927)],
-    "2023-05-04": [(50, 1806), (50, 1866), (100, 2167), (100, 2729), (100, 3050), (float('inf'), 3151)],
+    "2023-05-04": [(50, 1728), (50, 1786), (100, 2074), (100, 2612), (100, 2919), (float('inf'), 3015)],
+    "2023-11-09": [(50, 1806), (50, 1866), (100, 2167), (100, 2729), (100, 3050), (float('inf'), 3151)],
     "2024-10-11": [(50, 1893), (50, 1956), (100, 2271), (100, 2860), (100, 3197), (float('inf'), 3302)],
     "2025-05-10": [(50, 1984), (50, 2050), (100, 2380), (100, 2998), (100, 3350), (float('inf'), 3460)]
 }
 
+# [NEW] Loại biểu giá theo từng entry
+CONF_TARIFF_TYPE = "tariff_type"
+CONF_FIXED_PRICE = "fixed_price"
+CONF_TOU_PEAK_SHARE = "tou_peak_share"
+CONF_TOU_OFFPEAK_SHARE = "tou_offpeak_share"
+
+TARIFF_RESIDENTIAL = "residential"
+TARIFF_TIME_OF_USE = "time_of_use"
+TARIFF_FIXED = "fixed"
+TARIFF_TYPES = [TARIFF_RESIDENTIAL, TARIFF_TIME_OF_USE, TARIFF_FIXED]
+
+# Biểu giá điện kinh doanh theo giờ (cấp điện áp dưới 6 kV): (bình thường, thấp điểm, cao điểm)
+TOU_PRICE_HISTORY = {
+    "2024-10-11": (3007, 1830, 5174),
+    "2025-05-10": (3152, 1918, 5422)
+}
+
 SIGNAL_UPDATE_SENSORS = "electricity_consumption_tracker_update_signal"
+
+# [NEW] Sự kiện khi kỳ hóa đơn đang mở sang bậc giá cao hơn
+EVENT_TIER_CHANGED = f"{DOMAIN}_tier_changed"
+
+# [NEW] Rebuild lịch sử chạy trên pool riêng (hass.data[DATA_REBUILD_SCHEDULER]), báo tiến độ qua sự kiện
+DATA_REBUILD_SCHEDULER = f"{DOMAIN}_rebuild_scheduler"
+EVENT_REBUILD_PROGRESS = f"{DOMAIN}_rebuild_progress"
+
+# [NEW] Entry ảo: cộng sản lượng ngày của các entry con (ví dụ "Tổng nhà")
+CONF_ENTRY_TYPE = "entry_type"
+CONF_CHILD_ENTRIES = "child_entries"
+ENTRY_TYPE_METER = "meter"
+ENTRY_TYPE_VIRTUAL = "virtual"
+# Gửi (entry_id, [date]) mỗi khi một entry ghi/sửa sản lượng ngày
+SIGNAL_DAYS_CHANGED = f"{DOMAIN}_days_changed"
+
+# [NEW] Định dạng attribute gọn (tùy chọn): ngày/kỳ bắt đầu + mảng giá trị thay cho dict Ngay_XX/Thang_XX/Nam_XXXX
+CONF_COMPACT_ATTRIBUTES = "compact_attributes"
+ATTR_SCHEMA_VERSION = "schema_version"
+SCHEMA_VERSION_LEGACY = 1
+SCHEMA_VERSION_COMPACT = 2
+
+# [NEW] Sự kiện khi một ngày đã hoàn tất (hoặc được override) có sản lượng bất thường
+EVENT_ANOMALY_DETECTED = f"{DOMAIN}_anomaly_detected"
+
+# [NEW] Lưu sản lượng theo giờ (tùy chọn); giờ cũ hơn số ngày giữ lại được gộp thành hồ sơ theo tháng
+CONF_HOURLY_HISTORY = "hourly_history"
+CONF_HOURLY_RETENTION_DAYS = "hourly_retention_days"
+HOURLY_RETENTION_DAYS_DEFAULT = 90
+
+# [NEW] Bản chụp DB (online backup) cho HA backup và dịch vụ backup_data; khóa tránh hai lần chụp chồng nhau
+BACKUP_DIR = "electricity_consumption_tracker/backup"
+DATA_BACKUP_LOCK = f"{DOMAIN}_backup_lock"
+
+# [NEW] Loại sensor nguồn: sản lượng hôm nay (tăng dần, mặc định) hoặc sản lượng hôm qua (ví dụ sensor EVN)
+CONF_SOURCE_TYPE = "source_type"
+SOURCE_TYPE_TODAY = "today"
+SOURCE_TYPE_YESTERDAY = "yesterday"
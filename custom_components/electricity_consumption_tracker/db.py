@@ -0,0 +1,470 @@
+"""SQLite helpers for the Electricity Consumption Tracker integration."""
+import json
+import math
+import os
+import sqlite3
+import struct
+import sys
+from array import array
+from datetime import date, timedelta
+
+# Tinh chỉnh SQLite: đọc qua mmap, cache trang lớn hơn mặc định (~2MB)
+MMAP_SIZE = 64 * 1024 * 1024
+CACHE_SIZE_KIB = 8192
+BUSY_TIMEOUT = 10
+
+# Checkpoint WAL định kỳ, chỉ chạy khi entry không ghi trong CHECKPOINT_IDLE_SECONDS
+CHECKPOINT_INTERVAL_MINUTES = 15
+CHECKPOINT_IDLE_SECONDS = 120
+CHECKPOINT_BUSY_TIMEOUT_MS = 1000
+
+# Cột của idx_daily_usage_ky: SUM/COUNT/checksum theo kỳ qua view daily_values chỉ đọc index.
+# Có cả don_vi vì SQLite không bỏ cột không dùng của view UNION ALL khi chọn covering index.
+DAILY_KY_INDEX_COLUMNS = ("ky_nam", "ky_thang", "nam", "thang", "ngay", "san_luong", "don_vi")
+
+# Năm dương lịch cũ hơn cửa sổ nóng được nén thành 1 blob float64 / năm trong daily_archive.
+# float64 giữ nguyên giá trị REAL của SQLite: tổng, checksum của kỳ/năm không đổi sau khi nén.
+# Giữ năm hiện tại và năm trước ở dạng dòng: mọi kỳ chạm tới năm đã nén đều đã đóng.
+ARCHIVE_HOT_YEARS = 2
+# Blob float32 của bản cũ được làm tròn chừng này chữ số khi chuyển sang float64 (giống cách đọc cũ)
+ARCHIVE_LEGACY_DECIMALS = 3
+# Chạy nén + incremental vacuum mỗi ngày vào giờ này (giờ địa phương)
+COMPACT_HOUR = 3
+COMPACT_MINUTE = 30
+
+
+def billing_period_sql(billing_day, apply_date, nam="nam", thang="thang", ngay="ngay"):
+    """Biểu thức SQL (ky_nam, ky_thang) tương đương billing.get_billing_period."""
+    shifted = (f"({billing_day} > 1 AND printf('%04d-%02d-%02d', {nam}, {thang}, {ngay}) >= {apply_date} "
+               f"AND {ngay} >= {billing_day})")
+    ky_nam = f"CASE WHEN {shifted} AND {thang} = 12 THEN {nam} + 1 ELSE {nam} END"
+    ky_thang = f"CASE WHEN {shifted} THEN {thang} % 12 + 1 ELSE {thang} END"
+    return ky_nam, ky_thang
+
+
+# Đọc daily_usage qua view này: gộp dòng nóng và các năm đã nén (dòng nóng ưu tiên
+# nếu một ngày của năm đã nén bị ghi đè lại). View là TEMP nên chỉ cần hàm Python
+# trên kết nối hiện tại, DB vẫn mở được bằng công cụ SQLite khác.
+# Nhánh nén là một phép join phẳng daily_archive x archive_calendar: điều kiện trên `nam`
+# được SQLite đẩy xuống thành tìm theo khóa chính của daily_archive, nên chỉ giải mã các năm
+# truy vấn có thể chạm tới. Truy vấn theo kỳ thêm điều kiện nam (archive_years_sql).
+# Kỳ của các ngày đã nén được suy ra từ billing_config.
+DAILY_VIEW = "daily_values"
+_ARCHIVE_KY = billing_period_sql(
+    "COALESCE((SELECT billing_day FROM main.billing_config WHERE id = 1), 1)",
+    "COALESCE((SELECT apply_date FROM main.billing_config WHERE id = 1), '')",
+    "a.nam", "k.thang", "k.ngay"
+)
+_DAILY_VIEW_SQL = f"""
+    CREATE TEMP VIEW IF NOT EXISTS {DAILY_VIEW} AS
+    SELECT nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang FROM main.daily_usage
+    UNION ALL
+    SELECT a.nam, k.thang, k.ngay, ect_archive_value(a.du_lieu, k.i), 'kWh', {_ARCHIVE_KY[0]}, {_ARCHIVE_KY[1]}
+    FROM main.daily_archive a
+    JOIN main.archive_calendar k ON k.so_ngay = a.so_ngay
+    WHERE ect_archive_value(a.du_lieu, k.i) IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM main.daily_usage u WHERE u.nam = a.nam AND u.thang = k.thang AND u.ngay = k.ngay
+    )
+"""
+
+
+def archive_years_sql(ky_from, ky_to, nam="nam"):
+    """Điều kiện nam tương ứng với ky_nam trong [ky_from, ky_to] (tham số SQL hoặc số).
+
+    Ngày của năm N thuộc kỳ năm N hoặc N + 1, nên điều kiện này không bỏ sót dòng nào
+    mà giúp view daily_values bỏ qua các năm đã nén nằm ngoài khoảng.
+    """
+    return f"{nam} BETWEEN {ky_from} - 1 AND {ky_to}"
+
+
+def day_bounds(cursor):
+    """(ngày đầu tiên, ngày cuối cùng) có dữ liệu, kể cả năm đã nén, hoặc (None, None).
+
+    Đọc thẳng daily_usage (theo khóa chính) và daily_archive (chỉ giải mã năm đầu/năm cuối),
+    không ORDER BY qua view.
+    """
+    cursor.execute("SELECT nam, thang, ngay FROM daily_usage ORDER BY nam, thang, ngay LIMIT 1")
+    hot_first = cursor.fetchone()
+    cursor.execute("SELECT nam, thang, ngay FROM daily_usage ORDER BY nam DESC, thang DESC, ngay DESC LIMIT 1")
+    hot_last = cursor.fetchone()
+    firsts, lasts = [], []
+    if hot_first: firsts.append(date(*hot_first))
+    if hot_last: lasts.append(date(*hot_last))
+    for order, out in (("ASC", firsts), ("DESC", lasts)):
+        cursor.execute(f"SELECT nam, du_lieu FROM daily_archive WHERE so_ngay_co_du_lieu > 0 ORDER BY nam {order} LIMIT 1")
+        row = cursor.fetchone()
+        if row is None: continue
+        index = [i for i, v in enumerate(unpack_year(row[1])) if v is not None]
+        if index: out.append(date(row[0], 1, 1) + timedelta(days=index[0] if order == "ASC" else index[-1]))
+    return (min(firsts) if firsts else None), (max(lasts) if lasts else None)
+
+
+def entry_db_path(storage_dir, entry_id):
+    return os.path.join(storage_dir, f"electricity_data_{entry_id}.db")
+
+
+def connect_db(db_path, read_only=False):
+    """Mở kết nối đã tinh chỉnh. Luồng đọc dùng read_only=True (mode=ro)."""
+    if read_only:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+    else:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    if not read_only:
+        # An toàn với WAL, giảm fsync cho mỗi tick
+        conn.execute("PRAGMA synchronous=NORMAL")
+    _install_daily_view(conn)
+    return conn
+
+
+def _install_daily_view(conn):
+    conn.create_function("ect_archive_value", 2, _archive_value, deterministic=True)
+    ready = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='archive_calendar'"
+    ).fetchone()
+    # DB chưa init/migrate (lần mở đầu tiên) thì chưa có view; init_db không cần đọc qua view
+    if ready: conn.execute(_DAILY_VIEW_SQL)
+
+
+def sync_billing_config(cursor, billing_day, apply_date_str):
+    """Ghi billing_config và cập nhật ky_nam/ky_thang của daily_usage bằng 1 câu UPDATE.
+
+    Cấu hình đổi thì tính lại mọi dòng, ngược lại chỉ điền các dòng còn NULL
+    (dòng cũ trước migration). Trả về True nếu cấu hình đã thay đổi.
+    """
+    cursor.execute("SELECT billing_day, apply_date FROM billing_config WHERE id = 1")
+    changed = cursor.fetchone() != (billing_day, apply_date_str)
+    if changed:
+        # Upsert: giữ nguyên các cột khác (bảng giá) của dòng cấu hình
+        cursor.execute("""
+            INSERT INTO billing_config (id, billing_day, apply_date) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET billing_day = excluded.billing_day, apply_date = excluded.apply_date
+        """, (billing_day, apply_date_str))
+
+    ky_nam, ky_thang = billing_period_sql(":billing_day", ":apply_date")
+    cursor.execute(
+        f"UPDATE daily_usage SET ky_nam = {ky_nam}, ky_thang = {ky_thang}" + ("" if changed else " WHERE ky_nam IS NULL"),
+        {"billing_day": billing_day, "apply_date": apply_date_str}
+    )
+    return changed
+
+
+def sync_billing_config_db(db_path, billing_day, apply_date_str, tariff=None):
+    """sync_billing_config trong 1 transaction; tariff (dict options bảng giá) được lưu kèm cho CLI."""
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        changed = sync_billing_config(cursor, billing_day, apply_date_str)
+        if tariff is not None:
+            cursor.execute("UPDATE billing_config SET tariff = ? WHERE id = 1", (json.dumps(tariff, sort_keys=True),))
+        conn.commit()
+        return changed
+    finally:
+        conn.close()
+
+
+def set_tariff_hash(cursor, value):
+    """Ghi mã băm bảng giá đã dùng để tính các kỳ (gọi trong transaction tính lại, trước commit)."""
+    cursor.execute("UPDATE billing_config SET tariff_hash = ? WHERE id = 1", (value,))
+
+
+def init_tariff_hash_db(db_path, value):
+    """Trả về mã băm bảng giá đã lưu; DB chưa có (lần đầu chạy bản này) thì lấy value làm mốc và trả về None."""
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        row = cursor.execute("SELECT tariff_hash FROM billing_config WHERE id = 1").fetchone()
+        stored = row[0] if row else None
+        if stored is None:
+            set_tariff_hash(cursor, value)
+            conn.commit()
+        return stored
+    finally:
+        conn.close()
+
+
+# --- SO SÁNH CÙNG KỲ ---
+
+def refresh_yoy(cursor, months=None):
+    """Tính lại yoy_comparison cho các tháng kỳ (1..12) trong `months` (None = cả 12 tháng).
+
+    Đổi một kỳ chỉ ảnh hưởng các dòng cùng tháng kỳ (chênh lệch với năm trước của năm sau nó và
+    trung bình các năm khác), nên mỗi lần ghi chỉ tính lại O(số năm) dòng.
+    """
+    months = sorted(set(months)) if months is not None else list(range(1, 13))
+    if not months: return
+    marks = ", ".join("?" * len(months))
+    cursor.execute(f"DELETE FROM yoy_comparison WHERE ky_thang IN ({marks})", months)
+    cursor.execute(f"""
+        INSERT INTO yoy_comparison
+        (ky_thang, nam, san_luong, thanh_tien, thanh_tien_sau_thue,
+         san_luong_nam_truoc, chenh_lech_nam_truoc, trung_binh_nam_khac, chenh_lech_trung_binh)
+        SELECT m.thang, m.nam, m.tong_san_luong, m.thanh_tien, m.thanh_tien_sau_thue,
+               p.tong_san_luong,
+               CASE WHEN p.tong_san_luong > 0 THEN (m.tong_san_luong - p.tong_san_luong) / p.tong_san_luong END,
+               o.tb,
+               CASE WHEN o.tb > 0 THEN (m.tong_san_luong - o.tb) / o.tb END
+        FROM monthly_bill m
+        LEFT JOIN monthly_bill p ON p.nam = m.nam - 1 AND p.thang = m.thang
+        JOIN (
+            SELECT m2.nam, m2.thang,
+                   CASE WHEN t.c > 1 THEN (t.s - m2.tong_san_luong) / (t.c - 1) END AS tb
+            FROM monthly_bill m2
+            JOIN (SELECT thang, SUM(tong_san_luong) AS s, COUNT(*) AS c FROM monthly_bill
+                  WHERE thang IN ({marks}) GROUP BY thang) t ON t.thang = m2.thang
+        ) o ON o.nam = m.nam AND o.thang = m.thang
+    """, months)
+
+
+# --- NÉN NĂM CŨ ---
+
+def _days_in_year(year):
+    return (date(year + 1, 1, 1) - date(year, 1, 1)).days
+
+
+def pack_year(values):
+    """Đóng gói list giá trị theo ngày trong năm (None = không có dữ liệu) thành blob float64 little-endian."""
+    arr = array("d", (math.nan if v is None else v for v in values))
+    if sys.byteorder == "big": arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_year(blob):
+    arr = array("d")
+    arr.frombytes(blob)
+    if sys.byteorder == "big": arr.byteswap()
+    return [None if math.isnan(v) else v for v in arr]
+
+
+def _unpack_year_legacy(blob):
+    arr = array("f")
+    arr.frombytes(blob)
+    if sys.byteorder == "big": arr.byteswap()
+    return [None if math.isnan(v) else round(v, ARCHIVE_LEGACY_DECIMALS) for v in arr]
+
+
+def _archive_value(blob, index):
+    if blob is None or index * 8 + 8 > len(blob): return None
+    v = struct.unpack_from("<d", blob, index * 8)[0]
+    return None if math.isnan(v) else v
+
+
+def compact_db(db_path, keep_from_year):
+    """Nén các năm < keep_from_year vào daily_archive rồi trả lại trang trống cho hệ điều hành.
+
+    Trả về (danh sách năm vừa nén, số trang được giải phóng).
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT nam FROM daily_usage WHERE nam < ? ORDER BY nam", (keep_from_year,))
+        years = [r[0] for r in cursor.fetchall()]
+
+        for year in years:
+            cursor.execute("SELECT du_lieu FROM daily_archive WHERE nam=?", (year,))
+            existing = cursor.fetchone()
+            values = unpack_year(existing[0]) if existing else [None] * _days_in_year(year)
+
+            base = date(year, 1, 1).toordinal()
+            cursor.execute("SELECT thang, ngay, san_luong FROM daily_usage WHERE nam=?", (year,))
+            for thang, ngay, san_luong in cursor.fetchall():
+                values[date(year, thang, ngay).toordinal() - base] = san_luong or 0.0
+
+            cursor.execute("""
+                INSERT OR REPLACE INTO daily_archive (nam, so_ngay, so_ngay_co_du_lieu, du_lieu)
+                VALUES (?, ?, ?, ?)
+            """, (year, len(values), sum(1 for v in values if v is not None), pack_year(values)))
+            cursor.execute("DELETE FROM daily_usage WHERE nam=?", (year,))
+        conn.commit()
+
+        freed = 0
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            cursor.execute("PRAGMA incremental_vacuum").fetchall()
+            conn.commit()
+            freed = before - cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        return years, freed
+    finally:
+        conn.close()
+
+
+def checkpoint_db(db_path):
+    """Checkpoint WAL (TRUNCATE). Trả về False nếu đang có luồng ghi/đọc giữ WAL."""
+    conn = sqlite3.connect(db_path, timeout=CHECKPOINT_BUSY_TIMEOUT_MS / 1000)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={CHECKPOINT_BUSY_TIMEOUT_MS}")
+        busy, _log_frames, _checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return busy == 0
+    finally:
+        conn.close()
+
+
+def init_db(db_path):
+    """Tạo bảng, chạy migration và bật WAL cho DB của một entry."""
+    conn = connect_db(db_path)
+    cursor = conn.cursor()
+    # Bật trước khi tạo bảng (DB mới); DB cũ được VACUUM một lần ở cuối để đổi chế độ
+    needs_vacuum = False
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        needs_vacuum = cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] > 0
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL được lưu trong file DB: luồng đọc (sensor) và luồng ghi không còn chặn nhau
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_usage (
+            nam INTEGER, thang INTEGER, ngay INTEGER, san_luong REAL, don_vi TEXT, PRIMARY KEY (nam, thang, ngay)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_bill (
+            nam INTEGER, thang INTEGER, tong_san_luong REAL, don_vi_san_luong TEXT, 
+            thanh_tien REAL, don_vi_tien TEXT, 
+            thanh_tien_sau_thue REAL, vat INTEGER,
+            ngay_bat_dau TEXT, ngay_ket_thuc TEXT,
+            PRIMARY KEY (nam, thang)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS yearly_bill (
+            nam INTEGER, tong_san_luong REAL, tong_tien REAL, 
+            tong_tien_sau_thue REAL, vat INTEGER,
+            PRIMARY KEY (nam)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_archive (
+            nam INTEGER PRIMARY KEY, so_ngay INTEGER, so_ngay_co_du_lieu INTEGER, du_lieu BLOB
+        )
+    """)
+    # Lịch (vị trí trong năm -> tháng, ngày) của năm 365 và 366 ngày, để view giải mã blob không cần date()
+    calendar_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='archive_calendar'"
+    ).fetchone()
+    if not calendar_exists:
+        cursor.execute("""
+            CREATE TABLE archive_calendar (
+                so_ngay INTEGER, i INTEGER, thang INTEGER, ngay INTEGER, PRIMARY KEY (so_ngay, i)
+            ) WITHOUT ROWID
+        """)
+        cursor.executemany("INSERT INTO archive_calendar VALUES (?, ?, ?, ?)", [
+            (size, i, d.month, d.day)
+            for size, year in ((365, 2001), (366, 2000))
+            for i, d in enumerate(date(year, 1, 1) + timedelta(days=n) for n in range(size))
+        ])
+    # Ngày chốt số / ngày áp dụng mà cột ky_nam, ky_thang của daily_usage đang theo
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS billing_config (
+            id INTEGER PRIMARY KEY CHECK (id = 1), billing_day INTEGER, apply_date TEXT, tariff TEXT, tariff_hash TEXT
+        )
+    """)
+    # Thống kê Welford theo thứ trong tuần (0 = Thứ Hai) trên cửa sổ ngày đã hoàn tất, xem anomaly.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekday_stats (
+            thu INTEGER PRIMARY KEY, so_mau INTEGER, trung_binh REAL, m2 REAL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1), ngay_moc TEXT,
+            ngay TEXT, san_luong REAL, trung_binh REAL, do_lech_chuan REAL, so_mau INTEGER,
+            z REAL, nam_truoc REAL, bat_thuong INTEGER
+        )
+    """)
+    # So sánh cùng kỳ theo (tháng kỳ, năm), cập nhật bởi refresh_yoy mỗi khi một kỳ thay đổi
+    yoy_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'yoy_comparison'"
+    ).fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS yoy_comparison (
+            ky_thang INTEGER, nam INTEGER, san_luong REAL, thanh_tien REAL, thanh_tien_sau_thue REAL,
+            san_luong_nam_truoc REAL, chenh_lech_nam_truoc REAL,
+            trung_binh_nam_khac REAL, chenh_lech_trung_binh REAL,
+            PRIMARY KEY (ky_thang, nam)
+        )
+    """)
+    # Sản lượng theo giờ (tùy chọn, xem hourly.py): tổng các giờ của một ngày = daily_usage của ngày đó
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_usage (
+            nam INTEGER, thang INTEGER, ngay INTEGER, gio INTEGER, san_luong REAL,
+            PRIMARY KEY (nam, thang, ngay, gio)
+        )
+    """)
+    # Giờ đã quá hạn giữ lại được gộp theo (năm, tháng, giờ): tổng sản lượng và số ngày
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_profile (
+            nam INTEGER, thang INTEGER, gio INTEGER, san_luong REAL, so_ngay INTEGER,
+            PRIMARY KEY (nam, thang, gio)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS total_usage (
+            tong_san_luong REAL, don_vi TEXT, tong_so_thang INTEGER,
+            thoi_diem_bat_dau TEXT, thoi_diem_ket_thuc TEXT,
+            tong_tien_tich_luy REAL, tong_tien_tich_luy_sau_thue REAL, vat INTEGER
+        )
+    """)
+    
+    # MIGRATION: Thêm cột mới nếu chưa có
+    try:
+        cursor.execute("PRAGMA table_info(monthly_bill)")
+        cols = [info[1] for info in cursor.fetchall()]
+        if "thanh_tien_sau_thue" not in cols:
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN thanh_tien_sau_thue REAL DEFAULT 0")
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN vat INTEGER DEFAULT 8")
+        if "ngay_bat_dau" not in cols:
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN ngay_bat_dau TEXT")
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN ngay_ket_thuc TEXT")
+
+        cursor.execute("PRAGMA table_info(total_usage)")
+        cols_t = [info[1] for info in cursor.fetchall()]
+        if "tong_tien_tich_luy_sau_thue" not in cols_t:
+            cursor.execute("ALTER TABLE total_usage ADD COLUMN tong_tien_tich_luy_sau_thue REAL DEFAULT 0")
+            cursor.execute("ALTER TABLE total_usage ADD COLUMN thoi_diem_bat_dau TEXT")
+            cursor.execute("ALTER TABLE total_usage ADD COLUMN thoi_diem_ket_thuc TEXT")
+            cursor.execute("ALTER TABLE total_usage ADD COLUMN tong_tien_tich_luy REAL DEFAULT 0")
+            cursor.execute("ALTER TABLE total_usage ADD COLUMN vat INTEGER DEFAULT 8")
+
+        cursor.execute("PRAGMA table_info(daily_usage)")
+        cols_d = [info[1] for info in cursor.fetchall()]
+        if "so_ngay" not in cols:
+            # Số ngày và checksum của các dòng daily_usage đã cộng vào kỳ (dùng để kiểm tra)
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN so_ngay INTEGER")
+            cursor.execute("ALTER TABLE monthly_bill ADD COLUMN checksum INTEGER")
+
+        cursor.execute("PRAGMA table_info(billing_config)")
+        cols_c = [info[1] for info in cursor.fetchall()]
+        if "tariff" not in cols_c:
+            # Options bảng giá (JSON) của entry, ghi khi setup; CLI đọc lại để tính đúng giá
+            cursor.execute("ALTER TABLE billing_config ADD COLUMN tariff TEXT")
+        if "tariff_hash" not in cols_c:
+            # Mã băm bảng giá/VAT mà các kỳ đã được tính theo (tariff.tables_hash)
+            cursor.execute("ALTER TABLE billing_config ADD COLUMN tariff_hash TEXT")
+
+        if "ky_nam" not in cols_d:
+            # Kỳ hóa đơn của từng ngày, điền bởi sync_billing_config
+            cursor.execute("ALTER TABLE daily_usage ADD COLUMN ky_nam INTEGER")
+            cursor.execute("ALTER TABLE daily_usage ADD COLUMN ky_thang INTEGER")
+    except Exception:
+        pass
+
+    # Blob float32 của bản cũ: chuyển sang float64 một lần với đúng giá trị view đã trả về trước đó
+    cursor.execute("SELECT nam, du_lieu FROM daily_archive WHERE length(du_lieu) = so_ngay * 4")
+    for nam, blob in cursor.fetchall():
+        cursor.execute("UPDATE daily_archive SET du_lieu = ? WHERE nam = ?", (pack_year(_unpack_year_legacy(blob)), nam))
+
+    # Covering index: SUM/checksum theo kỳ (CHECKSUM_SQL đọc cả nam, thang, ngay) chỉ đọc index, không đụng bảng
+    index_cols = [r[2] for r in cursor.execute("PRAGMA index_info(idx_daily_usage_ky)").fetchall()]
+    if index_cols and index_cols != list(DAILY_KY_INDEX_COLUMNS):
+        cursor.execute("DROP INDEX idx_daily_usage_ky")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_daily_usage_ky ON daily_usage ({', '.join(DAILY_KY_INDEX_COLUMNS)})")
+
+    # DB cũ: dựng bảng so sánh cùng kỳ một lần từ monthly_bill (đã migrate cột ở trên)
+    if not yoy_exists:
+        refresh_yoy(cursor)
+
+    conn.commit()
+    if needs_vacuum:
+        cursor.execute("VACUUM")
+    conn.close()
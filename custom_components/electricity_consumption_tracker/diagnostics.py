@@ -0,0 +1,29 @@
+"""Diagnostics support for the Electricity Consumption Tracker integration."""
+import os
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN, DATA_REBUILD_SCHEDULER
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id, {})
+    db_path = entry_data.get("db_path")
+
+    scheduler = hass.data.get(DATA_REBUILD_SCHEDULER)
+    rebuilds = [t for t in scheduler.status() if t["entry_id"] == entry.entry_id] if scheduler else []
+
+    def db_size():
+        return os.path.getsize(db_path) if db_path and os.path.exists(db_path) else None
+
+    return {
+        "data": dict(entry.data),
+        "options": dict(entry.options),
+        "db_size_bytes": await hass.async_add_executor_job(db_size),
+        # Lần kiểm tra checksum gần nhất: kỳ/năm đã sửa
+        "verify": entry_data.get("verify"),
+        "rebuild": rebuilds,
+        # Bản chụp (backup) gần nhất: đường dẫn, kích thước, thời điểm
+        "backup": entry_data.get("backup"),
+    }
@@ -0,0 +1,160 @@
+"""Export helpers for the Electricity Consumption Tracker integration."""
+import csv
+import os
+import sqlite3
+import logging
+from datetime import datetime
+
+from .db import connect_db, DAILY_VIEW
+
+_LOGGER = logging.getLogger(__name__)
+
+EXPORT_TABLES = ("daily_usage", "monthly_bill", "yearly_bill")
+EXPORT_FORMATS = ("csv", "parquet")
+
+# Số dòng đọc mỗi lần từ cursor (giữ bộ nhớ ổn định với DB lớn)
+CHUNK_SIZE = 5000
+# Số page copy mỗi bước backup, giữa các bước khóa đọc được nhả cho luồng ghi
+BACKUP_PAGES = 64
+BACKUP_SLEEP = 0.05
+
+# daily_usage được đọc qua view để gồm cả các năm đã nén
+_SOURCE = {"daily_usage": DAILY_VIEW}
+
+_ORDER_BY = {
+    "daily_usage": "nam, thang, ngay",
+    "monthly_bill": "nam, thang",
+    "yearly_bill": "nam",
+}
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def snapshot_db(db_path, snapshot_path):
+    """Chụp DB sang file tạm bằng SQLite online backup (từng bước nhỏ)."""
+    src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(snapshot_path)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _remove_db_files(path):
+    """Xóa file DB cùng các file -wal/-shm đi kèm (nếu có)."""
+    for f in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(f): os.remove(f)
+
+
+def backup_db(db_path, out_path):
+    """Chụp DB sang out_path bằng snapshot_db (ghi file .part, kiểm tra quick_check rồi mới đổi tên).
+
+    Bản chụp chuyển sang journal DELETE để là một file duy nhất. Trả về kích thước (byte).
+    """
+    tmp_path = out_path + ".part"
+    try:
+        snapshot_db(db_path, tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchone()[0]
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            conn.close()
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Bản chụp {out_path} lỗi: {result}")
+        os.replace(tmp_path, out_path)
+    finally:
+        _remove_db_files(tmp_path)
+    return os.path.getsize(out_path)
+
+
+def _iter_chunks(cursor):
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows: break
+        yield rows
+
+
+def _write_csv(cursor, columns, out_path):
+    count = 0
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in _iter_chunks(cursor):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_parquet(cursor, columns, out_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    count = 0
+    writer = None
+    try:
+        for rows in _iter_chunks(cursor):
+            arrays = {col: [r[i] for r in rows] for i, col in enumerate(columns)}
+            if writer is None:
+                table = pa.table(arrays)
+                writer = pq.ParquetWriter(out_path, table.schema)
+            else:
+                table = pa.table(arrays, schema=writer.schema)
+            writer.write_table(table)
+            count += len(rows)
+    finally:
+        if writer is not None: writer.close()
+
+    if writer is None:
+        # Bảng rỗng: vẫn tạo file có schema để phía phân tích không bị thiếu file
+        pq.write_table(pa.table({col: pa.array([], pa.null()) for col in columns}), out_path)
+    return count
+
+
+def export_entry(db_path, out_dir, entry_id, fmt="csv"):
+    """Export các bảng của một entry, trả về danh sách (đường dẫn file, số dòng)."""
+    if fmt == "parquet" and not _has_pyarrow():
+        _LOGGER.warning("pyarrow chưa được cài, export %s sang CSV thay vì Parquet", entry_id)
+        fmt = "csv"
+
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    snapshot_path = os.path.join(out_dir, f".snapshot_{entry_id}_{stamp}.db")
+
+    results = []
+    try:
+        snapshot_db(db_path, snapshot_path)
+        # Bản chụp mang theo journal WAL của DB gốc: chuyển sang DELETE để đọc không sinh -wal/-shm
+        conn = sqlite3.connect(snapshot_path)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            conn.close()
+        conn = connect_db(snapshot_path, read_only=True)
+        try:
+            cursor = conn.cursor()
+            for table in EXPORT_TABLES:
+                cursor.execute(f"SELECT * FROM {_SOURCE.get(table, table)} ORDER BY {_ORDER_BY[table]}")
+                columns = [c[0] for c in cursor.description]
+                out_path = os.path.join(out_dir, f"{entry_id}_{table}_{stamp}.{fmt}")
+                tmp_path = out_path + ".part"
+                if fmt == "parquet":
+                    count = _write_parquet(cursor, columns, tmp_path)
+                else:
+                    count = _write_csv(cursor, columns, tmp_path)
+                os.replace(tmp_path, out_path)
+                results.append((out_path, count))
+        finally:
+            conn.close()
+    finally:
+        _remove_db_files(snapshot_path)
+
+    return results
@@ -0,0 +1,131 @@
+"""Optional hourly consumption history for the Electricity Consumption Tracker integration."""
+from datetime import date, timedelta
+
+from .db import connect_db
+
+# Số ngày gần nhất (không gồm hôm nay) dùng để tính sản lượng trung bình theo giờ
+HOURLY_PROFILE_DAYS = 30
+# Tổng các giờ lệch với sản lượng ngày quá mức này (kWh) thì được chỉnh lại (reconcile_hours)
+HOURLY_TOLERANCE = 1e-6
+
+
+def record_hour(cursor, d, hour, day_kwh):
+    """Ghi chỉ số lũy kế trong ngày (day_kwh, đọc lúc `hour` giờ) vào hourly_usage.
+
+    Sản lượng của giờ = day_kwh - tổng các giờ khác của ngày, nên tổng các giờ luôn bằng
+    chỉ số mới nhất. Khoảng không có số liệu (HA tắt) được dồn vào giờ đầu tiên đọc được.
+    Trả về sản lượng cả ngày để cuộn lên daily_usage.
+    """
+    cursor.execute("""
+        SELECT COALESCE(SUM(san_luong), 0) FROM hourly_usage
+        WHERE nam = ? AND thang = ? AND ngay = ? AND gio <> ?
+    """, (d.year, d.month, d.day, hour))
+    others = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT OR REPLACE INTO hourly_usage (nam, thang, ngay, gio, san_luong) VALUES (?, ?, ?, ?, ?)
+    """, (d.year, d.month, d.day, hour, day_kwh - others))
+    return day_kwh
+
+
+def reconcile_hours(cursor, d, day_kwh):
+    """Đưa các giờ đã lưu của ngày d về đúng day_kwh khi ngày được ghi không qua record_hour (override, backfill...).
+
+    Tổng các giờ còn dương thì co giãn theo tỷ lệ (giữ dạng phân bố trong ngày), ngược lại xóa các giờ của ngày.
+    day_kwh=None: ngày bị xóa, xóa luôn các giờ. Trả về số dòng đã sửa.
+    """
+    key = (d.year, d.month, d.day)
+    cursor.execute("""
+        SELECT COALESCE(SUM(san_luong), 0), COUNT(*) FROM hourly_usage WHERE nam = ? AND thang = ? AND ngay = ?
+    """, key)
+    total, count = cursor.fetchone()
+    if not count or (day_kwh is not None and abs(total - day_kwh) <= HOURLY_TOLERANCE): return 0
+    if day_kwh is not None and day_kwh >= 0 and total > 0:
+        cursor.execute("""
+            UPDATE hourly_usage SET san_luong = san_luong * ? WHERE nam = ? AND thang = ? AND ngay = ?
+        """, (day_kwh / total,) + key)
+    else:
+        cursor.execute("DELETE FROM hourly_usage WHERE nam = ? AND thang = ? AND ngay = ?", key)
+    return cursor.rowcount
+
+
+def reconcile_hours_between(cursor, first, last):
+    """reconcile_hours cho mọi ngày trong [first, last] có giờ đã lưu (sau khi ghi hàng loạt, ví dụ nhập pyscript).
+
+    Chỉ đọc các ngày có trong hourly_usage (vài chục ngày gần nhất), không quét cả khoảng. Trả về số ngày đã sửa.
+    """
+    cursor.execute("""
+        SELECT h.nam, h.thang, h.ngay,
+               (SELECT v.san_luong FROM daily_values v WHERE v.nam = h.nam AND v.thang = h.thang AND v.ngay = h.ngay)
+        FROM hourly_usage h
+        WHERE (h.nam, h.thang, h.ngay) BETWEEN (?, ?, ?) AND (?, ?, ?)
+        GROUP BY h.nam, h.thang, h.ngay
+    """, (first.year, first.month, first.day, last.year, last.month, last.day))
+    fixed = 0
+    for y, m, d, day_kwh in cursor.fetchall():
+        if reconcile_hours(cursor, date(y, m, d), day_kwh): fixed += 1
+    return fixed
+
+
+def prune_hourly(db_path, keep_from):
+    """Gộp các giờ trước ngày keep_from vào hourly_profile rồi xóa khỏi hourly_usage (1 transaction).
+
+    Trả về số dòng đã gộp.
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        key = (keep_from.year, keep_from.month, keep_from.day)
+        # WHERE bắt buộc để SQLite không hiểu nhầm ON CONFLICT là điều kiện JOIN
+        cursor.execute("""
+            INSERT INTO hourly_profile (nam, thang, gio, san_luong, so_ngay)
+            SELECT nam, thang, gio, SUM(san_luong), COUNT(*) FROM hourly_usage
+            WHERE (nam, thang, ngay) < (?, ?, ?)
+            GROUP BY nam, thang, gio
+            ON CONFLICT (nam, thang, gio) DO UPDATE SET
+                san_luong = san_luong + excluded.san_luong, so_ngay = so_ngay + excluded.so_ngay
+        """, key)
+        cursor.execute("DELETE FROM hourly_usage WHERE (nam, thang, ngay) < (?, ?, ?)", key)
+        removed = cursor.rowcount
+        conn.commit()
+        return removed
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def read_hourly(db_path, today, days=HOURLY_PROFILE_DAYS):
+    """Sản lượng từng giờ của hôm nay và trung bình từng giờ của `days` ngày trước (mảng 24 phần tử).
+
+    Trả về None nếu chưa có số liệu theo giờ.
+    """
+    start = today - timedelta(days=days)
+    conn = connect_db(db_path, read_only=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT gio, san_luong FROM hourly_usage WHERE nam = ? AND thang = ? AND ngay = ?
+        """, (today.year, today.month, today.day))
+        today_rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT gio, SUM(san_luong) FROM hourly_usage
+            WHERE (nam, thang, ngay) >= (?, ?, ?) AND (nam, thang, ngay) < (?, ?, ?)
+            GROUP BY gio
+        """, (start.year, start.month, start.day, today.year, today.month, today.day))
+        profile_rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT COUNT(DISTINCT nam * 10000 + thang * 100 + ngay) FROM hourly_usage
+            WHERE (nam, thang, ngay) >= (?, ?, ?) AND (nam, thang, ngay) < (?, ?, ?)
+        """, (start.year, start.month, start.day, today.year, today.month, today.day))
+        sample_days = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    if not today_rows and not profile_rows: return None
+    today_kwh = [None] * 24
+    for gio, kwh in today_rows: today_kwh[gio] = kwh
+    # Chia cho số ngày có số liệu theo giờ: giờ không có dòng nào trong một ngày được tính là 0 kWh
+    average = [None] * 24
+    for gio, kwh in profile_rows: average[gio] = kwh / sample_days
+    return {"today": today_kwh, "average": average, "days": sample_days}
@@ -0,0 +1,104 @@
+"""Import of the legacy pyscript database into an Electricity Consumption Tracker entry."""
+import os
+import sqlite3
+from datetime import date, datetime
+
+from .db import connect_db, billing_period_sql, sync_billing_config
+from .billing import RebuildCancelled, _calculate_months_chunked, recalculate_total_usage
+from .anomaly import refresh_anomaly_stats
+from .hourly import reconcile_hours_between
+
+# File của pyscript_hass/tongou_tong_electricity_data.py (tương đối so với /config)
+PYSCRIPT_DB_PATH = "pyscript/tongou_tong_electricity_data.db"
+# Số dòng đọc/ghi mỗi lượt: bộ nhớ không phụ thuộc kích thước file nguồn
+IMPORT_CHUNK_SIZE = 5000
+
+_KY = billing_period_sql(":billing_day", ":apply_date", ":nam", ":thang", ":ngay")
+_INSERT_SQL = """
+    INSERT OR {mode} INTO daily_usage (nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang)
+    VALUES (:nam, :thang, :ngay, :san_luong, 'kWh', {ky_nam}, {ky_thang})
+"""
+
+
+def _check_source(cursor):
+    cursor.execute("PRAGMA table_info(daily_usage)")
+    cols = {info[1] for info in cursor.fetchall()}
+    missing = {"nam", "thang", "ngay", "san_luong"} - cols
+    if missing:
+        raise ValueError(f"File nguồn không có bảng daily_usage hợp lệ (thiếu cột {', '.join(sorted(missing))})")
+
+
+def import_pyscript_db(db_path, source_path, billing_day, apply_date_str, tariff=None, overwrite=False,
+                       cache=None, today=None, hourly=False, cancel_event=None, progress=None):
+    """Nhập daily_usage của DB pyscript (chỉ theo tháng dương lịch) vào DB của entry.
+
+    Đọc nguồn bằng fetchmany, ghi INSERT OR IGNORE (overwrite=True: OR REPLACE) trong một transaction,
+    rồi tính lại các kỳ bị ảnh hưởng bằng một lượt GROUP BY. Chạy lại nhiều lần cho cùng kết quả.
+    cache (OpenPeriodCache) được nạp lại trong cùng transaction với ngày `today`.
+    hourly=True (entry lưu theo giờ): các giờ đã lưu của những ngày bị ghi đè được chỉnh theo giá trị mới.
+    Trả về {"rows": số dòng đọc, "first": ngày đầu, "last": ngày cuối, "periods": số kỳ đã tính lại}.
+    """
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(source_path)
+
+    src = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    conn = connect_db(db_path)
+    try:
+        src_cursor = src.cursor()
+        _check_source(src_cursor)
+        src_cursor.execute("SELECT COUNT(*) FROM daily_usage WHERE san_luong IS NOT NULL")
+        total = src_cursor.fetchone()[0]
+        src_cursor.execute("""
+            SELECT nam, thang, ngay, san_luong FROM daily_usage
+            WHERE san_luong IS NOT NULL ORDER BY nam, thang, ngay
+        """)
+
+        cursor = conn.cursor()
+        sync_billing_config(cursor, billing_day, apply_date_str)
+        insert_sql = _INSERT_SQL.format(mode="REPLACE" if overwrite else "IGNORE", ky_nam=_KY[0], ky_thang=_KY[1])
+        params = {"billing_day": billing_day, "apply_date": apply_date_str}
+
+        count = 0
+        first = last = None
+        while True:
+            if cancel_event is not None and cancel_event.is_set(): raise RebuildCancelled()
+            rows = src_cursor.fetchmany(IMPORT_CHUNK_SIZE)
+            if not rows: break
+            cursor.executemany(insert_sql, (
+                {**params, "nam": r[0], "thang": r[1], "ngay": r[2], "san_luong": float(r[3])} for r in rows
+            ))
+            if first is None: first = rows[0][:3]
+            last = rows[-1][:3]
+            count += len(rows)
+            # Nửa đầu tiến độ là ghi dữ liệu, nửa sau là tính lại các kỳ
+            if progress is not None and total: progress(count, total * 2)
+
+        result = {"rows": count, "first": None, "last": None, "periods": 0}
+        if count:
+            cursor.execute("""
+                SELECT DISTINCT ky_nam, ky_thang FROM daily_values
+                WHERE (nam, thang, ngay) BETWEEN (?, ?, ?) AND (?, ?, ?) AND nam BETWEEN ? AND ?
+                ORDER BY ky_nam, ky_thang
+            """, (*first, *last, first[0], last[0]))
+            months = [(r[0], r[1]) for r in cursor.fetchall()]
+
+            def months_progress(done, months_total):
+                if progress is not None: progress(total + done * total // months_total, total * 2)
+
+            apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+            _calculate_months_chunked(cursor, months, billing_day, apply_date, tariff, cancel_event, months_progress)
+            recalculate_total_usage(cursor)
+            refresh_anomaly_stats(cursor, [date(*first), date(*last)])
+            if hourly: reconcile_hours_between(cursor, date(*first), date(*last))
+            result.update({"first": date(*first).isoformat(), "last": date(*last).isoformat(), "periods": len(months)})
+            if cache is not None: cache.load(cursor, today)
+
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        if cache is not None: cache.invalidate()
+        raise
+    finally:
+        conn.close()
+        src.close()
@@ -0,0 +1,802 @@
+"""The Electricity Consumption Tracker integration."""
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import voluptuous as vol
+from datetime import timedelta, date, datetime
+import homeassistant.util.dt as dt_util
+
+from homeassistant.config_entries import ConfigEntry, ConfigEntryState
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant, ServiceCall, callback
+from homeassistant.helpers import config_validation as cv, device_registry as dr
+from homeassistant.helpers.event import async_track_time_interval, async_track_time_change, async_track_state_change_event
+from homeassistant.helpers.dispatcher import async_dispatcher_send, async_dispatcher_connect
+
+from .const import (
+    DOMAIN, CONF_SOURCE_SENSOR, CONF_UPDATE_INTERVAL,
+    CONF_FRIENDLY_NAME, SIGNAL_UPDATE_SENSORS,
+    CONF_BILLING_DAY, CONF_START_DATE_APPLY, EVENT_TIER_CHANGED,
+    DATA_REBUILD_SCHEDULER, EVENT_REBUILD_PROGRESS,
+    CONF_ENTRY_TYPE, CONF_CHILD_ENTRIES, ENTRY_TYPE_VIRTUAL, SIGNAL_DAYS_CHANGED,
+    EVENT_ANOMALY_DETECTED, CONF_HOURLY_HISTORY, CONF_HOURLY_RETENTION_DAYS, HOURLY_RETENTION_DAYS_DEFAULT,
+    BACKUP_DIR, DATA_BACKUP_LOCK, CONF_SOURCE_TYPE, SOURCE_TYPE_TODAY, SOURCE_TYPE_YESTERDAY
+)
+from .billing import (
+    perform_db_calculation, recompute_from_date, rebuild_history, RebuildCancelled, RebuildSuperseded, verify_db,
+    find_missing_days, backfill_days, VERIFY_HOUR, VERIFY_MINUTE
+)
+from .cache import OpenPeriodCache
+from .tariff import (
+    build_tariff, tariff_options, tables_hash, find_tariff_file, write_tariff_file, upgrade_tariff_file,
+    load_tariff_file, apply_tariff_tables, TARIFF_WATCH_SECONDS
+)
+from .db import (
+    connect_db, init_db, checkpoint_db, compact_db, sync_billing_config_db, entry_db_path,
+    init_tariff_hash_db, set_tariff_hash,
+    CHECKPOINT_INTERVAL_MINUTES, CHECKPOINT_IDLE_SECONDS,
+    ARCHIVE_HOT_YEARS, COMPACT_HOUR, COMPACT_MINUTE
+)
+from .export import EXPORT_FORMATS, export_entry, backup_db
+from .rebuild import RebuildScheduler, REBUILD_OPTIONS, REBUILD_TARIFF, REBUILD_IMPORT
+from .backfill import async_fetch_daily_values, BACKFILL_HOUR, BACKFILL_MINUTE
+from .virtual import plan_sync, children_map, cyclic_children
+from .importer import import_pyscript_db, PYSCRIPT_DB_PATH
+from .hourly import record_hour, reconcile_hours, prune_hourly
+from .yesterday import YesterdayReadings
+
+_LOGGER = logging.getLogger(__name__)
+
+PLATFORMS = ["sensor", "binary_sensor"]
+
+SERVICE_OVERRIDE_SCHEMA = vol.Schema({
+    vol.Required("entry_id"): cv.string,
+    vol.Required("date"): vol.Any(cv.date, cv.datetime),
+    vol.Required("value"): vol.Coerce(float),
+})
+
+SERVICE_EXPORT_SCHEMA = vol.Schema({
+    vol.Optional("entry_id"): cv.string,
+    vol.Optional("format", default="csv"): vol.In(EXPORT_FORMATS),
+    vol.Optional("path"): cv.string,
+})
+
+SERVICE_BACKUP_SCHEMA = vol.Schema({
+    vol.Optional("entry_id"): cv.string,
+    vol.Optional("path"): cv.string,
+})
+
+SERVICE_CANCEL_REBUILD_SCHEMA = vol.Schema({
+    vol.Optional("entry_id"): cv.string,
+})
+
+SERVICE_IMPORT_PYSCRIPT_SCHEMA = vol.Schema({
+    vol.Required("entry_id"): cv.string,
+    vol.Optional("path", default=PYSCRIPT_DB_PATH): cv.string,
+    vol.Optional("overwrite", default=False): cv.boolean,
+})
+
+# Báo tiến độ rebuild mỗi khi tăng thêm ít nhất chừng này phần trăm
+REBUILD_PROGRESS_STEP = 10
+
+def get_entry_tariff(entry: ConfigEntry):
+    return build_tariff({**entry.data, **entry.options})
+
+
+def write_day(db_path, cache, y, m, d, val, billing_day, apply_date_str, tariff=None, hour=None, hourly=False):
+    """Ghi một ngày trong 1 transaction, đi qua cache nếu ngày thuộc kỳ đang mở.
+
+    hour: val là chỉ số đọc lúc `hour` giờ, được ghi vào hourly_usage rồi cuộn lên ngày trong cùng transaction.
+    hour=None (override, entry ảo...) và hourly=True (entry lưu theo giờ): các giờ đã lưu của ngày được chỉnh
+    theo val để tổng vẫn khớp. Entry không lưu theo giờ bỏ qua bước này.
+    Trả về (bậc giá vừa vượt hoặc None, kết quả đánh giá bất thường hoặc None).
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        if cache is not None and not cache.loaded:
+            cache.load(cursor, dt_util.now().date())
+        if hour is not None:
+            val = record_hour(cursor, date(y, m, d), hour, val)
+        elif hourly:
+            reconcile_hours(cursor, date(y, m, d), val)
+        anomaly = perform_db_calculation(cursor, y, m, d, val, billing_day, apply_date_str, cache, tariff)
+        conn.commit()
+    except Exception:
+        if cache is not None: cache.invalidate()
+        raise
+    finally:
+        conn.close()
+    return (cache.pop_tier_crossed() if cache is not None else None), anomaly
+
+
+def write_days(db_path, cache, values, billing_day, apply_date_str, tariff=None, removed_days=None, hourly=False):
+    """Ghi nhiều ngày ({date: kWh}) trong 1 transaction rồi nạp lại cache. Trả về các kỳ đã tính lại.
+
+    hourly=True: các giờ đã lưu của những ngày được ghi/xóa được chỉnh theo (như write_day).
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        months = backfill_days(cursor, values, billing_day, apply_date_str, tariff, removed_days)
+        if hourly:
+            for d, val in values.items(): reconcile_hours(cursor, d, val)
+            for d in removed_days or (): reconcile_hours(cursor, d, None)
+        if cache is not None: cache.load(cursor, dt_util.now().date())
+        conn.commit()
+    except Exception:
+        if cache is not None: cache.invalidate()
+        raise
+    finally:
+        conn.close()
+    return months
+
+
+def read_days(db_path, days):
+    """Sản lượng đã lưu của các ngày: {date: kWh} (ngày chưa có thì không có trong dict)."""
+    conn = connect_db(db_path, read_only=True)
+    try:
+        cursor = conn.cursor()
+        result = {}
+        for d in days:
+            cursor.execute("SELECT san_luong FROM daily_values WHERE nam=? AND thang=? AND ngay=?", (d.year, d.month, d.day))
+            row = cursor.fetchone()
+            if row is not None: result[d] = row[0]
+        return result
+    finally:
+        conn.close()
+
+
+def find_missing(db_path, end_date):
+    conn = connect_db(db_path, read_only=True)
+    try:
+        return find_missing_days(conn.cursor(), end_date)
+    finally:
+        conn.close()
+
+
+def is_virtual_entry(entry: ConfigEntry):
+    return entry.data.get(CONF_ENTRY_TYPE) == ENTRY_TYPE_VIRTUAL
+
+
+@callback
+def notify_days_changed(hass: HomeAssistant, entry_id, days):
+    """Báo cho entry ảo biết những ngày của entry_id vừa được ghi."""
+    if days: async_dispatcher_send(hass, SIGNAL_DAYS_CHANGED, entry_id, list(days))
+
+
+def fire_tier_event(hass: HomeAssistant, entry_id, cache, crossed):
+    if not crossed: return
+    hass.bus.async_fire(EVENT_TIER_CHANGED, {
+        "entry_id": entry_id,
+        "ky_hoa_don": f"{cache.b_month:02d}/{cache.b_year}",
+        "bac_cu": crossed[0],
+        "bac_moi": crossed[1],
+        "tong_san_luong_kwh": round(cache.kwh, 2),
+    })
+
+
+def fire_anomaly_event(hass: HomeAssistant, entry_id, anomaly):
+    if not anomaly or not anomaly["bat_thuong"]: return
+    hass.bus.async_fire(EVENT_ANOMALY_DETECTED, {
+        "entry_id": entry_id,
+        "ngay": anomaly["ngay"],
+        "san_luong_kwh": round(anomaly["san_luong"], 2),
+        "trung_binh_kwh": round(anomaly["trung_binh"], 2),
+        "z": round(anomaly["z"], 2),
+        "nam_truoc_kwh": round(anomaly["nam_truoc"], 2) if anomaly["nam_truoc"] is not None else None,
+    })
+
+
+def recompute_entry(db_path, cache, since_str, billing_day, apply_date, tariff=None, tables=None, cancel_event=None, progress=None):
+    """Tính lại các kỳ từ since_str cho một entry và nạp lại cache (chạy trên pool rebuild).
+
+    tables: mã băm bảng giá đã dùng, ghi cùng transaction nên chỉ được lưu khi tính lại thành công.
+    """
+    conn = connect_db(db_path)
+    try:
+        cursor = conn.cursor()
+        months = recompute_from_date(cursor, since_str, billing_day, apply_date, tariff, cancel_event, progress)
+        if tables is not None: set_tariff_hash(cursor, tables)
+        if cache is not None: cache.load(cursor, dt_util.now().date())
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        if cache is not None: cache.invalidate()
+        raise
+    finally:
+        conn.close()
+    return len(months)
+
+
+def get_rebuild_scheduler(hass: HomeAssistant):
+    scheduler = hass.data.get(DATA_REBUILD_SCHEDULER)
+    if scheduler is None:
+        scheduler = hass.data[DATA_REBUILD_SCHEDULER] = RebuildScheduler()
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, lambda _event: scheduler.shutdown())
+    return scheduler
+
+
+async def async_run_rebuild(hass: HomeAssistant, entry_id, kind, fn, *args):
+    """Chạy fn trên pool rebuild (giữ khóa ghi của entry), phát EVENT_REBUILD_PROGRESS theo từng nấc REBUILD_PROGRESS_STEP %.
+
+    Rebuild cùng loại mới hơn hủy lần này (RebuildSuperseded); rebuild khác loại chờ khóa ghi rồi chạy tiếp.
+    """
+    last_pct = [-REBUILD_PROGRESS_STEP]
+
+    def on_progress(task):
+        # Gọi từ luồng rebuild: chỉ đẩy sự kiện về event loop khi qua nấc mới
+        pct = int(task.done * 100 / task.total) if task.total else 100
+        if pct < 100 and pct - last_pct[0] < REBUILD_PROGRESS_STEP: return
+        last_pct[0] = pct
+        hass.loop.call_soon_threadsafe(hass.bus.async_fire, EVENT_REBUILD_PROGRESS, {
+            "entry_id": entry_id, "kind": kind, "done": task.done, "total": task.total, "percent": pct,
+        })
+
+    scheduler = get_rebuild_scheduler(hass)
+    task = scheduler.queue(entry_id, kind)
+    try:
+        async with hass.data[DOMAIN][entry_id]["write_lock"]:
+            # Bị hủy (hoặc bị thay) trong lúc chờ lượt: không chạy
+            if task.cancel_event.is_set(): raise RebuildCancelled()
+            scheduler.start(task, fn, *args, on_progress=on_progress)
+            return await asyncio.wrap_future(task.future)
+    except RebuildCancelled:
+        if task.superseded: raise RebuildSuperseded() from None
+        raise
+    finally:
+        if task.future is None: scheduler.forget(task)
+
+
+async def handle_override_global(hass: HomeAssistant, call: ServiceCall):
+    entry_id = call.data.get("entry_id")
+    if DOMAIN not in hass.data or entry_id not in hass.data[DOMAIN]: return
+
+    db_path = hass.data[DOMAIN][entry_id]["db_path"]
+    entry = hass.config_entries.async_get_entry(entry_id)
+    
+    billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+    apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+
+    raw_date = call.data.get("date")
+    val = call.data.get("value")
+    
+    if hasattr(raw_date, "date"): target_date = raw_date
+    else:
+        target_date = dt_util.parse_datetime(str(raw_date)) or dt_util.parse_date(str(raw_date))
+    
+    y, m, d = target_date.year, target_date.month, target_date.day
+    
+    cache = hass.data[DOMAIN][entry_id].get("cache")
+    tariff = hass.data[DOMAIN][entry_id].get("tariff")
+    hourly = hass.data[DOMAIN][entry_id].get("hourly", False)
+    async with hass.data[DOMAIN][entry_id]["write_lock"]:
+        crossed, anomaly = await hass.async_add_executor_job(
+            write_day, db_path, cache, y, m, d, val, billing_day, apply_date_str, tariff, None, hourly
+        )
+    fire_tier_event(hass, entry_id, cache, crossed)
+    fire_anomaly_event(hass, entry_id, anomaly)
+    hass.data[DOMAIN][entry_id]["last_write"] = time.monotonic()
+    async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry_id}", [date(y, m, d)])
+    notify_days_changed(hass, entry_id, [date(y, m, d)])
+
+
+async def handle_export_global(hass: HomeAssistant, call: ServiceCall):
+    if DOMAIN not in hass.data: return
+
+    entry_id = call.data.get("entry_id")
+    if entry_id:
+        if entry_id not in hass.data[DOMAIN]: return
+        entry_ids = [entry_id]
+    else:
+        entry_ids = list(hass.data[DOMAIN].keys())
+
+    fmt = call.data.get("format", "csv")
+    out_dir = call.data.get("path") or "electricity_consumption_tracker/export"
+    if not os.path.isabs(out_dir): out_dir = hass.config.path(out_dir)
+
+    for e_id in entry_ids:
+        db_path = hass.data[DOMAIN][e_id]["db_path"]
+        if not os.path.exists(db_path): continue
+        try:
+            results = await hass.async_add_executor_job(export_entry, db_path, out_dir, e_id, fmt)
+        except Exception as e:
+            _LOGGER.error(f"Export error {e_id}: {e}")
+            continue
+        for out_path, count in results:
+            _LOGGER.info(f"Exported {count} rows -> {out_path}")
+
+
+async def async_backup_entries(hass: HomeAssistant, entry_ids=None, out_dir=None):
+    """Chụp DB của các entry (mặc định tất cả) vào out_dir bằng SQLite online backup trong executor.
+
+    Mỗi entry một file electricity_data_<entry_id>.db (ghi đè bản cũ khi bản mới đã kiểm tra xong).
+    Trả về [(entry_id, đường dẫn, số byte)].
+    """
+    if DOMAIN not in hass.data: return []
+    out_dir = out_dir or BACKUP_DIR
+    if not os.path.isabs(out_dir): out_dir = hass.config.path(out_dir)
+    await hass.async_add_executor_job(lambda: os.makedirs(out_dir, exist_ok=True))
+
+    results = []
+    lock = hass.data.setdefault(DATA_BACKUP_LOCK, asyncio.Lock())
+    async with lock:
+        for e_id in entry_ids or list(hass.data[DOMAIN].keys()):
+            entry_data = hass.data[DOMAIN].get(e_id)
+            if not entry_data or not os.path.exists(entry_data["db_path"]): continue
+            out_path = os.path.join(out_dir, os.path.basename(entry_data["db_path"]))
+            try:
+                size = await hass.async_add_executor_job(backup_db, entry_data["db_path"], out_path)
+            except Exception as e:
+                _LOGGER.error(f"Backup error {e_id}: {e}")
+                continue
+            entry_data["backup"] = {"path": out_path, "bytes": size, "at": dt_util.now().isoformat()}
+            results.append((e_id, out_path, size))
+    return results
+
+
+async def handle_backup_global(hass: HomeAssistant, call: ServiceCall):
+    entry_id = call.data.get("entry_id")
+    if entry_id and (DOMAIN not in hass.data or entry_id not in hass.data[DOMAIN]): return
+    results = await async_backup_entries(hass, [entry_id] if entry_id else None, call.data.get("path"))
+    for _e_id, out_path, size in results:
+        _LOGGER.info(f"Backed up {size} bytes -> {out_path}")
+
+
+async def handle_import_pyscript(hass: HomeAssistant, call: ServiceCall):
+    entry_id = call.data["entry_id"]
+    if DOMAIN not in hass.data or entry_id not in hass.data[DOMAIN]: return
+    entry = hass.config_entries.async_get_entry(entry_id)
+    entry_data = hass.data[DOMAIN][entry_id]
+
+    source_path = call.data.get("path") or PYSCRIPT_DB_PATH
+    if not os.path.isabs(source_path): source_path = hass.config.path(source_path)
+    billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+    apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+
+    # Chạy trên pool rebuild: có tiến độ (EVENT_REBUILD_PROGRESS) và hủy được bằng cancel_rebuild
+    try:
+        result = await async_run_rebuild(
+            hass, entry_id, REBUILD_IMPORT, import_pyscript_db, entry_data["db_path"], source_path, billing_day, apply_date_str,
+            entry_data.get("tariff"), call.data.get("overwrite", False), entry_data.get("cache"), dt_util.now().date(),
+            entry_data.get("hourly", False)
+        )
+    except RebuildCancelled:
+        _LOGGER.warning(f"Pyscript import cancelled {entry_id}, nothing was written")
+        return
+    except (OSError, ValueError, sqlite3.Error) as e:
+        _LOGGER.error(f"Pyscript import error {entry_id} ({source_path}): {e}")
+        return
+
+    _LOGGER.info(f"Imported {result['rows']} days ({result['first']} -> {result['last']}, "
+                 f"{result['periods']} billing periods) from {source_path} into {entry_id}")
+    entry_data["last_write"] = time.monotonic()
+    async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry_id}", None)
+    # Entry ảo chứa entry này đối chiếu lại toàn bộ (days=None), không gửi danh sách mọi ngày đã nhập
+    if result["rows"]: async_dispatcher_send(hass, SIGNAL_DAYS_CHANGED, entry_id, None)
+
+
+async def async_recompute_all_entries(hass: HomeAssistant, since_str, entry_ids=None):
+    """Tính lại các kỳ bị ảnh hưởng bởi thay đổi bảng giá cho mọi entry (hoặc entry_ids) song song, refresh sensor 1 lần ở cuối."""
+    tables = tables_hash()
+    jobs = []
+    for entry in hass.config_entries.async_entries(DOMAIN):
+        if entry_ids is not None and entry.entry_id not in entry_ids: continue
+        entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+        if not entry_data or not os.path.exists(entry_data["db_path"]): continue
+        billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+        apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+        apply_date = datetime.strptime(apply_date_str, "%Y-%m-%d").date()
+        jobs.append((entry.entry_id, entry_data["db_path"], entry_data.get("cache"), billing_day, apply_date,
+                     entry_data.get("tariff")))
+    if not jobs: return
+
+    results = await asyncio.gather(*(
+        async_run_rebuild(hass, entry_id, REBUILD_TARIFF, recompute_entry, db_path, cache, since_str, billing_day, apply_date, tariff,
+                          tables)
+        for entry_id, db_path, cache, billing_day, apply_date, tariff in jobs
+    ), return_exceptions=True)
+
+    done = []
+    now = time.monotonic()
+    for (entry_id, *_rest), result in zip(jobs, results):
+        if isinstance(result, RebuildCancelled):
+            _LOGGER.warning(f"Tariff recompute cancelled {entry_id}")
+            continue
+        if isinstance(result, BaseException):
+            _LOGGER.error(f"Tariff recompute error {entry_id}: {result}")
+            continue
+        if entry_id not in hass.data.get(DOMAIN, {}): continue
+        hass.data[DOMAIN][entry_id]["last_write"] = now
+        _LOGGER.info(f"Tariff change since {since_str}: recalculated {result} billing periods for {entry_id}")
+        done.append(entry_id)
+    # Refresh sensor một lượt sau khi mọi entry đã tính xong
+    for entry_id in done:
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry_id}", None)
+
+
+async def async_setup(hass: HomeAssistant, config: dict) -> bool:
+    async def override_service_handler(call: ServiceCall):
+        await handle_override_global(hass, call)
+    hass.services.async_register(DOMAIN, "override_data", override_service_handler, schema=SERVICE_OVERRIDE_SCHEMA)
+
+    async def export_service_handler(call: ServiceCall):
+        await handle_export_global(hass, call)
+    hass.services.async_register(DOMAIN, "export_data", export_service_handler, schema=SERVICE_EXPORT_SCHEMA)
+
+    async def backup_service_handler(call: ServiceCall):
+        await handle_backup_global(hass, call)
+    hass.services.async_register(DOMAIN, "backup_data", backup_service_handler, schema=SERVICE_BACKUP_SCHEMA)
+
+    async def cancel_rebuild_handler(call: ServiceCall):
+        count = get_rebuild_scheduler(hass).cancel(call.data.get("entry_id"))
+        _LOGGER.info(f"Cancelled {count} running rebuild(s)")
+    hass.services.async_register(DOMAIN, "cancel_rebuild", cancel_rebuild_handler, schema=SERVICE_CANCEL_REBUILD_SCHEMA)
+
+    async def import_pyscript_handler(call: ServiceCall):
+        await handle_import_pyscript(hass, call)
+    hass.services.async_register(DOMAIN, "import_pyscript", import_pyscript_handler, schema=SERVICE_IMPORT_PYSCRIPT_SCHEMA)
+
+    # [NEW] Bảng giá/VAT đọc từ file trong thư mục dữ liệu, tự nạp lại khi file thay đổi
+    storage_dir = hass.config.path("electricity_consumption_tracker")
+    tariff_state = {"path": None, "mtime": None}
+
+    def check_tariff_file():
+        os.makedirs(storage_dir, exist_ok=True)
+        path = find_tariff_file(storage_dir)
+        if path is None:
+            path = os.path.join(storage_dir, "tariffs.json")
+            write_tariff_file(path)
+        mtime = os.path.getmtime(path)
+        if tariff_state["path"] == path and tariff_state["mtime"] == mtime: return None
+        # File do bản trước tạo ra mang nhầm bảng giá 04/05/2023: sửa lại trước khi nạp
+        if upgrade_tariff_file(path):
+            _LOGGER.info(f"Updated the generated price table in {path} (04/05/2023 and 09/11/2023)")
+            mtime = os.path.getmtime(path)
+        tariff_state.update(path=path, mtime=mtime)
+        return apply_tariff_tables(load_tariff_file(path))
+
+    async def async_check_tariff_file(now=None):
+        try:
+            since = await hass.async_add_executor_job(check_tariff_file)
+        except Exception as e:
+            _LOGGER.error(f"Tariff file error: {e}")
+            return
+        # Lần nạp lúc khởi động chạy trước khi có entry: mỗi entry tự so mã băm bảng giá khi setup
+        if since and now is not None:
+            await async_recompute_all_entries(hass, since)
+
+    await async_check_tariff_file()
+    async_track_time_interval(hass, async_check_tariff_file, timedelta(seconds=TARIFF_WATCH_SECONDS))
+    return True
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    storage_dir = hass.config.path("electricity_consumption_tracker")
+    if not os.path.exists(storage_dir): os.makedirs(storage_dir, exist_ok=True)
+
+    db_path = entry_db_path(storage_dir, entry.entry_id)
+    hass.data.setdefault(DOMAIN, {})
+    # [NEW] Mọi transaction ghi của entry (tick, override, backfill, rebuild, verify...) chạy lần lượt dưới khóa này,
+    # để các dòng tổng hợp được commit đúng thứ tự đã tính
+    write_lock = asyncio.Lock()
+    hass.data[DOMAIN][entry.entry_id] = {"db_path": db_path, "last_write": time.monotonic(), "write_lock": write_lock}
+
+    device_registry = dr.async_get(hass)
+    device_registry.async_get_or_create(
+        config_entry_id=entry.entry_id,
+        identifiers={(DOMAIN, entry.entry_id)},
+        name=entry.data.get(CONF_FRIENDLY_NAME, "Electricity Tracker"),
+        manufacturer="Khaisilk1910",
+        model="Electricity DB",
+        sw_version="2026.01.30",
+    )
+
+    await hass.async_add_executor_job(init_db, db_path)
+
+    # [NEW] Nạp kỳ hóa đơn đang mở vào RAM một lần khi setup
+    billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+    apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+    tariff = get_entry_tariff(entry)
+    # Điền kỳ hóa đơn (ky_nam, ky_thang) cho các dòng chưa có (DB cũ vừa migrate)
+    await hass.async_add_executor_job(
+        sync_billing_config_db, db_path, billing_day, apply_date_str, tariff_options({**entry.data, **entry.options})
+    )
+    cache = OpenPeriodCache(billing_day, datetime.strptime(apply_date_str, "%Y-%m-%d").date(), tariff)
+
+    def load_cache():
+        conn = connect_db(db_path, read_only=True)
+        try:
+            cache.load(conn.cursor(), dt_util.now().date())
+        finally:
+            conn.close()
+
+    await hass.async_add_executor_job(load_cache)
+    # Bảng giá đổi lúc entry không chạy (sửa file khi HA tắt, lần tính lại trước bị hủy): tính lại toàn bộ sau setup
+    stored_tables = await hass.async_add_executor_job(init_tariff_hash_db, db_path, tables_hash())
+    tables_changed = stored_tables is not None and stored_tables != tables_hash()
+    hass.data[DOMAIN][entry.entry_id]["cache"] = cache
+    hass.data[DOMAIN][entry.entry_id]["tariff"] = tariff
+    # [NEW] Nguồn "hôm qua": sensor báo sản lượng của ngày trước đó (ví dụ EVN), nghe thay đổi state thay vì tick
+    source_type = entry.options.get(CONF_SOURCE_TYPE, entry.data.get(CONF_SOURCE_TYPE, SOURCE_TYPE_TODAY))
+    yesterday_source = source_type == SOURCE_TYPE_YESTERDAY
+    hourly = entry.options.get(CONF_HOURLY_HISTORY, False) and not yesterday_source
+    # Dịch vụ override/import đọc cờ này để biết có cần chỉnh hourly_usage theo ngày vừa ghi
+    hass.data[DOMAIN][entry.entry_id]["hourly"] = hourly
+
+    async def update_data(now=None):
+        source_entity = entry.options.get(CONF_SOURCE_SENSOR, entry.data.get(CONF_SOURCE_SENSOR))
+        billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+        apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+
+        state = hass.states.get(source_entity)
+        if not state or state.state in ["unknown", "unavailable"]: return
+        try: current_kwh = float(state.state)
+        except ValueError: return
+
+        dt_now = dt_util.now()
+        y, m, d = dt_now.year, dt_now.month, dt_now.day
+
+        async with write_lock:
+            crossed, anomaly = await hass.async_add_executor_job(
+                write_day, db_path, cache, y, m, d, current_kwh, billing_day, apply_date_str, tariff,
+                dt_now.hour if hourly else None
+            )
+        fire_tier_event(hass, entry.entry_id, cache, crossed)
+        fire_anomaly_event(hass, entry.entry_id, anomaly)
+        hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", [dt_now.date()])
+        notify_days_changed(hass, entry.entry_id, [dt_now.date()])
+
+    # [NEW] Theo giờ: giữ chỉ số mới nhất của sensor nguồn trong RAM, ghi xuống DB một lần khi sang giờ mới
+    pending_hour = {}
+
+    async def flush_hour(at, kwh):
+        try:
+            async with write_lock:
+                crossed, anomaly = await hass.async_add_executor_job(
+                    write_day, db_path, cache, at.year, at.month, at.day, kwh, billing_day, apply_date_str, tariff, at.hour
+                )
+        except Exception as e:
+            _LOGGER.error(f"Hourly write error {entry.entry_id}: {e}")
+            return
+        fire_tier_event(hass, entry.entry_id, cache, crossed)
+        fire_anomaly_event(hass, entry.entry_id, anomaly)
+        hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", [at.date()])
+        notify_days_changed(hass, entry.entry_id, [at.date()])
+
+    @callback
+    def source_changed(event):
+        new_state = event.data.get("new_state")
+        if new_state is None or new_state.state in ["unknown", "unavailable"]: return
+        try: kwh = float(new_state.state)
+        except ValueError: return
+        at = dt_util.as_local(new_state.last_updated)
+        previous = pending_hour.get("reading")
+        pending_hour["reading"] = (at, kwh)
+        # Số đọc cuối cùng của giờ trước (kể cả 23h hôm qua) là chỉ số chốt của giờ đó
+        if previous is not None and (previous[0].date(), previous[0].hour) != (at.date(), at.hour):
+            hass.async_create_task(flush_hour(*previous))
+
+    yesterday_lock = asyncio.Lock()
+    yesterday = YesterdayReadings()
+
+    async def write_yesterday(day, kwh):
+        async with yesterday_lock:
+            if yesterday.is_done(day, kwh): return
+            try:
+                stored = await hass.async_add_executor_job(read_days, db_path, [day])
+                if stored.get(day) == kwh:
+                    yesterday.done(day, kwh)
+                    return
+                async with write_lock:
+                    crossed, anomaly = await hass.async_add_executor_job(
+                        write_day, db_path, cache, day.year, day.month, day.day, kwh, billing_day, apply_date_str, tariff
+                    )
+            except Exception as e:
+                _LOGGER.error(f"Yesterday source write error {entry.entry_id}: {e}")
+                return
+            yesterday.done(day, kwh)
+        _LOGGER.debug(f"Stored {kwh} kWh for {day} from {source_entity} ({entry.entry_id})")
+        fire_tier_event(hass, entry.entry_id, cache, crossed)
+        fire_anomaly_event(hass, entry.entry_id, anomaly)
+        hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", [day])
+        notify_days_changed(hass, entry.entry_id, [day])
+
+    @callback
+    def yesterday_changed(event):
+        new_state = event.data.get("new_state")
+        result = yesterday.reading(new_state.state if new_state else None, dt_util.now().date())
+        if result is not None: hass.async_create_task(write_yesterday(*result))
+
+    # Entry ảo: sản lượng ngày = tổng các entry con, cập nhật theo ngày con báo thay đổi
+    children = entry.options.get(CONF_CHILD_ENTRIES, entry.data.get(CONF_CHILD_ENTRIES, []))
+    # Bỏ con đang chứa chính entry này (cấu hình cũ / sửa đồng thời): SIGNAL_DAYS_CHANGED sẽ lặp vô hạn
+    cyclic = cyclic_children(entry.entry_id, children, children_map(hass.config_entries.async_entries(DOMAIN)))
+    if cyclic:
+        _LOGGER.error(f"Virtual entry {entry.entry_id} ignores children that contain it: {cyclic}")
+        children = [c for c in children if c not in cyclic]
+    child_paths = [entry_db_path(storage_dir, child_id) for child_id in children]
+    sync_lock = asyncio.Lock()
+
+    async def sync_children(days=None):
+        async with sync_lock:
+            try:
+                changed, removed = await hass.async_add_executor_job(plan_sync, db_path, child_paths, days)
+                if not changed and not removed: return
+                if len(changed) == 1 and not removed:
+                    # Một ngày (tick thường lệ của con): đi đường cache tăng dần
+                    (d_obj, val), = changed.items()
+                    async with write_lock:
+                        crossed, anomaly = await hass.async_add_executor_job(
+                            write_day, db_path, cache, d_obj.year, d_obj.month, d_obj.day, val, billing_day, apply_date_str, tariff,
+                            None, hourly
+                        )
+                    fire_tier_event(hass, entry.entry_id, cache, crossed)
+                    fire_anomaly_event(hass, entry.entry_id, anomaly)
+                else:
+                    async with write_lock:
+                        await hass.async_add_executor_job(
+                            write_days, db_path, cache, changed, billing_day, apply_date_str, tariff, removed, hourly
+                        )
+            except Exception as e:
+                _LOGGER.error(f"Virtual entry sync error {entry.entry_id}: {e}")
+                return
+        if days is None:
+            _LOGGER.info(f"Virtual entry {entry.entry_id}: synced {len(changed)} days, removed {len(removed)}")
+        hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", list(changed) + removed)
+        notify_days_changed(hass, entry.entry_id, list(changed) + removed)
+
+    @callback
+    def child_days_changed(child_id, days):
+        if child_id in children: hass.async_create_task(sync_children(days))
+
+    async def checkpoint_if_idle(now=None):
+        # Chỉ checkpoint WAL khi entry đang rảnh (không có tick/override gần đây)
+        entry_data = hass.data[DOMAIN].get(entry.entry_id)
+        if not entry_data: return
+        if time.monotonic() - entry_data.get("last_write", 0) < CHECKPOINT_IDLE_SECONDS: return
+        try:
+            done = await hass.async_add_executor_job(checkpoint_db, db_path)
+        except Exception as e:
+            _LOGGER.debug(f"WAL checkpoint error {entry.entry_id}: {e}")
+            return
+        if not done:
+            _LOGGER.debug(f"WAL checkpoint skipped (busy) {entry.entry_id}")
+
+    async def backfill_gaps(now=None):
+        # Ngày bị thiếu (HA tắt lúc chốt số, sensor nguồn unavailable) được lấy lại từ recorder
+        source_entity = entry.options.get(CONF_SOURCE_SENSOR, entry.data.get(CONF_SOURCE_SENSOR))
+        # Nguồn "hôm qua": ngày D chỉ có số sau khi ngày D+1 kết thúc
+        offset = 1 if yesterday_source else 0
+        last_complete = dt_util.now().date() - timedelta(days=1 + offset)
+        try:
+            missing = await hass.async_add_executor_job(find_missing, db_path, last_complete)
+            if not missing: return
+            values = await async_fetch_daily_values(hass, source_entity, missing, offset)
+            if not values:
+                _LOGGER.debug(f"No recorder data for {len(missing)} missing days of {entry.entry_id}")
+                return
+            async with write_lock:
+                months = await hass.async_add_executor_job(
+                    write_days, db_path, cache, values, billing_day, apply_date_str, tariff, None, hourly
+                )
+        except Exception as e:
+            _LOGGER.error(f"Backfill error {entry.entry_id}: {e}")
+            return
+        _LOGGER.info(f"Backfilled {len(values)}/{len(missing)} missing days ({len(months)} billing periods) for {entry.entry_id}")
+        hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", list(values))
+        notify_days_changed(hass, entry.entry_id, values)
+
+    async def compact_history(now=None):
+        # Nén các năm đã đóng ra khỏi daily_usage và trả lại dung lượng trống
+        keep_from_year = dt_util.now().year - ARCHIVE_HOT_YEARS + 1
+        # Giờ quá hạn giữ lại được gộp thành hồ sơ theo tháng (chạy cả khi đã tắt lưu theo giờ)
+        retention = int(entry.options.get(CONF_HOURLY_RETENTION_DAYS, HOURLY_RETENTION_DAYS_DEFAULT))
+        keep_hours_from = dt_util.now().date() - timedelta(days=retention)
+        try:
+            async with write_lock:
+                hours = await hass.async_add_executor_job(prune_hourly, db_path, keep_hours_from)
+                years, freed = await hass.async_add_executor_job(compact_db, db_path, keep_from_year)
+        except Exception as e:
+            _LOGGER.error(f"History compaction error {entry.entry_id}: {e}")
+            return
+        if hours:
+            _LOGGER.info(f"Folded {hours} hourly rows before {keep_hours_from} for {entry.entry_id}")
+        if years or freed:
+            _LOGGER.info(f"Archived years {years} and freed {freed} pages for {entry.entry_id}")
+
+    async def verify_history(now=None):
+        # Đối chiếu checksum từng kỳ, chỉ sửa kỳ lệch; kết quả xem trong Diagnostics
+        try:
+            async with write_lock:
+                report = await hass.async_add_executor_job(verify_db, db_path, billing_day, apply_date_str, tariff)
+                repaired = report["periods_repaired"] or report["years_repaired"] or report["total_repaired"]
+                # Nạp lại cache trước khi nhả khóa: tick kế tiếp không ghi đè bằng phần "đã đóng" cũ
+                if repaired: await hass.async_add_executor_job(load_cache)
+        except Exception as e:
+            _LOGGER.error(f"Verify error {entry.entry_id}: {e}")
+            return
+        report["checked_at"] = dt_util.now().isoformat()
+        entry_data = hass.data[DOMAIN].get(entry.entry_id)
+        if not entry_data: return
+        entry_data["verify"] = report
+        if not repaired: return
+
+        _LOGGER.warning(f"Repaired aggregates for {entry.entry_id}: {report}")
+        entry_data["last_write"] = time.monotonic()
+        async_dispatcher_send(hass, f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", None)
+
+    virtual = is_virtual_entry(entry)
+    if virtual:
+        entry.async_on_unload(async_dispatcher_connect(hass, SIGNAL_DAYS_CHANGED, child_days_changed))
+    else:
+        source_entity = entry.options.get(CONF_SOURCE_SENSOR, entry.data.get(CONF_SOURCE_SENSOR))
+        if yesterday_source:
+            entry.async_on_unload(async_track_state_change_event(hass, [source_entity], yesterday_changed))
+        else:
+            interval = entry.options.get(CONF_UPDATE_INTERVAL, entry.data.get(CONF_UPDATE_INTERVAL, 1))
+            entry.async_on_unload(async_track_time_interval(hass, update_data, timedelta(hours=interval)))
+            entry.async_on_unload(async_track_time_change(hass, update_data, hour=23, minute=59, second=55))
+        entry.async_on_unload(async_track_time_change(hass, backfill_gaps, hour=BACKFILL_HOUR, minute=BACKFILL_MINUTE, second=0))
+        if hourly:
+            entry.async_on_unload(async_track_state_change_event(hass, [source_entity], source_changed))
+    entry.async_on_unload(async_track_time_interval(hass, checkpoint_if_idle, timedelta(minutes=CHECKPOINT_INTERVAL_MINUTES)))
+    entry.async_on_unload(async_track_time_change(hass, compact_history, hour=COMPACT_HOUR, minute=COMPACT_MINUTE, second=0))
+    entry.async_on_unload(async_track_time_change(hass, verify_history, hour=VERIFY_HOUR, minute=VERIFY_MINUTE, second=0))
+
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(update_listener))
+    
+    if virtual:
+        # Đối chiếu toàn bộ với các con một lần khi khởi động (bù thay đổi lúc entry ảo chưa chạy)
+        hass.async_create_task(sync_children())
+    elif yesterday_source:
+        # Không suy ra ngày từ state lúc khởi động (không biết số thuộc ngày nào): ngày bị lỡ được backfill_gaps
+        # lấy từ recorder, còn số hiện tại chỉ làm mốc để lần đổi state kế tiếp mới được ghi
+        state = hass.states.get(source_entity)
+        yesterday.seed(state.state if state else None)
+        hass.async_create_task(backfill_gaps())
+    else:
+        hass.async_create_task(update_data())
+        hass.async_create_task(backfill_gaps())
+    if tables_changed:
+        _LOGGER.info(f"Tariff tables changed since {entry.entry_id} was last calculated, recalculating history")
+        hass.async_create_task(async_recompute_all_entries(hass, "0000-01-01", [entry.entry_id]))
+    hass.async_create_task(verify_history())
+    
+    return True
+
+async def update_listener(hass: HomeAssistant, entry: ConfigEntry):
+    db_path = hass.data[DOMAIN][entry.entry_id]["db_path"]
+    billing_day = entry.options.get(CONF_BILLING_DAY, entry.data.get(CONF_BILLING_DAY, 1))
+    apply_date_str = entry.options.get(CONF_START_DATE_APPLY, entry.data.get(CONF_START_DATE_APPLY, "2024-01-01"))
+    tariff = get_entry_tariff(entry)
+    # Đổi biểu giá thì mọi kỳ đều phải định giá lại, không chỉ từ ngày áp dụng
+    old_tariff = hass.data[DOMAIN][entry.entry_id].get("tariff")
+    tariff_changed = old_tariff is not None and old_tariff.key != tariff.key
+
+    try:
+        count = await async_run_rebuild(
+            hass, entry.entry_id, REBUILD_OPTIONS, rebuild_history, db_path, billing_day, apply_date_str, tariff, tariff_changed
+        )
+        _LOGGER.info(f"Rebuilt {count} billing periods for {entry.entry_id}")
+    except RebuildSuperseded:
+        # Lần lưu tùy chọn mới hơn sẽ rebuild rồi reload
+        return
+    except RebuildCancelled:
+        _LOGGER.warning(f"History rebuild cancelled {entry.entry_id}, keeping previous data")
+        # Bị hủy vì entry đang gỡ / HA đang dừng thì thôi; hủy bằng cancel_rebuild vẫn reload để áp dụng tùy chọn khác
+        if hass.is_stopping or entry.state is not ConfigEntryState.LOADED: return
+    hass.data[DOMAIN][entry.entry_id]["last_write"] = time.monotonic()
+    await hass.config_entries.async_reload(entry.entry_id)
+
+async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    scheduler = hass.data.get(DATA_REBUILD_SCHEDULER)
+    if scheduler is not None: scheduler.cancel(entry.entry_id)
+    return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
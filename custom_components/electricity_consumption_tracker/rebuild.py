@@ -0,0 +1,113 @@
+"""Bounded rebuild scheduler for the Electricity Consumption Tracker integration."""
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+_LOGGER = logging.getLogger(__name__)
+
+# Mỗi entry là một file DB độc lập nên có thể rebuild song song.
+# Pool riêng (không dùng executor của HA) và giới hạn số luồng để HA luôn còn slot trống.
+MAX_REBUILD_WORKERS = 4
+
+# Loại rebuild: rebuild mới chỉ hủy rebuild cùng loại của entry, khác loại thì xếp hàng
+REBUILD_OPTIONS = "options"
+REBUILD_TARIFF = "tariff"
+REBUILD_IMPORT = "import"
+
+
+def default_workers():
+    return max(1, min(MAX_REBUILD_WORKERS, (os.cpu_count() or 2) - 1))
+
+
+class RebuildTask:
+    """Trạng thái một lần rebuild: loại, tiến độ, cờ hủy, future (None khi còn chờ lượt)."""
+
+    def __init__(self, entry_id, kind):
+        self.entry_id = entry_id
+        self.kind = kind
+        self.cancel_event = threading.Event()
+        self.superseded = False
+        self.done = 0
+        self.total = 0
+        self.future = None
+
+    def report(self, done, total):
+        self.done, self.total = done, total
+
+    def cancel(self, superseded=False):
+        self.superseded = self.superseded or superseded
+        self.cancel_event.set()
+
+    def as_dict(self):
+        return {
+            "entry_id": self.entry_id,
+            "kind": self.kind,
+            "done": self.done,
+            "total": self.total,
+            "cancelled": self.cancel_event.is_set(),
+            "running": self.future is not None and self.future.running(),
+        }
+
+
+class RebuildScheduler:
+    """Phân phối rebuild của nhiều entry lên một thread pool có giới hạn.
+
+    Rebuild mới hủy rebuild cùng loại của cùng entry (đang chạy hoặc đang chờ); các loại khác
+    (tính lại theo bảng giá, nhập pyscript, rebuild theo tùy chọn) không hủy nhau mà xếp hàng:
+    người gọi giữ khóa ghi của entry từ lúc start() đến khi xong (xem integration.async_run_rebuild).
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or default_workers()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._tasks = []
+
+    def queue(self, entry_id, kind):
+        """Đăng ký một rebuild chờ lượt, hủy rebuild cùng loại trước đó của entry. Trả về RebuildTask."""
+        task = RebuildTask(entry_id, kind)
+        with self._lock:
+            for other in self._tasks:
+                if other.entry_id == entry_id and other.kind == kind: other.cancel(superseded=True)
+            self._tasks.append(task)
+        return task
+
+    def start(self, task, fn, *args, on_progress=None):
+        """Chạy fn(*args, cancel_event=..., progress=...) của task trên pool (lần cũ bị hủy thì rollback, không ghi dở)."""
+        def progress(done, total):
+            task.report(done, total)
+            if on_progress is not None: on_progress(task)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ect_rebuild")
+            task.future = self._executor.submit(fn, *args, cancel_event=task.cancel_event, progress=progress)
+        task.future.add_done_callback(lambda _f: self.forget(task))
+        return task
+
+    def submit(self, entry_id, kind, fn, *args, on_progress=None):
+        """queue() rồi start() ngay (không chờ lượt theo khóa ghi)."""
+        return self.start(self.queue(entry_id, kind), fn, *args, on_progress=on_progress)
+
+    def forget(self, task):
+        with self._lock:
+            if task in self._tasks: self._tasks.remove(task)
+
+    def cancel(self, entry_id=None):
+        with self._lock:
+            tasks = [t for t in self._tasks if entry_id is None or t.entry_id == entry_id]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def status(self):
+        with self._lock:
+            return [t.as_dict() for t in self._tasks]
+
+    def shutdown(self):
+        self.cancel()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
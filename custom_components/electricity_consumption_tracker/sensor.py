@@ -1,5 +1,4 @@
 """Sensor platform for Electricity Consumption Tracker."""
-import sqlite3
 import os
 import logging
 from homeassistant.components.sensor import (
@@ -11,80 +10,119 @@ from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
-from .const import DOMAIN, SIGNAL_UPDATE_SENSORS
+import homeassistant.util.dt as dt_util
+from .const import (
+    DOMAIN, SIGNAL_UPDATE_SENSORS,
+    CONF_COMPACT_ATTRIBUTES,
+    CONF_HOURLY_HISTORY, CONF_ENTRY_TYPE, ENTRY_TYPE_VIRTUAL, CONF_SOURCE_TYPE, SOURCE_TYPE_YESTERDAY
+)
+from .attributes import month_attributes, total_attributes, year_attributes
+from .columnar import EntryColumns
+from .billing import get_billing_period
+from .hourly import read_hourly
 
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
     db_path = hass.data[DOMAIN][entry.entry_id]["db_path"]
     friendly_name = entry.data.get("friendly_name", "Electricity")
+    compact = entry.options.get(CONF_COMPACT_ATTRIBUTES, False)
     
-    manager = ElectricitySensorManager(hass, entry, async_add_entities, db_path, friendly_name)
+    # [NEW] Bộ đệm dạng cột dùng chung cho mọi sensor của entry
+    columns = EntryColumns(db_path)
+    hass.data[DOMAIN][entry.entry_id]["columns"] = columns
+
+    manager = ElectricitySensorManager(hass, entry, async_add_entities, columns, friendly_name, compact)
     await manager.async_create_total_sensor()
-    await manager.async_check_and_add_new_sensors()
+    await manager.async_refresh()
+
+    # [NEW] Sản lượng theo giờ, chỉ khi entry đo (nguồn "hôm nay") bật lưu theo giờ
+    source_type = entry.options.get(CONF_SOURCE_TYPE, entry.data.get(CONF_SOURCE_TYPE))
+    if entry.options.get(CONF_HOURLY_HISTORY, False) and entry.data.get(CONF_ENTRY_TYPE) != ENTRY_TYPE_VIRTUAL \
+            and source_type != SOURCE_TYPE_YESTERDAY:
+        async_add_entities([ConsumptionHourlySensor(db_path, f"{friendly_name} Sản lượng theo giờ", entry.entry_id)])
 
     entry.async_on_unload(
         async_dispatcher_connect(
             hass, 
             f"{SIGNAL_UPDATE_SENSORS}_{entry.entry_id}", 
-            manager.async_check_and_add_new_sensors
+            manager.async_refresh
         )
     )
 
 class ElectricitySensorManager:
-    def __init__(self, hass, entry, async_add_entities, db_path, friendly_name):
+    """Cập nhật bộ đệm của entry một lần cho mỗi tín hiệu, tạo sensor mới và chỉ ghi state các sensor có thay đổi.
+
+    Tín hiệu mang theo các ngày vừa ghi: chỉ các kỳ chứa những ngày đó được cập nhật (kỳ đang mở và
+    tổng lấy từ OpenPeriodCache). None (rebuild, import, sửa checksum) = đọc lại toàn bộ DB.
+    """
+
+    def __init__(self, hass, entry, async_add_entities, columns, friendly_name, compact=False):
         self.hass = hass
         self.entry_id = entry.entry_id
         self.async_add_entities = async_add_entities
-        self.db_path = db_path
+        self.columns = columns
+        self.db_path = columns.db_path
         self.friendly_name = friendly_name
-        self.existing_years = set()
-        self.existing_months = set() 
+        self.compact = compact
+        self.entities = {}
         self.total_sensor_created = False
 
     async def async_create_total_sensor(self):
         if not self.total_sensor_created:
-            self.async_add_entities([
-                ConsumptionTotalSensor(self.db_path, f"{self.friendly_name} Total All Time", self.entry_id)
-            ])
+            total = ConsumptionTotalSensor(self.columns, f"{self.friendly_name} Total All Time", self.entry_id, self.compact)
+            self.entities[("total",)] = total
+            # [NEW] Một entity phục vụ toàn bộ bảng so sánh cùng kỳ cho biểu đồ
+            yoy = ConsumptionYoYSensor(self.columns, f"{self.friendly_name} So sánh cùng kỳ", self.entry_id)
+            self.entities[("yoy",)] = yoy
+            entities = [total, yoy]
+            # [NEW] Sensor dự báo cuối kỳ và vị trí bậc giá của kỳ đang mở
+            for key, meta in FORECAST_SENSORS.items():
+                entities.append(ConsumptionForecastSensor(
+                    self.db_path, f"{self.friendly_name} {meta['name']}", self.entry_id, key
+                ))
+            self.async_add_entities(entities)
             self.total_sensor_created = True
 
-    async def async_check_and_add_new_sensors(self):
+    async def async_refresh(self, days=None):
         if not os.path.exists(self.db_path): return
+        cache = self.hass.data.get(DOMAIN, {}).get(self.entry_id, {}).get("cache")
+        try:
+            if days is None or cache is None or not self.columns.loaded:
+                changed = await self.hass.async_add_executor_job(self.columns.refresh)
+            else:
+                periods = {get_billing_period(d, cache.billing_day, cache.apply_date) for d in days}
+                delta = await self.hass.async_add_executor_job(self.columns.read_periods, periods, cache)
+                changed = self.columns.apply(delta)
+        except Exception as e:
+            _LOGGER.error(f"Update error {self.entry_id}: {e}")
+            return
 
-        def get_existing_periods():
-            found_years = []
-            found_months = []
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT nam FROM monthly_bill ORDER BY nam DESC")
-                found_years = [r[0] for r in cursor.fetchall()]
-                cursor.execute("SELECT nam, thang FROM monthly_bill ORDER BY nam DESC, thang DESC")
-                found_months = [(r[0], r[1]) for r in cursor.fetchall()]
-                conn.close()
-            except Exception as e:
-                pass
-            return found_years, found_months
-
-        years, months = await self.hass.async_add_executor_job(get_existing_periods)
+        years, months = self.columns.periods()
         new_entities = []
 
         for year in years:
-            if year not in self.existing_years:
+            if ("year", year) not in self.entities:
                 name = f"{self.friendly_name} - Năm {year}"
-                new_entities.append(ConsumptionYearlySensor(self.db_path, name, year, self.entry_id))
-                self.existing_years.add(year)
+                entity = ConsumptionYearlySensor(self.columns, name, year, self.entry_id, self.compact)
+                self.entities[("year", year)] = entity
+                new_entities.append(entity)
 
         for year, month in months:
-            if (year, month) not in self.existing_months:
+            if ("month", year, month) not in self.entities:
                 name = f"{self.friendly_name} - Tháng {month:02d}/{year}"
-                new_entities.append(ConsumptionMonthlySensor(self.db_path, name, year, month, self.entry_id))
-                self.existing_months.add((year, month))
+                entity = ConsumptionMonthlySensor(self.columns, name, year, month, self.entry_id, self.compact)
+                self.entities[("month", year, month)] = entity
+                new_entities.append(entity)
 
         if new_entities:
             self.async_add_entities(new_entities)
 
+        for key in changed:
+            entity = self.entities.get(key)
+            if entity is not None and entity not in new_entities and entity.hass is not None:
+                entity.async_write_ha_state()
+
 class ConsumptionBase(SensorEntity):
     def __init__(self, db_path, name, entry_id):
         self._db_path = db_path
@@ -100,203 +138,245 @@ class ConsumptionBase(SensorEntity):
         )
 
     @callback
-    def _async_force_update_callback(self):
+    def _async_force_update_callback(self, _days=None):
         self.async_schedule_update_ha_state(True)
 
-    async def async_update(self):
-        if not os.path.exists(self._db_path): return
-        await self.hass.async_add_executor_job(self._update_data_sync)
+    def _get_cache(self):
+        cache = self.hass.data.get(DOMAIN, {}).get(self._entry_id, {}).get("cache")
+        return cache if cache is not None and cache.loaded else None
+
+class ColumnarSensor(SensorEntity):
+    """Sensor chỉ giữ khóa kỳ; giá trị và attribute được đọc từ EntryColumns khi HA ghi state.
 
-    def _update_data_sync(self):
-        raise NotImplementedError()
+    Không poll: ElectricitySensorManager ghi state khi số liệu của khóa này thay đổi.
+    compact=True: phần chi tiết là mốc bắt đầu + các mảng song song (schema_version 2).
+    """
 
-class ConsumptionMonthlySensor(ConsumptionBase):
+    _attr_should_poll = False
+    _attr_has_entity_name = False
+
+    # Mỗi kỳ/năm một entity: khóa riêng của lớp này để trong slot. Các _attr_* do SensorEntity quản lý
+    # (class attribute + cache của HA) nên vẫn nằm trong __dict__ của Entity.
+    __slots__ = ("_columns", "_compact")
+
+    def __init__(self, columns, name, entry_id, compact=False):
+        self._columns = columns
+        self._compact = compact
+        self._attr_name = name
+        self._attr_device_info = {"identifiers": {(DOMAIN, entry_id)}, "name": entry_id}
+
+class ConsumptionMonthlySensor(ColumnarSensor):
     _attr_device_class = SensorDeviceClass.MONETARY
     _attr_state_class = SensorStateClass.TOTAL
     _attr_native_unit_of_measurement = "đ"
+    _attr_icon = "mdi:calendar-month"
 
-    def __init__(self, db_path, name, year, month, entry_id):
-        super().__init__(db_path, name, entry_id)
+    __slots__ = ("_year", "_month")
+
+    def __init__(self, columns, name, year, month, entry_id, compact=False):
+        super().__init__(columns, name, entry_id, compact)
         self._year = year
         self._month = month
         self._attr_unique_id = f"{entry_id}_bill_{year}_{month:02d}"
-        self._attr_icon = "mdi:calendar-month"
 
-    def _update_data_sync(self):
-        try:
-            conn = sqlite3.connect(self._db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT thanh_tien, tong_san_luong, thanh_tien_sau_thue, vat, ngay_bat_dau, ngay_ket_thuc
-                FROM monthly_bill WHERE nam=? AND thang=?
-            """, (self._year, self._month))
-            res = cursor.fetchone()
-            
-            daily_rows = []
-            start_date_str = "N/A"
-            end_date_str = "N/A"
-
-            if res:
-                # [FIX] Handle trường hợp NULL nếu migration chưa kịp chạy
-                start_date_str = res[4] if res[4] else "N/A"
-                end_date_str = res[5] if res[5] else "N/A"
-                
-                if start_date_str != "N/A" and end_date_str != "N/A":
-                    cursor.execute(f"""
-                        SELECT ngay, san_luong 
-                        FROM daily_usage 
-                        WHERE printf('%04d-%02d-%02d', nam, thang, ngay) BETWEEN ? AND ?
-                        ORDER BY nam, thang, ngay ASC
-                    """, (start_date_str, end_date_str))
-                else:
-                    cursor.execute("SELECT ngay, san_luong FROM daily_usage WHERE nam=? AND thang=? ORDER BY ngay ASC", (self._year, self._month))
-                
-                daily_rows = cursor.fetchall()
-
-            conn.close()
-
-            if res:
-                pre_tax = int(res[0]) if res[0] else 0
-                vat_val = res[3] if res[3] is not None else 8
-                
-                db_post_tax = res[2]
-                if db_post_tax and db_post_tax > 0:
-                    post_tax = int(db_post_tax)
-                else:
-                    post_tax = int(pre_tax * (1 + vat_val / 100))
-                
-                self._attr_native_value = pre_tax
-                self._attr_extra_state_attributes = {
-                    "tong_san_luong_kwh": round(res[1], 2),
-                    "tong_tien_truoc_thue": pre_tax,
-                    "tong_tien_sau_thue": post_tax,
-                    "vat_rate": f"{vat_val}%",
-                    "ky_hoa_don": f"{start_date_str} -> {end_date_str}",
-                    "chi_tiet_ngay": {f"Ngay_{r[0]:02d}": round(r[1], 2) for r in daily_rows},
-                    "data_source": "Monthly Detail"
-                }
-            else:
-                self._attr_native_value = 0
-        except Exception as e:
-            _LOGGER.error(f"Update error month {self._month}/{self._year}: {e}")
+    @property
+    def native_value(self):
+        res = self._columns.month(self._year, self._month)
+        return int(res[0]) if res and res[0] else 0
 
-class ConsumptionYearlySensor(ConsumptionBase):
+    @property
+    def extra_state_attributes(self):
+        return month_attributes(self._columns, self._year, self._month, self._compact)
+
+class ConsumptionYearlySensor(ColumnarSensor):
     _attr_device_class = SensorDeviceClass.MONETARY
     _attr_state_class = SensorStateClass.TOTAL
     _attr_native_unit_of_measurement = "đ"
+    _attr_icon = "mdi:calendar-range"
 
-    def __init__(self, db_path, name, year, entry_id):
-        super().__init__(db_path, name, entry_id)
+    __slots__ = ("_year",)
+
+    def __init__(self, columns, name, year, entry_id, compact=False):
+        super().__init__(columns, name, entry_id, compact)
         self._year = year
         self._attr_unique_id = f"{entry_id}_bill_{year}"
-        self._attr_icon = "mdi:calendar-range"
 
-    def _update_data_sync(self):
-        try:
-            conn = sqlite3.connect(self._db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT tong_tien, tong_san_luong, tong_tien_sau_thue, vat 
-                FROM yearly_bill WHERE nam=?
-            """, (self._year,))
-            res = cursor.fetchone()
-            
-            cursor.execute("""
-                SELECT thang, tong_san_luong, thanh_tien, thanh_tien_sau_thue 
-                FROM monthly_bill WHERE nam=? ORDER BY thang ASC
-            """, (self._year,))
-            month_rows = cursor.fetchall()
-            conn.close()
-            
-            if res:
-                pre_tax = int(res[0]) if res[0] else 0
-                vat_val = res[3] if res[3] is not None else 8
-
-                db_post_tax = res[2]
-                if db_post_tax and db_post_tax > 0:
-                    post_tax = int(db_post_tax)
-                else:
-                    post_tax = int(pre_tax * (1 + vat_val / 100))
-                
-                self._attr_native_value = pre_tax
-                self._attr_extra_state_attributes = {
-                    "tong_san_luong_nam": round(res[1], 2),
-                    "tong_tien_truoc_thue": pre_tax,
-                    "tong_tien_sau_thue": post_tax,
-                    "vat_rate": f"{vat_val}%",
-                    "chi_tiet_cac_thang": {
-                        f"Thang_{r[0]:02d}": {
-                            "san_luong_kwh": round(r[1], 2),
-                            "thanh_tien_vnd": int(r[2]),
-                            "thanh_tien_sau_thue_vnd": int(r[3]) if r[3] and r[3] > 0 else int(r[2] * (1 + vat_val/100))
-                        } for r in month_rows
-                    }
-                }
-            else:
-                self._attr_native_value = 0
-        except Exception as e:
-            _LOGGER.error(f"Update error year {self._year}: {e}")
+    @property
+    def native_value(self):
+        res = self._columns.year(self._year)
+        return int(res[0]) if res and res[0] else 0
+
+    @property
+    def extra_state_attributes(self):
+        return year_attributes(self._columns, self._year, self._compact)
 
-class ConsumptionTotalSensor(ConsumptionBase):
+class ConsumptionTotalSensor(ColumnarSensor):
     _attr_device_class = SensorDeviceClass.ENERGY
     _attr_state_class = SensorStateClass.TOTAL_INCREASING
     _attr_native_unit_of_measurement = "kWh"
+    _attr_icon = "mdi:lightning-bolt"
+
+    __slots__ = ()
+
+    def __init__(self, columns, name, entry_id, compact=False):
+        super().__init__(columns, name, entry_id, compact)
+        self._attr_unique_id = f"{entry_id}_total_all_time"
+
+    @property
+    def native_value(self):
+        res = self._columns.total
+        return round(res[0] or 0, 2) if res else 0
+
+    @property
+    def extra_state_attributes(self):
+        return total_attributes(self._columns, self._compact)
+
+class ConsumptionYoYSensor(ColumnarSensor):
+    """Bảng so sánh cùng kỳ (tháng kỳ x năm) đọc từ yoy_comparison.
+
+    State: % chênh lệch sản lượng của kỳ mới nhất so với cùng kỳ năm trước.
+    Attribute: các mảng 12 phần tử (tháng kỳ 1..12) cho từng năm trong `nam`.
+    """
+
+    _attr_native_unit_of_measurement = "%"
+    _attr_icon = "mdi:compare-horizontal"
+
+    __slots__ = ()
+
+    def __init__(self, columns, name, entry_id):
+        super().__init__(columns, name, entry_id)
+        self._attr_unique_id = f"{entry_id}_yoy"
+
+    @property
+    def native_value(self):
+        rows = self._columns.yoy
+        if not rows or rows[-1][4] is None: return None
+        return round(rows[-1][4] * 100, 1)
+
+    @property
+    def extra_state_attributes(self):
+        rows = self._columns.yoy
+        if not rows: return None
+        years = sorted({r[1] for r in rows})
+        index = {y: i for i, y in enumerate(years)}
+        kwh = [[None] * 12 for _ in years]
+        cost = [[None] * 12 for _ in years]
+        vs_prev = [[None] * 12 for _ in years]
+        vs_avg = [[None] * 12 for _ in years]
+        sums, counts = [0.0] * 12, [0] * 12
+        for ky_thang, nam, r_kwh, r_cost, r_prev, _avg, r_vs_avg in rows:
+            i, m = index[nam], ky_thang - 1
+            kwh[i][m] = round(r_kwh or 0, 2)
+            cost[i][m] = int(r_cost or 0)
+            vs_prev[i][m] = round(r_prev * 100, 1) if r_prev is not None else None
+            vs_avg[i][m] = round(r_vs_avg * 100, 1) if r_vs_avg is not None else None
+            sums[m] += r_kwh or 0
+            counts[m] += 1
+        latest = rows[-1]
+        return {
+            "ky_moi_nhat": f"{latest[0]:02d}/{latest[1]}",
+            "nam": years,
+            "san_luong": kwh,
+            "tien": cost,
+            "chenh_lech_nam_truoc": vs_prev,
+            "trung_binh_thang": [round(sums[m] / counts[m], 2) if counts[m] else None for m in range(12)],
+            "chenh_lech_trung_binh": vs_avg,
+        }
+
+FORECAST_SENSORS = {
+    "projected_kwh": {
+        "name": "Dự kiến sản lượng cuối kỳ", "unit": "kWh", "icon": "mdi:chart-line",
+        "device_class": SensorDeviceClass.ENERGY,
+    },
+    "projected_cost": {
+        "name": "Dự kiến tiền điện cuối kỳ", "unit": "đ", "icon": "mdi:cash-clock",
+        "device_class": SensorDeviceClass.MONETARY,
+    },
+    "days_remaining": {
+        "name": "Số ngày còn lại trong kỳ", "unit": "ngày", "icon": "mdi:calendar-clock",
+        "device_class": None,
+    },
+    "tier": {
+        "name": "Bậc giá hiện tại", "unit": None, "icon": "mdi:stairs-up",
+        "device_class": None,
+    },
+    "tier_left": {
+        "name": "kWh còn lại đến bậc kế tiếp", "unit": "kWh", "icon": "mdi:stairs",
+        "device_class": None,
+    },
+}
+
+class ConsumptionForecastSensor(ConsumptionBase):
+    """Sensor của kỳ đang mở, chỉ đọc từ cache (không truy vấn SQLite)."""
+
+    def __init__(self, db_path, name, entry_id, key):
+        super().__init__(db_path, name, entry_id)
+        meta = FORECAST_SENSORS[key]
+        self._key = key
+        self._attr_unique_id = f"{entry_id}_{key}"
+        self._attr_icon = meta["icon"]
+        self._attr_native_unit_of_measurement = meta["unit"]
+        self._attr_device_class = meta["device_class"]
+
+    async def async_update(self):
+        self._update_from_cache()
+
+    def _update_from_cache(self):
+        cache = self._get_cache()
+        if cache is None: return False
+        p = cache.projection(dt_util.now().date())
+
+        if self._key == "projected_kwh":
+            value = round(p["projected_kwh"], 2) if p["projected_kwh"] is not None else None
+        elif self._key == "projected_cost":
+            value = p["projected_cost"]
+        elif self._key == "tier_left":
+            value = round(p["tier_left"], 2) if p["tier_left"] is not None else None
+        else:
+            value = p[self._key]
+
+        self._attr_native_value = value
+        self._attr_extra_state_attributes = {
+            "ky_hoa_don": f"{p['start']} -> {p['end']}",
+            "tong_san_luong_kwh": round(p["kwh"], 2),
+            "tong_tien_truoc_thue": int(p["cost"]),
+        }
+        if self._key == "projected_cost" and p["projected_post_tax"] is not None:
+            self._attr_extra_state_attributes["du_kien_sau_thue"] = p["projected_post_tax"]
+        if self._key in ("projected_kwh", "projected_cost") and p.get("avg_kwh") is not None:
+            self._attr_extra_state_attributes["trung_binh_ngay_kwh"] = round(p["avg_kwh"], 2)
+        if self._key in ("tier", "tier_left"):
+            self._attr_extra_state_attributes["so_bac"] = p["tier_count"]
+        return True
+
+class ConsumptionHourlySensor(ConsumptionBase):
+    """Sản lượng của giờ hiện tại; attribute gồm 24 giờ hôm nay và trung bình từng giờ các ngày trước."""
+
+    _attr_should_poll = False
+    _attr_icon = "mdi:clock-time-four-outline"
+    _attr_native_unit_of_measurement = "kWh"
 
     def __init__(self, db_path, name, entry_id):
         super().__init__(db_path, name, entry_id)
-        self._attr_unique_id = f"{entry_id}_total_all_time"
-        self._attr_icon = "mdi:lightning-bolt"
+        self._attr_unique_id = f"{entry_id}_hourly"
 
-    def _update_data_sync(self):
+    async def async_update(self):
+        if not os.path.exists(self._db_path): return
+        now = dt_util.now()
         try:
-            conn = sqlite3.connect(self._db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT tong_san_luong, tong_so_thang, 
-                       thoi_diem_bat_dau, thoi_diem_ket_thuc, 
-                       tong_tien_tich_luy, tong_tien_tich_luy_sau_thue, vat 
-                FROM total_usage
-            """)
-            res = cursor.fetchone()
-            
-            cursor.execute("""
-                SELECT nam, tong_san_luong, tong_tien, tong_tien_sau_thue, vat
-                FROM yearly_bill ORDER BY nam DESC
-            """)
-            years_stats = cursor.fetchall()
-            conn.close()
-            
-            if res:
-                self._attr_native_value = round(res[0], 2)
-                
-                total_pre = int(res[4]) if res[4] else 0
-                db_total_post = res[5]
-                vat_val = res[6] if res[6] is not None else 8
-
-                if db_total_post and db_total_post > 0:
-                    total_post = int(db_total_post)
-                else:
-                    total_post = int(total_pre * (1 + vat_val / 100))
-
-                self._attr_extra_state_attributes = {
-                    "tong_so_thang_du_lieu": res[1],
-                    "thoi_diem_bat_dau": res[2],
-                    "thoi_diem_ket_thuc": res[3],
-                    "tong_tien_tich_luy": total_pre,
-                    "tong_tien_tich_luy_sau_thue": total_post,
-                    "current_vat_ref": f"{vat_val}%",
-                    "chi_tiet_tung_nam": {
-                        f"Nam_{y[0]}": {
-                            "tong_san_luong_kwh": round(y[1], 2),
-                            "tong_tien_vnd": int(y[2]),
-                            "tong_tien_sau_thue_vnd": int(y[3]) if y[3] and y[3] > 0 else int(y[2] * (1 + (y[4] or 8)/100))
-                        } for y in years_stats
-                    }
-                }
-            else:
-                self._attr_native_value = 0
+            data = await self.hass.async_add_executor_job(read_hourly, self._db_path, now.date())
         except Exception as e:
-            _LOGGER.error(f"Update error total: {e}")
+            _LOGGER.error(f"Hourly read error {self._entry_id}: {e}")
+            return
+        if data is None:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {}
+            return
+        current = data["today"][now.hour]
+        self._attr_native_value = round(current, 3) if current is not None else None
+        self._attr_extra_state_attributes = {
+            "ngay": now.date().isoformat(),
+            "hom_nay": [round(v, 3) if v is not None else None for v in data["today"]],
+            "trung_binh_gio": [round(v, 3) if v is not None else None for v in data["average"]],
+            "so_ngay_trung_binh": data["days"],
+        }
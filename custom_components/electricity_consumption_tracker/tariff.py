@@ -0,0 +1,292 @@
+"""Tariff engines for the Electricity Consumption Tracker integration."""
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+
+from .const import (
+    PRICE_HISTORY, TOU_PRICE_HISTORY, VAT_HISTORY,
+    CONF_TARIFF_TYPE, CONF_FIXED_PRICE, CONF_TOU_PEAK_SHARE, CONF_TOU_OFFPEAK_SHARE,
+    TARIFF_RESIDENTIAL, TARIFF_TIME_OF_USE, TARIFF_FIXED
+)
+
+
+class TariffTables:
+    """Một bản bảng giá/VAT không đổi sau khi tạo, kèm các bảng đã biên dịch của chính nó.
+
+    Đổi bảng giá = gán một bản mới cho _tables (1 phép gán): luồng đang tính tiền đọc
+    _tables một lần nên luôn thấy trọn một bản, không bao giờ thấy bảng đang sửa dở.
+    """
+
+    def __init__(self, price_history, tou_price_history, vat_history):
+        self.price_history = dict(price_history)
+        self.tou_price_history = dict(tou_price_history)
+        self.vat_history = dict(vat_history)
+        self.price_keys = tuple(sorted(self.price_history))
+        self.tou_keys = tuple(sorted(self.tou_price_history))
+        self.vat_keys = tuple(sorted(self.vat_history))
+        self._compiled = {}
+        self.hash = hashlib.sha256(json.dumps(self.as_json(), sort_keys=True).encode()).hexdigest()
+
+    def as_json(self):
+        """Dạng ghi ra file (giới hạn bậc cuối = null)."""
+        return {
+            "price_history": {k: [[None if l == float('inf') else l, p] for l, p in v] for k, v in sorted(self.price_history.items())},
+            "tou_price_history": {k: list(v) for k, v in sorted(self.tou_price_history.items())},
+            "vat_history": dict(sorted(self.vat_history.items())),
+        }
+
+    def compiled_tiers(self, effective_key):
+        """Biên dịch bảng bậc thành (cận trên lũy kế, đơn giá, tiền lũy kế tại cận dưới)."""
+        compiled = self._compiled.get(effective_key)
+        if compiled is None:
+            uppers, prices, bases = [], [], []
+            upper = 0
+            base = 0
+            for limit, price in self.price_history[effective_key]:
+                uppers.append(upper + limit)
+                prices.append(price)
+                bases.append(base)
+                if limit != float('inf'):
+                    base += limit * price
+                    upper += limit
+            compiled = self._compiled[effective_key] = (tuple(uppers), tuple(prices), tuple(bases))
+        return compiled
+
+
+def _effective_key(keys, year, month):
+    """Mốc giá áp dụng cho kỳ (so sánh với ngày 01 của tháng, giống calculate_cost cũ)."""
+    idx = bisect_right(keys, f"{year}-{month:02d}-01") - 1
+    return keys[max(idx, 0)]
+
+
+# Bảng đang dùng: mặc định trong const, được thay bằng nội dung tariffs.json/tariffs.yaml (apply_tariff_tables)
+_tables = TariffTables(PRICE_HISTORY, TOU_PRICE_HISTORY, VAT_HISTORY)
+
+
+def tables_hash():
+    """Mã băm của bảng giá/VAT đang dùng, lưu vào DB sau mỗi lần tính lại theo bảng giá."""
+    return _tables.hash
+
+
+def get_vat_rate(year, month, day):
+    tables = _tables
+    idx = bisect_right(tables.vat_keys, f"{year}-{month:02d}-{day:02d}") - 1
+    return tables.vat_history[tables.vat_keys[max(idx, 0)]]
+
+
+class TariffEngine(ABC):
+    """Giao diện chung: tính tiền (trước thuế) cho một hoặc nhiều kỳ."""
+
+    tariff_type = None
+
+    @property
+    def key(self):
+        """Định danh biểu giá + tham số, dùng để biết có cần tính lại toàn bộ lịch sử."""
+        return (self.tariff_type,)
+
+    def price(self, kwh, year, month):
+        return self.price_many([(year, month, kwh)])[0]
+
+    @abstractmethod
+    def price_many(self, periods):
+        """Tính tiền cho danh sách (năm, tháng, kWh), trả về list cùng thứ tự.
+
+        Gọi theo lô để bảng giá (_tables) chỉ được đọc một lần cho cả lô; bên trong vẫn là
+        vòng lặp Python từng kỳ (tra bậc bằng bisect), không phải phép tính véc-tơ.
+        """
+
+    def tiers(self, year, month):
+        """Bảng bậc (giới hạn, đơn giá) nếu biểu giá có bậc, ngược lại []."""
+        return []
+
+
+class TieredResidentialTariff(TariffEngine):
+    """Biểu giá sinh hoạt bậc thang EVN (PRICE_HISTORY)."""
+
+    tariff_type = TARIFF_RESIDENTIAL
+
+    def price_many(self, periods):
+        tables = _tables
+        results = []
+        for year, month, kwh in periods:
+            if not kwh or kwh <= 0:
+                results.append(0)
+                continue
+            uppers, prices, bases = tables.compiled_tiers(_effective_key(tables.price_keys, year, month))
+            i = min(bisect_right(uppers, kwh), len(uppers) - 1)
+            # kWh nằm đúng cận trên thì vẫn thuộc bậc dưới (giống vòng lặp cũ)
+            if i > 0 and kwh <= uppers[i - 1]: i -= 1
+            lower = uppers[i - 1] if i > 0 else 0
+            results.append(round(bases[i] + (kwh - lower) * prices[i]))
+        return results
+
+    def tiers(self, year, month):
+        tables = _tables
+        return tables.price_history[_effective_key(tables.price_keys, year, month)]
+
+
+class TimeOfUseTariff(TariffEngine):
+    """Biểu giá theo giờ (cao điểm / bình thường / thấp điểm), tính xấp xỉ theo tỷ lệ cố định.
+
+    Engine chỉ nhận tổng kWh của kỳ nên mọi kỳ đều được chia theo tỷ lệ cấu hình,
+    kể cả khi entry có lưu sản lượng theo giờ (hourly_usage không được dùng để tính tiền).
+    Đơn giá bình quân của mỗi bộ giá (bình thường, thấp điểm, cao điểm) được tính một lần.
+    """
+
+    tariff_type = TARIFF_TIME_OF_USE
+
+    def __init__(self, peak_share, offpeak_share):
+        self.peak_share = max(0.0, min(float(peak_share), 100.0)) / 100
+        self.offpeak_share = max(0.0, min(float(offpeak_share), 100.0 - self.peak_share * 100)) / 100
+        self._blended = {}
+
+    @property
+    def key(self):
+        return (self.tariff_type, self.peak_share, self.offpeak_share)
+
+    def _blended_price(self, prices):
+        # Khóa theo chính bộ giá nên không cần xóa khi bảng giá thay đổi
+        if prices not in self._blended:
+            normal, offpeak, peak = prices
+            normal_share = 1 - self.peak_share - self.offpeak_share
+            self._blended[prices] = peak * self.peak_share + offpeak * self.offpeak_share + normal * normal_share
+        return self._blended[prices]
+
+    def price_many(self, periods):
+        tables = _tables
+        return [
+            round(max(kwh or 0, 0) * self._blended_price(
+                tables.tou_price_history[_effective_key(tables.tou_keys, year, month)]))
+            for year, month, kwh in periods
+        ]
+
+
+class FixedPriceTariff(TariffEngine):
+    """Một đơn giá cố định cho mọi kWh."""
+
+    tariff_type = TARIFF_FIXED
+
+    def __init__(self, unit_price):
+        self.unit_price = float(unit_price)
+
+    @property
+    def key(self):
+        return (self.tariff_type, self.unit_price)
+
+    def price_many(self, periods):
+        return [round(max(kwh or 0, 0) * self.unit_price) for _year, _month, kwh in periods]
+
+
+DEFAULT_TARIFF = TieredResidentialTariff()
+
+
+def build_tariff(options):
+    """Tạo engine từ options/data của config entry."""
+    tariff_type = options.get(CONF_TARIFF_TYPE, TARIFF_RESIDENTIAL)
+    if tariff_type == TARIFF_TIME_OF_USE:
+        return TimeOfUseTariff(options.get(CONF_TOU_PEAK_SHARE, 20), options.get(CONF_TOU_OFFPEAK_SHARE, 30))
+    if tariff_type == TARIFF_FIXED:
+        return FixedPriceTariff(options.get(CONF_FIXED_PRICE, 0))
+    return DEFAULT_TARIFF
+
+
+def tariff_options(options):
+    """Phần options quyết định bảng giá, lưu vào billing_config để CLI tính đúng giá của entry."""
+    keys = (CONF_TARIFF_TYPE, CONF_FIXED_PRICE, CONF_TOU_PEAK_SHARE, CONF_TOU_OFFPEAK_SHARE)
+    return {k: options[k] for k in keys if options.get(k) is not None}
+
+
+# --- BẢNG GIÁ TỪ FILE (hot reload) ---
+
+TARIFF_FILE_NAMES = ("tariffs.yaml", "tariffs.json")
+TARIFF_WATCH_SECONDS = 60
+
+
+def find_tariff_file(storage_dir):
+    for name in TARIFF_FILE_NAMES:
+        path = os.path.join(storage_dir, name)
+        if os.path.exists(path): return path
+    return None
+
+
+def write_tariff_file(path):
+    """Ghi bảng giá đang dùng ra file JSON để người dùng sửa (giới hạn bậc cuối = null)."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_tables.as_json(), f, indent=2, ensure_ascii=False)
+
+
+def load_tariff_file(path):
+    """Đọc và kiểm tra file bảng giá (JSON hoặc YAML). Lỗi định dạng -> ValueError."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+
+    price = {}
+    for k, tiers in (data.get("price_history") or PRICE_HISTORY).items():
+        parsed = [(float('inf') if l is None or l == float('inf') else float(l), float(p)) for l, p in tiers]
+        if not parsed or parsed[-1][0] != float('inf'):
+            raise ValueError(f"price_history[{k}]: bậc cuối phải có giới hạn null")
+        price[str(k)] = parsed
+
+    tou = {}
+    for k, prices in (data.get("tou_price_history") or TOU_PRICE_HISTORY).items():
+        if len(prices) != 3:
+            raise ValueError(f"tou_price_history[{k}]: cần [bình thường, thấp điểm, cao điểm]")
+        tou[str(k)] = tuple(float(p) for p in prices)
+
+    vat = {str(k): float(v) for k, v in (data.get("vat_history") or VAT_HISTORY).items()}
+    if not vat:
+        raise ValueError("vat_history rỗng")
+
+    return {"price_history": price, "tou_price_history": tou, "vat_history": vat}
+
+
+def _is_legacy_generated(price_history):
+    """Bảng giá do bản trước tự ghi ra file: thiếu mốc 2023-11-09 và mốc 2023-05-04 mang nhầm giá của 09/11/2023."""
+    legacy = {k: v for k, v in PRICE_HISTORY.items() if k != "2023-11-09"}
+    legacy["2023-05-04"] = PRICE_HISTORY["2023-11-09"]
+    return price_history == legacy
+
+
+def upgrade_tariff_file(path):
+    """Sửa price_history của file JSON được tạo tự động với bảng giá sai (chưa bị người dùng sửa).
+
+    Chỉ thay price_history; VAT và giá theo giờ trong file giữ nguyên. Trả về True nếu đã ghi lại file.
+    """
+    if not path.endswith(".json"): return False
+    if not _is_legacy_generated(load_tariff_file(path)["price_history"]): return False
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["price_history"] = TariffTables(PRICE_HISTORY, {}, {}).as_json()["price_history"]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return True
+
+
+def _earliest_change(old, new):
+    changed = [k for k in set(old) | set(new) if old.get(k) != new.get(k)]
+    if not changed: return None
+    # Mốc đầu tiên còn được dùng cho mọi kỳ trước nó
+    if min(changed) == min(set(old) | set(new)): return "0000-01-01"
+    return min(changed)
+
+
+def apply_tariff_tables(tables):
+    """Thay bảng giá/VAT đang dùng bằng một bản mới (1 phép gán). Trả về ngày sớm nhất bị ảnh hưởng (YYYY-MM-DD) hoặc None."""
+    global _tables
+    current = _tables
+    changes = [
+        _earliest_change(current.price_history, tables["price_history"]),
+        _earliest_change(current.tou_price_history, tables["tou_price_history"]),
+        _earliest_change(current.vat_history, tables["vat_history"]),
+    ]
+    changes = [c for c in changes if c]
+    if not changes: return None
+
+    _tables = TariffTables(tables["price_history"], tables["tou_price_history"], tables["vat_history"])
+    return min(changes)
@@ -0,0 +1,83 @@
+"""Virtual (aggregate) entries for the Electricity Consumption Tracker integration."""
+import os
+from datetime import date
+
+from .const import CONF_CHILD_ENTRIES, CONF_ENTRY_TYPE, ENTRY_TYPE_VIRTUAL
+from .db import connect_db
+
+# Chênh lệch nhỏ hơn mức này coi như bằng nhau (sai số cộng dồn số thực giữa các con)
+SYNC_TOLERANCE = 0.0005
+# Số ngày mỗi câu IN (3 tham số / ngày, dưới giới hạn 999 tham số của SQLite cũ)
+_DAYS_PER_QUERY = 300
+
+
+def children_map(entries):
+    """{entry_id ảo: [entry con]} từ các config entry của tích hợp."""
+    return {
+        e.entry_id: e.options.get(CONF_CHILD_ENTRIES, e.data.get(CONF_CHILD_ENTRIES, []))
+        for e in entries if e.data.get(CONF_ENTRY_TYPE) == ENTRY_TYPE_VIRTUAL
+    }
+
+
+def containers_of(entry_id, children_of):
+    """Các entry ảo chứa entry_id, trực tiếp hoặc qua entry ảo khác. children_of: {entry_id ảo: [entry con]}."""
+    result, stack = set(), [entry_id]
+    while stack:
+        current = stack.pop()
+        for parent, children in children_of.items():
+            if current in children and parent not in result:
+                result.add(parent)
+                stack.append(parent)
+    return result
+
+
+def cyclic_children(entry_id, children, children_of):
+    """Các con làm entry_id tự chứa chính nó (là chính nó hoặc đang chứa nó): SIGNAL_DAYS_CHANGED sẽ lặp vô hạn."""
+    containers = containers_of(entry_id, {k: v for k, v in children_of.items() if k != entry_id})
+    return [c for c in children if c == entry_id or c in containers]
+
+
+def read_days(db_path, days=None):
+    """Sản lượng theo ngày của một DB: {date: kWh}. days=None: toàn bộ lịch sử."""
+    conn = connect_db(db_path, read_only=True)
+    try:
+        cursor = conn.cursor()
+        if days is None:
+            cursor.execute("SELECT nam, thang, ngay, san_luong FROM daily_values")
+            rows = cursor.fetchall()
+        else:
+            rows = []
+            days = sorted(days)
+            for i in range(0, len(days), _DAYS_PER_QUERY):
+                chunk = days[i:i + _DAYS_PER_QUERY]
+                cursor.execute(f"""
+                    SELECT nam, thang, ngay, san_luong FROM daily_values
+                    WHERE (nam, thang, ngay) IN (VALUES {", ".join(["(?, ?, ?)"] * len(chunk))})
+                      AND nam BETWEEN ? AND ?
+                """, [x for d in chunk for x in (d.year, d.month, d.day)] + [chunk[0].year, chunk[-1].year])
+                rows += cursor.fetchall()
+        return {date(r[0], r[1], r[2]): r[3] or 0.0 for r in rows}
+    finally:
+        conn.close()
+
+
+def merge_days(child_paths, days=None):
+    """Tổng sản lượng theo ngày của các DB con (ngày không có ở con nào thì không có trong kết quả)."""
+    merged = {}
+    for path in child_paths:
+        if not os.path.exists(path): continue
+        for d, val in read_days(path, days).items():
+            merged[d] = merged.get(d, 0.0) + val
+    return merged
+
+
+def plan_sync(db_path, child_paths, days=None):
+    """So DB ảo với tổng của các con, trả về (ngày cần ghi {date: kWh}, ngày cần xóa [date]).
+
+    days=None so toàn bộ lịch sử (lúc khởi động); ngược lại chỉ các ngày được báo thay đổi.
+    """
+    merged = merge_days(child_paths, days)
+    current = read_days(db_path, days)
+    changed = {d: v for d, v in merged.items() if d not in current or abs(current[d] - v) > SYNC_TOLERANCE}
+    removed = sorted(d for d in current if d not in merged)
+    return changed, removed
@@ -0,0 +1,47 @@
+"""Source sensors reporting yesterday's consumption for the Electricity Consumption Tracker integration."""
+from datetime import timedelta
+
+# State không mang số liệu (sensor chưa sẵn sàng / mất kết nối)
+UNKNOWN_STATES = ("unknown", "unavailable")
+
+
+def parse_kwh(value):
+    """Số kWh từ chuỗi state của sensor, None nếu không phải số."""
+    if value is None or value in UNKNOWN_STATES: return None
+    try: return float(value)
+    except ValueError: return None
+
+
+class YesterdayReadings:
+    """Gán ngày cho số đọc của sensor nguồn "hôm qua" và bỏ các lần báo lặp.
+
+    - Số đổi trong ngày D+1 (giờ địa phương lúc nhận sự kiện) là sản lượng của ngày D. Không dùng
+      last_changed: sau khởi động lại hoặc cập nhật trễ nó không phải ngày của số liệu.
+    - Chỉ đổi attribute, hoặc về lại từ unavailable với đúng số cũ: không phải số của ngày mới.
+    - (ngày, kWh) đã ghi/đã có trong DB được nhớ lại để sự kiện lặp không phải đọc DB; so theo cả ngày nên
+      hai ngày liên tiếp có cùng sản lượng vẫn được ghi.
+    Chỉ dùng trong event loop (không cần khóa).
+    """
+
+    def __init__(self):
+        # Số hợp lệ gần nhất của sensor nguồn (kể cả qua khoảng unavailable)
+        self.last_kwh = None
+        # (ngày, kWh) đã xử lý gần nhất
+        self.last_done = None
+
+    def seed(self, value):
+        """Lúc khởi động: state hiện tại chỉ làm mốc, không suy ra ngày (ngày bị lỡ do backfill lấy từ recorder)."""
+        self.last_kwh = parse_kwh(value)
+
+    def reading(self, value, today):
+        """State mới của sensor nguồn nhận trong ngày `today`. Trả về (ngày, kWh) cần ghi hoặc None."""
+        kwh = parse_kwh(value)
+        if kwh is None or kwh == self.last_kwh: return None
+        self.last_kwh = kwh
+        return today - timedelta(days=1), kwh
+
+    def is_done(self, day, kwh):
+        return self.last_done == (day, kwh)
+
+    def done(self, day, kwh):
+        self.last_done = (day, kwh)
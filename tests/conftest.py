@@ -0,0 +1,5 @@
+"""Cho phép import các module tính toán (không cần Home Assistant) trong test."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "custom_components"))
@@ -0,0 +1,106 @@
+"""Thống kê bất thường cập nhật tăng dần (Welford thêm/bớt) phải khớp với dựng lại cửa sổ từ đầu."""
+import statistics
+from datetime import date, timedelta
+
+import pytest
+
+from electricity_consumption_tracker.anomaly import (
+    ANOMALY_WINDOW_DAYS, _add, _load, _remove, _window_stats, read_anomaly_state, update_anomaly_stats,
+)
+from electricity_consumption_tracker.db import connect_db, init_db
+
+
+def _kwh(d):
+    # Cuối tuần dùng nhiều hơn, thêm dao động theo ngày để phương sai khác 0
+    return round((9.0 if d.weekday() >= 5 else 6.0) + (d.toordinal() * 7 % 13) * 0.21, 2)
+
+
+def _write(cursor, d, val):
+    """Như một lần ghi ngày thật: cập nhật thống kê TRƯỚC, rồi mới ghi daily_usage."""
+    result = update_anomaly_stats(cursor, d, val)
+    cursor.execute("""
+        INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, ?, 'kWh')
+        ON CONFLICT(nam, thang, ngay) DO UPDATE SET san_luong = excluded.san_luong
+    """, (d.year, d.month, d.day, val))
+    return result
+
+
+def _assert_matches_rebuild(cursor):
+    anchor, stats = _load(cursor)
+    fresh = _window_stats(cursor, anchor)
+    for thu in range(7):
+        assert stats[thu][0] == fresh[thu][0], thu
+        assert stats[thu][1:] == pytest.approx(fresh[thu][1:], abs=1e-9), thu
+
+
+@pytest.fixture
+def cursor(tmp_path):
+    path = str(tmp_path / "anomaly.db")
+    init_db(path)
+    conn = connect_db(path)
+    yield conn.cursor()
+    conn.close()
+
+
+def test_add_remove_match_sample_statistics():
+    values = [4.2, 7.9, 5.5, 6.1, 12.3, 3.3, 8.8]
+    stat = (0, 0.0, 0.0)
+    for x in values: stat = _add(stat, x)
+    for x in values[:3]: stat = _remove(stat, x)
+
+    rest = values[3:]
+    assert stat[0] == len(rest)
+    assert stat[1] == pytest.approx(statistics.mean(rest))
+    assert stat[2] / (stat[0] - 1) == pytest.approx(statistics.variance(rest))
+    assert _remove((1, 5.0, 0.0), 5.0) == (0, 0.0, 0.0)
+
+
+def test_sliding_window_with_overrides_and_short_gaps(cursor):
+    start = date(2025, 11, 1)
+    skipped = {start + timedelta(days=n) for n in (20, 21, 45, 90)}
+    for n in range(130):
+        d = start + timedelta(days=n)
+        if d in skipped: continue
+        _write(cursor, d, _kwh(d))
+        if n % 9 == 0: _assert_matches_rebuild(cursor)
+
+    anchor, _ = _load(cursor)
+    # Sửa lại một ngày trong cửa sổ, một ngày ngay mép cửa sổ và một ngày quá cũ (bị bỏ qua)
+    for back in (3, ANOMALY_WINDOW_DAYS, ANOMALY_WINDOW_DAYS + 10):
+        d = anchor - timedelta(days=back)
+        _write(cursor, d, _kwh(d) + 4.0)
+        _assert_matches_rebuild(cursor)
+    assert _load(cursor)[0] == anchor
+
+
+def test_gap_longer_than_window_rebuilds(cursor):
+    first = date(2026, 1, 5)
+    for n in range(40):
+        d = first + timedelta(days=n)
+        _write(cursor, d, _kwh(d))
+    resume = first + timedelta(days=39 + ANOMALY_WINDOW_DAYS + 5)
+
+    _write(cursor, resume, _kwh(resume))
+
+    anchor, stats = _load(cursor)
+    assert anchor == resume
+    assert all(stat == (0, 0.0, 0.0) for stat in stats.values())
+    _assert_matches_rebuild(cursor)
+
+
+def test_spike_is_flagged_when_the_day_completes(cursor):
+    first = date(2026, 3, 2)
+    for n in range(ANOMALY_WINDOW_DAYS):
+        d = first + timedelta(days=n)
+        _write(cursor, d, _kwh(d))
+    spike = first + timedelta(days=ANOMALY_WINDOW_DAYS)
+    # Ghi ngày mới chỉ đánh giá ngày trước đó (đã hoàn tất); hôm nay còn đang tăng
+    previous = _write(cursor, spike, 60.0)
+    assert previous["ngay"] == (spike - timedelta(days=1)).isoformat() and previous["bat_thuong"] is False
+
+    result = _write(cursor, spike + timedelta(days=1), _kwh(spike))
+
+    assert result["ngay"] == spike.isoformat() and result["bat_thuong"] is True
+    assert result["so_mau"] == ANOMALY_WINDOW_DAYS // 7
+    assert read_anomaly_state(cursor)["ngay"] == spike.isoformat()
+    _assert_matches_rebuild(cursor)
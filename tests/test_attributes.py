@@ -0,0 +1,100 @@
+"""Attribute gọn (schema_version 2) nhỏ hơn attribute cũ và giải mã ra cùng số liệu."""
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from electricity_consumption_tracker.attributes import month_attributes, total_attributes, year_attributes
+from electricity_consumption_tracker.billing import rebuild_history
+from electricity_consumption_tracker.columnar import EntryColumns
+from electricity_consumption_tracker.db import connect_db, init_db
+
+BILLING_DAY = 15
+APPLY_DATE = "2020-01-01"
+FIRST_DAY = date(2023, 1, 1)
+LAST_DAY = date(2024, 3, 10)
+MISSING_DAY = date(2023, 6, 20)
+
+
+@pytest.fixture
+def columns(tmp_path):
+    path = str(tmp_path / "entry.db")
+    init_db(path)
+    conn = connect_db(path)
+    d, rows = FIRST_DAY, []
+    while d <= LAST_DAY:
+        if d != MISSING_DAY:
+            rows.append((d.year, d.month, d.day, round(3 + (d.toordinal() % 17) * 0.37, 3), "kWh"))
+        d += timedelta(days=1)
+    conn.executemany("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    rebuild_history(path, BILLING_DAY, APPLY_DATE, full=True)
+    cols = EntryColumns(path)
+    cols.refresh()
+    return cols
+
+
+def _size(attrs):
+    return len(json.dumps(attrs, ensure_ascii=False, separators=(",", ":")))
+
+
+def _legacy_days(attrs):
+    start, end = (date.fromisoformat(s) for s in attrs["ky_hoa_don"].split(" -> "))
+    detail = attrs["chi_tiet_ngay"]
+    result = {}
+    d = start
+    while d <= end:
+        key = f"Ngay_{d.day:02d}"
+        if key in detail: result[d] = detail[key]
+        d += timedelta(days=1)
+    assert len(result) == len(detail)
+    return result
+
+
+def _compact_days(attrs):
+    start = date.fromisoformat(attrs["ngay_bat_dau"])
+    return {start + timedelta(days=i): v for i, v in enumerate(attrs["san_luong_ngay"]) if v is not None}
+
+
+def test_month_attributes_decode_to_same_days(columns):
+    _years, months = columns.periods()
+    assert len(months) >= 12
+    legacy_total = compact_total = 0
+    for year, month in months:
+        legacy = month_attributes(columns, year, month)
+        compact = month_attributes(columns, year, month, compact=True)
+        assert legacy["schema_version"] == 1 and compact["schema_version"] == 2
+        assert _legacy_days(legacy) == _compact_days(compact)
+        legacy_total += _size(legacy)
+        compact_total += _size(compact)
+    assert MISSING_DAY not in _compact_days(month_attributes(columns, 2023, 6, compact=True))
+    # Bỏ khóa "Ngay_xx" lặp lại ở mỗi ngày: attribute kỳ nhỏ hơn ít nhất 30%
+    assert compact_total < legacy_total * 0.7
+
+
+def test_year_and_total_attributes_decode_to_same_values(columns):
+    years, _months = columns.periods()
+    for year in years:
+        legacy = year_attributes(columns, year)
+        compact = year_attributes(columns, year, compact=True)
+        decoded = {
+            f"Thang_{compact['thang_bat_dau'] + i:02d}": {
+                "san_luong_kwh": kwh, "thanh_tien_vnd": cost, "thanh_tien_sau_thue_vnd": post,
+            }
+            for i, (kwh, cost, post) in enumerate(zip(
+                compact["san_luong_thang"], compact["tien_thang"], compact["tien_sau_thue_thang"]))
+            if kwh is not None
+        }
+        assert decoded == legacy["chi_tiet_cac_thang"]
+        assert _size(compact) < _size(legacy)
+
+    legacy = total_attributes(columns)
+    compact = total_attributes(columns, compact=True)
+    decoded = {
+        f"Nam_{compact['nam_bat_dau'] + i}": {"tong_san_luong_kwh": kwh, "tong_tien_vnd": cost, "tong_tien_sau_thue_vnd": post}
+        for i, (kwh, cost, post) in enumerate(zip(compact["san_luong_nam"], compact["tien_nam"], compact["tien_sau_thue_nam"]))
+        if kwh is not None
+    }
+    assert decoded == legacy["chi_tiet_tung_nam"]
+    assert _size(compact) < _size(legacy)
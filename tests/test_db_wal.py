@@ -0,0 +1,139 @@
+"""Luồng đọc read_only không bị transaction ghi đang mở chặn (WAL)."""
+import sqlite3
+import threading
+import time
+
+from datetime import date, timedelta
+
+import pytest
+
+from electricity_consumption_tracker.billing import rebuild_history
+from electricity_consumption_tracker.db import BUSY_TIMEOUT, connect_db, init_db
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "entry.db")
+    init_db(path)
+    conn = connect_db(path)
+    conn.execute("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (2024, 1, 1, 5.0, 'kWh')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _read_in_thread(db_path):
+    result = {}
+
+    def run():
+        start = time.monotonic()
+        try:
+            conn = connect_db(db_path, read_only=True)
+            try:
+                result["rows"] = conn.execute("SELECT nam, thang, ngay, san_luong FROM daily_values").fetchall()
+            finally:
+                conn.close()
+        except Exception as err:  # noqa: BLE001 - trả lỗi về luồng test
+            result["error"] = err
+        result["elapsed"] = time.monotonic() - start
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(BUSY_TIMEOUT * 2)
+    assert not thread.is_alive()
+    return result
+
+
+def test_journal_mode_is_wal(db_path):
+    conn = connect_db(db_path, read_only=True)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        conn.close()
+
+
+def test_read_only_reader_not_blocked_by_open_write(db_path):
+    writer = connect_db(db_path)
+    try:
+        # EXCLUSIVE chặn mọi luồng đọc ở chế độ rollback journal, nhưng không chặn ở WAL
+        writer.execute("BEGIN EXCLUSIVE")
+        writer.execute("UPDATE daily_usage SET san_luong = 9.0 WHERE nam = 2024 AND thang = 1 AND ngay = 1")
+        writer.execute("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (2024, 1, 2, 3.0, 'kWh')")
+
+        result = _read_in_thread(db_path)
+
+        assert "error" not in result, result.get("error")
+        # Không phải chờ busy timeout và chỉ thấy dữ liệu đã commit
+        assert result["elapsed"] < BUSY_TIMEOUT / 2
+        assert result["rows"] == [(2024, 1, 1, 5.0)]
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_read_only_connection_rejects_writes(db_path):
+    conn = connect_db(db_path, read_only=True)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM daily_usage")
+    finally:
+        conn.close()
+
+
+def _bills(path):
+    conn = connect_db(path, read_only=True)
+    try:
+        return conn.execute("SELECT nam, thang, tong_san_luong, ngay_bat_dau FROM monthly_bill ORDER BY nam, thang").fetchall()
+    finally:
+        conn.close()
+
+
+def test_reader_not_blocked_by_threaded_rebuild(tmp_path):
+    # Ba năm dữ liệu, đã tính kỳ với ngày chốt số 1
+    path = str(tmp_path / "history.db")
+    init_db(path)
+    conn = connect_db(path)
+    first = date(2022, 1, 1)
+    conn.executemany(
+        "INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, ?, 'kWh')",
+        [(d.year, d.month, d.day, 4.0 + d.day % 5) for d in (first + timedelta(days=n) for n in range(3 * 365))],
+    )
+    conn.commit()
+    conn.close()
+    rebuild_history(path, 1, "2022-01-01", full=True)
+    before = _bills(path)
+
+    # Đổi ngày chốt số sang 15 và dừng rebuild giữa chừng (transaction ghi đang mở) ở lần báo tiến độ đầu
+    paused, resume = threading.Event(), threading.Event()
+    outcome = {}
+
+    def progress(done, total):
+        if not paused.is_set():
+            paused.set()
+            resume.wait(BUSY_TIMEOUT * 2)
+
+    def run():
+        try:
+            outcome["periods"] = rebuild_history(path, 15, "2022-01-01", full=True, progress=progress)
+        except Exception as err:  # noqa: BLE001 - trả lỗi về luồng test
+            outcome["error"] = err
+
+    rebuild = threading.Thread(target=run)
+    rebuild.start()
+    try:
+        assert paused.wait(BUSY_TIMEOUT * 2)
+        start = time.monotonic()
+        during = _bills(path)
+        elapsed = time.monotonic() - start
+        assert rebuild.is_alive()
+    finally:
+        resume.set()
+        rebuild.join(BUSY_TIMEOUT * 2)
+
+    assert "error" not in outcome, outcome.get("error")
+    # Đọc xong ngay, thấy trọn bản đã commit trước rebuild
+    assert elapsed < BUSY_TIMEOUT / 2
+    assert during == before
+    after = _bills(path)
+    assert after != before
+    assert after[1][3] == "2022-01-15"
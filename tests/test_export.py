@@ -0,0 +1,112 @@
+"""Export/backup không để lại file tạm (-wal/-shm của bản chụp) trong thư mục đích."""
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from electricity_consumption_tracker import export
+from electricity_consumption_tracker.db import connect_db, init_db
+from electricity_consumption_tracker.export import backup_db, export_entry
+
+
+def _live_db(tmp_path):
+    """DB đang mở bởi một kết nối ghi (có -wal chưa checkpoint), như lúc HA đang chạy."""
+    path = str(tmp_path / "live.db")
+    init_db(path)
+    conn = connect_db(path)
+    conn.executemany(
+        "INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (2025, 3, ?, ?, 'kWh')",
+        [(d, d * 0.5) for d in range(1, 11)],
+    )
+    conn.commit()
+    return path, conn
+
+
+def test_export_leaves_only_output_files(tmp_path):
+    path, writer = _live_db(tmp_path)
+    out_dir = tmp_path / "export"
+    try:
+        results = export_entry(path, str(out_dir), "abc")
+    finally:
+        writer.close()
+
+    assert sorted(os.listdir(out_dir)) == sorted(os.path.basename(p) for p, _ in results)
+    # EXPORT_TABLES bắt đầu bằng daily_usage
+    assert results[0][1] == 10
+
+
+def test_backup_is_single_file(tmp_path):
+    path, writer = _live_db(tmp_path)
+    out_dir = tmp_path / "backup"
+    out_dir.mkdir()
+    out_path = str(out_dir / "copy.db")
+    try:
+        size = backup_db(path, out_path)
+    finally:
+        writer.close()
+
+    assert os.listdir(out_dir) == ["copy.db"]
+    assert size == os.path.getsize(out_path)
+    conn = sqlite3.connect(out_path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert conn.execute("SELECT COUNT(*) FROM daily_usage").fetchone()[0] == 10
+    finally:
+        conn.close()
+
+
+def test_backup_during_writes_is_a_committed_state(tmp_path, monkeypatch):
+    # Mỗi bước chép 1 trang để các lần ghi chắc chắn xen giữa các bước
+    monkeypatch.setattr(export, "BACKUP_PAGES", 1)
+    monkeypatch.setattr(export, "BACKUP_SLEEP", 0.001)
+    path = str(tmp_path / "busy.db")
+    init_db(path)
+    conn = connect_db(path)
+    first = date(2020, 1, 1)
+    conn.executemany("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, 2.0, 'kWh')",
+                     [(d.year, d.month, d.day) for d in (first + timedelta(days=n) for n in range(20000))])
+    conn.execute("INSERT INTO total_usage (tong_san_luong, don_vi) VALUES (40000.0, 'kWh')")
+    conn.commit()
+    conn.close()
+
+    out_path = str(tmp_path / "busy-backup.db")
+    commits = []
+
+    def write():
+        # Bắt đầu ghi khi bản chụp đã mở file .part (đang chép dở)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(out_path + ".part") and time.monotonic() < deadline: time.sleep(0.0005)
+        # Mỗi transaction thêm một ngày và cộng vào tổng: bản chụp hợp lệ luôn có tổng = SUM(daily_usage)
+        writer = connect_db(path)
+        try:
+            for n in range(20000, 20060):
+                d = first + timedelta(days=n)
+                writer.execute("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, 3.0, 'kWh')",
+                               (d.year, d.month, d.day))
+                writer.execute("UPDATE total_usage SET tong_san_luong = tong_san_luong + 3.0")
+                writer.commit()
+                commits.append(time.monotonic())
+                time.sleep(0.001)
+        finally:
+            writer.close()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        backup_db(path, out_path)
+        finished = time.monotonic()
+    finally:
+        thread.join(30)
+    assert not thread.is_alive()
+    # Các bước chép không chặn luồng ghi
+    assert commits and commits[0] < finished
+
+    copy = sqlite3.connect(out_path)
+    try:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        rows, total_days = copy.execute("SELECT COUNT(*), SUM(san_luong) FROM daily_usage").fetchone()
+        assert 20000 <= rows <= 20060
+        assert copy.execute("SELECT tong_san_luong FROM total_usage").fetchone()[0] == total_days
+    finally:
+        copy.close()
@@ -0,0 +1,54 @@
+"""find_missing_days: chỉ các ngày trống trong cửa sổ nhìn lại, không trước ngày đầu tiên có dữ liệu."""
+from datetime import date
+
+import pytest
+
+from electricity_consumption_tracker.billing import find_missing_days
+from electricity_consumption_tracker.db import compact_db, connect_db, init_db
+
+
+@pytest.fixture
+def cursor(tmp_path):
+    path = str(tmp_path / "gaps.db")
+    init_db(path)
+    conn = connect_db(path)
+    yield conn.cursor()
+    conn.close()
+
+
+def _insert(cursor, *days):
+    cursor.executemany("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, 1.0, 'kWh')",
+                       [(d.year, d.month, d.day) for d in days])
+
+
+def test_empty_database_has_nothing_to_backfill(cursor):
+    assert find_missing_days(cursor, date(2026, 3, 1)) == []
+
+
+def test_gaps_start_at_first_recorded_day(cursor):
+    # Bắt đầu dùng ngày 25/02: các ngày trước đó không phải là "thiếu"
+    _insert(cursor, date(2026, 2, 25), date(2026, 2, 27), date(2026, 3, 1))
+    assert find_missing_days(cursor, date(2026, 3, 2)) == [date(2026, 2, 26), date(2026, 2, 28), date(2026, 3, 2)]
+
+
+def test_lookback_limits_old_gaps_across_year_boundary(cursor):
+    _insert(cursor, date(2025, 11, 1), date(2025, 12, 30), date(2026, 1, 2))
+    missing = find_missing_days(cursor, date(2026, 1, 3), lookback_days=5)
+    assert missing == [date(2025, 12, 31), date(2026, 1, 1), date(2026, 1, 3)]
+
+
+def test_archived_days_are_not_reported_missing(tmp_path):
+    # Tháng 12/2025 đã nén vào daily_archive (thiếu ngày 29): chỉ ngày 29 và hôm nay là trống
+    path = str(tmp_path / "archived.db")
+    init_db(path)
+    conn = connect_db(path)
+    _insert(conn.cursor(), *(date(2025, 12, d) for d in range(1, 32) if d != 29), date(2026, 1, 1), date(2026, 1, 2))
+    conn.commit()
+    conn.close()
+    compact_db(path, 2026)
+
+    conn = connect_db(path, read_only=True)
+    try:
+        assert find_missing_days(conn.cursor(), date(2026, 1, 3), lookback_days=7) == [date(2025, 12, 29), date(2026, 1, 3)]
+    finally:
+        conn.close()
@@ -0,0 +1,77 @@
+"""Các giờ đã lưu luôn cộng lại bằng sản lượng ngày sau khi ngày bị ghi đè."""
+import sqlite3
+from datetime import date
+
+import pytest
+
+from electricity_consumption_tracker.db import connect_db, init_db
+from electricity_consumption_tracker.hourly import reconcile_hours, record_hour
+from electricity_consumption_tracker.importer import import_pyscript_db
+
+DAY = date(2026, 5, 4)
+
+
+@pytest.fixture
+def cursor(tmp_path):
+    path = str(tmp_path / "entry.db")
+    init_db(path)
+    conn = connect_db(path)
+    cursor = conn.cursor()
+    # Chỉ số lũy kế trong ngày đọc lúc 7h, 12h, 19h
+    for hour, day_kwh in ((7, 2.0), (12, 5.0), (19, 8.0)):
+        record_hour(cursor, DAY, hour, day_kwh)
+    yield cursor
+    conn.close()
+
+
+def _hours(cursor):
+    cursor.execute("SELECT gio, san_luong FROM hourly_usage WHERE nam = ? AND thang = ? AND ngay = ? ORDER BY gio",
+                   (DAY.year, DAY.month, DAY.day))
+    return cursor.fetchall()
+
+
+def test_override_rescales_hours(cursor):
+    assert reconcile_hours(cursor, DAY, 4.0) == 3
+    hours = _hours(cursor)
+    assert [h for h, _ in hours] == [7, 12, 19]
+    assert [kwh for _, kwh in hours] == pytest.approx([1.0, 1.5, 1.5])
+
+
+def test_matching_total_is_left_alone(cursor):
+    assert reconcile_hours(cursor, DAY, 8.0) == 0
+    assert [kwh for _, kwh in _hours(cursor)] == pytest.approx([2.0, 3.0, 3.0])
+
+
+@pytest.mark.parametrize("day_kwh", [None, -1.0])
+def test_removed_or_negative_day_drops_hours(cursor, day_kwh):
+    reconcile_hours(cursor, DAY, day_kwh)
+    assert _hours(cursor) == []
+
+
+@pytest.mark.parametrize("hourly, expected", [(True, 4.0), (False, 8.0)])
+def test_pyscript_import_overwrite_reconciles_hours_only_when_enabled(tmp_path, hourly, expected):
+    # Entry đã có ngày DAY = 8 kWh kèm các giờ; file pyscript ghi đè ngày đó thành 4 kWh
+    path = str(tmp_path / "entry.db")
+    init_db(path)
+    conn = connect_db(path)
+    for hour, day_kwh in ((7, 2.0), (12, 5.0), (19, 8.0)):
+        record_hour(conn.cursor(), DAY, hour, day_kwh)
+    conn.execute("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, 8.0, 'kWh')",
+                 (DAY.year, DAY.month, DAY.day))
+    conn.commit()
+    conn.close()
+
+    source = str(tmp_path / "pyscript.db")
+    src = sqlite3.connect(source)
+    src.execute("CREATE TABLE daily_usage (nam INTEGER, thang INTEGER, ngay INTEGER, san_luong REAL, don_vi TEXT)")
+    src.execute("INSERT INTO daily_usage VALUES (?, ?, ?, 4.0, 'kWh')", (DAY.year, DAY.month, DAY.day))
+    src.commit()
+    src.close()
+
+    import_pyscript_db(path, source, 1, "2026-01-01", overwrite=True, hourly=hourly)
+
+    conn = connect_db(path, read_only=True)
+    try:
+        assert sum(kwh for _, kwh in _hours(conn.cursor())) == pytest.approx(expected)
+    finally:
+        conn.close()
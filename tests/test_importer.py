@@ -0,0 +1,104 @@
+"""Nhập DB pyscript: chạy lại cho cùng kết quả, không ghi đè ngày đã có trừ khi overwrite=True."""
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from electricity_consumption_tracker.billing import rebuild_history
+from electricity_consumption_tracker.db import connect_db, init_db
+from electricity_consumption_tracker.importer import import_pyscript_db
+
+BILLING_DAY = 20
+APPLY = "2024-01-01"
+SUMMARY_TABLES = ("daily_usage", "monthly_bill", "yearly_bill", "total_usage")
+
+
+@pytest.fixture
+def source(tmp_path):
+    """DB theo schema cũ của pyscript: chỉ có daily_usage theo tháng dương lịch, không có cột kỳ."""
+    path = str(tmp_path / "tongou_tong_electricity_data.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE daily_usage (
+            nam INTEGER, thang INTEGER, ngay INTEGER, san_luong REAL, don_vi TEXT, PRIMARY KEY (nam, thang, ngay)
+        )
+    """)
+    first = date(2024, 10, 1)
+    days = [first + timedelta(days=n) for n in range(150)]
+    conn.executemany("INSERT INTO daily_usage VALUES (?, ?, ?, ?, 'kWh')",
+                     [(d.year, d.month, d.day, 5 + d.day % 6 * 0.5) for d in days])
+    # Ngày pyscript chưa kịp ghi số: bị bỏ qua
+    conn.execute("UPDATE daily_usage SET san_luong = NULL WHERE nam = 2024 AND thang = 12 AND ngay = 24")
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def target(tmp_path):
+    path = str(tmp_path / "entry.db")
+    init_db(path)
+    return path
+
+
+def _snapshot(path):
+    conn = connect_db(path, read_only=True)
+    try:
+        return {t: conn.execute(f"SELECT * FROM {t} ORDER BY 1, 2").fetchall() for t in SUMMARY_TABLES}
+    finally:
+        conn.close()
+
+
+def _day(path, d):
+    conn = connect_db(path, read_only=True)
+    try:
+        return conn.execute("SELECT san_luong FROM daily_usage WHERE nam = ? AND thang = ? AND ngay = ?",
+                            (d.year, d.month, d.day)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_second_import_changes_nothing(source, target):
+    first = import_pyscript_db(target, source, BILLING_DAY, APPLY)
+    snapshot = _snapshot(target)
+
+    second = import_pyscript_db(target, source, BILLING_DAY, APPLY)
+
+    assert first == second
+    assert first["rows"] == 149 and first["first"] == "2024-10-01" and first["last"] == "2025-02-27"
+    assert _snapshot(target) == snapshot
+    # Kết quả giống hệt tính lại toàn bộ từ daily_usage
+    rebuild_history(target, BILLING_DAY, APPLY, full=True)
+    assert _snapshot(target) == snapshot
+
+
+def test_existing_days_kept_unless_overwrite(source, target):
+    day = date(2025, 1, 5)
+    conn = connect_db(target)
+    conn.execute("INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, 42.0, 'kWh')",
+                 (day.year, day.month, day.day))
+    conn.commit()
+    conn.close()
+
+    import_pyscript_db(target, source, BILLING_DAY, APPLY)
+    kept = _snapshot(target)
+    assert _day(target, day) == 42.0
+
+    import_pyscript_db(target, source, BILLING_DAY, APPLY, overwrite=True)
+    assert _day(target, day) != 42.0
+    overwritten = _snapshot(target)
+    assert overwritten["total_usage"][0][0] == pytest.approx(kept["total_usage"][0][0] - 42.0 + _day(target, day))
+
+    import_pyscript_db(target, source, BILLING_DAY, APPLY, overwrite=True)
+    assert _snapshot(target) == overwritten
+
+
+def test_source_without_usage_column_is_rejected(tmp_path, target):
+    path = str(tmp_path / "other.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE daily_usage (nam INTEGER, thang INTEGER, ngay INTEGER)")
+    conn.close()
+
+    with pytest.raises(ValueError, match="san_luong"):
+        import_pyscript_db(target, path, BILLING_DAY, APPLY)
+    assert _snapshot(target)["daily_usage"] == []
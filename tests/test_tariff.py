@@ -0,0 +1,50 @@
+"""Mốc giá 2023 và việc sửa file tariffs.json do bản trước tạo tự động."""
+import json
+
+import pytest
+
+from electricity_consumption_tracker.const import PRICE_HISTORY, VAT_HISTORY
+from electricity_consumption_tracker.tariff import TariffTables, TieredResidentialTariff, upgrade_tariff_file
+
+
+@pytest.mark.parametrize("year, month, first_tier_price", [
+    (2023, 4, 1678),   # trước 04/05/2023
+    (2023, 6, 1728),   # 04/05/2023 - 08/11/2023
+    (2023, 12, 1806),  # từ 09/11/2023
+    (2024, 11, 1893),
+])
+def test_2023_price_steps(year, month, first_tier_price):
+    assert TieredResidentialTariff().price(10, year, month) == 10 * first_tier_price
+
+
+def _legacy_file(path, **extra):
+    """Ghi file như bản trước: mốc 2023-05-04 mang bảng giá của 09/11/2023, không có mốc 2023-11-09."""
+    data = TariffTables(PRICE_HISTORY, {}, VAT_HISTORY).as_json()
+    data["price_history"]["2023-05-04"] = data["price_history"].pop("2023-11-09")
+    data.update(extra)
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return data
+
+
+def test_upgrade_generated_file_keeps_vat(tmp_path):
+    path = tmp_path / "tariffs.json"
+    _legacy_file(path, vat_history={"2019-01-01": 0.1})
+
+    assert upgrade_tariff_file(str(path)) is True
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["price_history"]["2023-05-04"][0] == [50, 1728]
+    assert data["price_history"]["2023-11-09"][0] == [50, 1806]
+    assert data["vat_history"] == {"2019-01-01": 0.1}
+    # Lần sau không còn gì để sửa
+    assert upgrade_tariff_file(str(path)) is False
+
+
+def test_edited_file_left_alone(tmp_path):
+    path = tmp_path / "tariffs.json"
+    data = _legacy_file(path)
+    data["price_history"]["2026-01-01"] = [[None, 4000]]
+    path.write_text(json.dumps(data), encoding="utf-8")
+    before = path.read_text(encoding="utf-8")
+
+    assert upgrade_tariff_file(str(path)) is False
+    assert path.read_text(encoding="utf-8") == before
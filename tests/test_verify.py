@@ -0,0 +1,105 @@
+"""verify_db: so checksum từng kỳ và chỉ sửa những kỳ/năm/tổng bị lệch."""
+from datetime import date, timedelta
+
+from electricity_consumption_tracker.billing import get_billing_period, rebuild_history, verify_db
+from electricity_consumption_tracker.db import compact_db, connect_db, init_db
+
+BILLING_DAY = 15
+APPLY = "2023-01-01"
+
+
+def _history(path, first, last, compact_before=None):
+    """Các ngày từ first đến last (giá trị thay đổi theo ngày), đã tính kỳ; tùy chọn nén các năm < compact_before."""
+    init_db(path)
+    conn = connect_db(path)
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+    conn.executemany(
+        "INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi) VALUES (?, ?, ?, ?, 'kWh')",
+        [(d.year, d.month, d.day, round(3 + (d.toordinal() % 11) * 0.37, 2)) for d in days],
+    )
+    conn.commit()
+    conn.close()
+    rebuild_history(path, BILLING_DAY, APPLY, full=True)
+    if compact_before is not None: compact_db(path, compact_before)
+
+
+def _execute(path, sql, params=()):
+    conn = connect_db(path)
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _bill(path, ky):
+    conn = connect_db(path, read_only=True)
+    try:
+        return conn.execute("SELECT tong_san_luong, checksum FROM monthly_bill WHERE nam = ? AND thang = ?", ky).fetchone()
+    finally:
+        conn.close()
+
+
+def test_clean_history_with_archived_years_needs_no_repair(tmp_path):
+    path = str(tmp_path / "archived.db")
+    _history(path, date(2023, 1, 1), date(2025, 6, 30), compact_before=2025)
+
+    report = verify_db(path, BILLING_DAY, APPLY)
+
+    assert report["periods_checked"] > 20
+    assert report["periods_repaired"] == []
+    assert report["periods_backfilled"] == 0
+    assert report["years_repaired"] == []
+    assert report["total_repaired"] is False
+
+
+def test_swapped_days_with_same_total_are_caught_by_checksum(tmp_path):
+    path = str(tmp_path / "swap.db")
+    _history(path, date(2024, 3, 1), date(2024, 8, 31))
+    # Hai ngày cùng kỳ 05/2024 (15/04 - 14/05) đổi giá trị cho nhau: tổng và số ngày không đổi, chỉ checksum đổi
+    conn = connect_db(path)
+    a, b = (conn.execute("SELECT san_luong FROM daily_usage WHERE nam = 2024 AND thang = 5 AND ngay = ?", (n,)).fetchone()[0]
+            for n in (2, 3))
+    assert a != b
+    conn.executemany("UPDATE daily_usage SET san_luong = ? WHERE nam = 2024 AND thang = 5 AND ngay = ?", [(b, 2), (a, 3)])
+    conn.commit()
+    conn.close()
+    kwh_before, checksum_before = _bill(path, (2024, 5))
+
+    report = verify_db(path, BILLING_DAY, APPLY)
+
+    assert report["periods_repaired"] == ["05/2024"]
+    assert report["years_repaired"] == [2024]
+    kwh_after, checksum_after = _bill(path, (2024, 5))
+    assert kwh_after == kwh_before and checksum_after != checksum_before
+    assert verify_db(path, BILLING_DAY, APPLY)["periods_repaired"] == []
+
+
+def test_override_of_archived_day_repairs_period_year_and_total(tmp_path):
+    path = str(tmp_path / "override.db")
+    _history(path, date(2023, 6, 1), date(2025, 2, 28), compact_before=2024)
+    # Ghi đè thẳng một ngày của năm đã nén (dòng nóng thắng bản nén) mà không tính lại kỳ
+    day = date(2023, 9, 20)
+    ky = get_billing_period(day, BILLING_DAY, date.fromisoformat(APPLY))
+    _execute(path, """
+        INSERT INTO daily_usage (nam, thang, ngay, san_luong, don_vi, ky_nam, ky_thang) VALUES (?, ?, ?, 50.0, 'kWh', ?, ?)
+    """, (day.year, day.month, day.day, *ky))
+
+    report = verify_db(path, BILLING_DAY, APPLY)
+
+    assert report["periods_repaired"] == [f"{ky[1]:02d}/{ky[0]}"]
+    assert report["years_repaired"] == [ky[0]]
+    assert report["total_repaired"] is True
+    assert verify_db(path, BILLING_DAY, APPLY)["periods_repaired"] == []
+
+
+def test_rows_without_checksum_are_backfilled_not_repriced(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    _history(path, date(2024, 1, 1), date(2024, 4, 30))
+    _execute(path, "UPDATE monthly_bill SET checksum = NULL")
+
+    report = verify_db(path, BILLING_DAY, APPLY)
+
+    assert report["periods_repaired"] == []
+    assert report["periods_backfilled"] == report["periods_checked"]
+    assert all(_bill(path, (2024, m))[1] is not None for m in (2, 3, 4))
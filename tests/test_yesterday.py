@@ -0,0 +1,51 @@
+"""Nguồn "hôm qua": ngày của số đọc theo lúc nhận, bỏ số lặp, nhớ (ngày, kWh) đã ghi."""
+from datetime import date
+
+import pytest
+
+from electricity_consumption_tracker.yesterday import YesterdayReadings, parse_kwh
+
+
+@pytest.mark.parametrize("value, expected", [("12.5", 12.5), ("0", 0.0), ("unknown", None), ("unavailable", None),
+                                             ("", None), ("n/a", None), (None, None)])
+def test_parse_kwh(value, expected):
+    assert parse_kwh(value) == expected
+
+
+def test_reading_belongs_to_the_day_before_it_arrives():
+    readings = YesterdayReadings()
+
+    assert readings.reading("8.4", date(2026, 3, 2)) == (date(2026, 3, 1), 8.4)
+    assert readings.reading("9.1", date(2026, 3, 3)) == (date(2026, 3, 2), 9.1)
+    # Qua ranh giới năm
+    assert readings.reading("7.7", date(2027, 1, 1)) == (date(2026, 12, 31), 7.7)
+
+
+def test_startup_state_is_only_a_baseline():
+    readings = YesterdayReadings()
+    readings.seed("6.0")
+
+    # Sau khởi động sensor báo lại đúng số cũ: không biết thuộc ngày nào, bỏ qua
+    assert readings.reading("6.0", date(2026, 5, 10)) is None
+    assert readings.reading("6.5", date(2026, 5, 10)) == (date(2026, 5, 9), 6.5)
+
+
+def test_unavailable_gap_and_repeats_are_skipped():
+    readings = YesterdayReadings()
+    assert readings.reading("5.0", date(2026, 5, 10)) == (date(2026, 5, 9), 5.0)
+
+    # Chỉ đổi attribute (cùng state), mất kết nối rồi về lại đúng số cũ
+    for value in ("5.0", "unavailable", None, "5.0"):
+        assert readings.reading(value, date(2026, 5, 10)) is None
+    assert readings.last_kwh == 5.0
+    assert readings.reading("5.2", date(2026, 5, 11)) == (date(2026, 5, 10), 5.2)
+
+
+def test_done_is_per_day():
+    readings = YesterdayReadings()
+    readings.done(date(2026, 5, 9), 5.0)
+
+    assert readings.is_done(date(2026, 5, 9), 5.0)
+    # Hai ngày liên tiếp cùng sản lượng vẫn phải ghi, và sửa số của cùng ngày cũng vậy
+    assert not readings.is_done(date(2026, 5, 10), 5.0)
+    assert not readings.is_done(date(2026, 5, 9), 5.3)